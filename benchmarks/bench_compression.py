@@ -0,0 +1,161 @@
+"""
+Benchmark gzip compression of FHIR payloads.
+
+By default, this uses synthetic payloads shaped like the two cases that
+matter most: large search pages (responses) and transaction Bundles (request
+bodies). For each payload and compression level, it reports the compressed
+size, the time to compress and decompress and the estimated transfer time
+over a few link speeds, with and without compression.
+
+If --host is provided (along with a fhir_hosts file in the cwd), each --query
+is also fetched from the server with and without compressed responses.
+
+    python benchmarks/bench_compression.py
+    python benchmarks/bench_compression.py --host dev -q "Observation?_count=1000"
+"""
+import gzip
+import sys
+from argparse import ArgumentParser
+from json import dumps
+from time import perf_counter
+
+from rich.console import Console
+from rich.table import Table
+
+# Megabits per second
+link_speeds = [10, 100, 1000]
+
+
+def observation(i):
+    return {
+        "resourceType": "Observation",
+        "id": f"obs-{i}",
+        "meta": {"profile": ["https://nih-ncpi.github.io/ncpi-fhir-ig/StructureDefinition/phenotype"]},
+        "identifier": [{"system": "https://example.org/study/observation", "value": f"obs-{i}"}],
+        "status": "final",
+        "code": {
+            "coding": [
+                {"system": "http://purl.obolibrary.org/obo/hp.owl", "code": f"HP:{i % 9000:07}", "display": "Phenotype"}
+            ]
+        },
+        "subject": {"reference": f"Patient/pt-{i % 2000}"},
+        "valueCodeableConcept": {
+            "coding": [{"system": "http://snomed.info/sct", "code": "52101004", "display": "Present"}]
+        },
+    }
+
+
+def search_page(count):
+    return {
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "total": count,
+        "entry": [{"fullUrl": f"https://example.org/fhir/Observation/obs-{i}", "resource": observation(i), "search": {"mode": "match"}} for i in range(count)],
+    }
+
+
+def transaction(count):
+    return {
+        "resourceType": "Bundle",
+        "type": "transaction",
+        "entry": [
+            {"resource": observation(i), "request": {"method": "PUT", "url": f"Observation/obs-{i}"}}
+            for i in range(count)
+        ],
+    }
+
+
+def timed(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        result = fn()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def transfer_time(size, mbps):
+    return size * 8 / (mbps * 1000000)
+
+
+def bench_payloads(console, payloads, levels):
+    table = Table(title="gzip compression of FHIR payloads")
+    table.add_column("Payload", style="cyan")
+    table.add_column("Level", justify="right")
+    table.add_column("Raw", justify="right")
+    table.add_column("Compressed", justify="right", style="yellow")
+    table.add_column("Ratio", justify="right")
+    table.add_column("Compress (ms)", justify="right")
+    table.add_column("Decompress (ms)", justify="right")
+    for mbps in link_speeds:
+        table.add_column(f"{mbps} Mbps raw/gz (ms)", justify="right")
+
+    for name, payload in payloads:
+        body = dumps(payload).encode("utf-8")
+        for level in levels:
+            compressed, compress_time = timed(lambda: gzip.compress(body, compresslevel=level))
+            _, decompress_time = timed(lambda: gzip.decompress(compressed))
+            row = [
+                name,
+                str(level),
+                f"{len(body):,}",
+                f"{len(compressed):,}",
+                f"{len(body) / len(compressed):.1f}x",
+                f"{compress_time * 1000:.1f}",
+                f"{decompress_time * 1000:.1f}",
+            ]
+            for mbps in link_speeds:
+                raw = transfer_time(len(body), mbps) * 1000
+                gz = (transfer_time(len(compressed), mbps) + compress_time + decompress_time) * 1000
+                row.append(f"{raw:.0f} / {gz:.0f}")
+            table.add_row(*row)
+    console.print(table)
+
+
+def bench_host(console, host, queries):
+    from ncpi_fhir_client.fhir_client import FhirClient
+    from ncpi_fhir_client.host_config import get_host_config
+
+    cfg = dict(get_host_config()[host])
+
+    table = Table(title=f"Response compression: {host}")
+    table.add_column("Query", style="cyan")
+    table.add_column("Accept-Encoding")
+    table.add_column("Bytes on the wire", justify="right", style="yellow")
+    table.add_column("Time (ms)", justify="right")
+
+    for responses in [False, True]:
+        cfg["compression"] = dict(cfg.get("compression") or {}, responses=responses)
+        client = FhirClient(cfg)
+        for query in queries:
+            start = perf_counter()
+            result = client.get(query, recurse=False, raw_result=True)
+            elapsed = perf_counter() - start
+            wire_size = result["response_headers"].get("Content-Length", result["response_bytes"])
+            table.add_row(query, "gzip" if responses else "identity", f"{int(wire_size):,}", f"{elapsed * 1000:.0f}")
+    console.print(table)
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark compression of FHIR request and response bodies")
+    parser.add_argument("--host", help="fhir_hosts entry to fetch --query from (optional)")
+    parser.add_argument("-q", "--query", action="append", default=[], help="Query to fetch from --host")
+    parser.add_argument("--level", type=int, action="append", help="gzip level(s) to test (default 1, 6 and 9)")
+    args = parser.parse_args(sys.argv[1:])
+
+    console = Console()
+    payloads = [
+        ("search page (200)", search_page(200)),
+        ("search page (1000)", search_page(1000)),
+        ("transaction (1000)", transaction(1000)),
+        ("transaction (10000)", transaction(10000)),
+    ]
+    bench_payloads(console, payloads, args.level or [1, 6, 9])
+
+    if args.host is not None:
+        bench_host(console, args.host, args.query or ["Observation?_count=1000"])
+
+
+if __name__ == "__main__":
+    main()
@@ -48,6 +48,27 @@ def report_exception(ex: BaseException, msg: str) -> NoReturn:
     sys.exit(1)
 
 
+def retry_strategy(
+    total: int = 10,
+    read: int = 10,
+    connect: int = 1,
+    status: int = 10,
+    backoff_factor: float = 5,
+    status_forcelist: tuple[int, ...] = (500, 502, 503, 504),
+    retry_class: type[Retry] = Retry,
+) -> Retry:
+    """The urllib3.Retry used by requests_retry_session, see it for details on the kwargs"""
+    return retry_class(
+        total=total,
+        read=read,
+        connect=connect,
+        status=status,
+        backoff_factor=backoff_factor,
+        status_forcelist=status_forcelist,
+        allowed_methods=False,
+    )
+
+
 # Stolen from KF FHIR Utility:
 def requests_retry_session(
     session: requests.Session | None = None,
@@ -57,6 +78,7 @@ def requests_retry_session(
     status: int = 10,
     backoff_factor: int = 5,
     status_forcelist: tuple[int, ...] = (500, 502, 503, 504),
+    adapter: HTTPAdapter | None = None,
 ) -> requests.Session:
     """
     Send an http request and retry on failures or redirects
@@ -72,18 +94,21 @@ def requests_retry_session(
     `status_forcelist`
     :param backoff_factor: affects sleep time between retries
     :param status_forcelist: list of HTTP status codes that force retry
+    :param adapter: mount this adapter (with its own retries) rather than
+    building a new one. Used to share connection pools across sessions
     """
     session = session or requests.Session()
 
-    retry = Retry(
-        total=total,
-        read=read,
-        connect=connect,
-        backoff_factor=backoff_factor,
-        status_forcelist=status_forcelist,
-        allowed_methods=False,
-    )
-    adapter = HTTPAdapter(max_retries=retry)
+    if adapter is None:
+        retry = retry_strategy(
+            total=total,
+            read=read,
+            connect=connect,
+            status=status,
+            backoff_factor=backoff_factor,
+            status_forcelist=status_forcelist,
+        )
+        adapter = HTTPAdapter(max_retries=retry)
     session.mount("http://", adapter)
     session.mount("https://", adapter)
 
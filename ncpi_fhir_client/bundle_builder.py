@@ -0,0 +1,259 @@
+"""
+Build transaction bundles from a collection of resources, so that a whole
+study can be loaded in a handful of transactions rather than one ordered
+POST at a time.
+
+Each resource is given a fullUrl and a request:
+
+  * Resources whose id on the server is already known (found in the RIdCache
+    by their first identifier or, with client_ids=True, their own id) are
+    PUT to Type/id.
+  * Everything else is POSTed with a urn:uuid fullUrl, leaving the server to
+    assign the id.
+
+References between resources in the input (Type/id or conditional
+Type?identifier=system|value references) are rewritten to point at the
+target's fullUrl (for POSTs) or Type/id (for PUTs), so the server can link
+them up within the transaction.
+
+Large inputs are split into bundles under max_entries and max_bytes. A
+urn:uuid only means something inside its own bundle, so resources linked
+by references to POSTed resources always share a bundle. References to PUT
+resources only require that the target's bundle isn't sent later, so the
+bundles are returned in the order they should be sent. Lots of resources
+referring to a single POSTed resource (such as a ResearchStudy) can
+produce a bundle over the caps, so it is best for those to have known ids.
+"""
+from __future__ import annotations
+
+import logging
+import uuid
+from copy import deepcopy
+from json import dumps
+from typing import Any, Iterable
+
+from ncpi_fhir_client.resource_graph import reference_key
+
+logger = logging.getLogger(__name__)
+
+
+def _identifiers(resource: dict[str, Any]) -> list[dict[str, Any]]:
+    identifiers = resource.get("identifier", [])
+    if not isinstance(identifiers, list):
+        identifiers = [identifiers]
+    return identifiers
+
+
+class BundleBuilder:
+    def __init__(
+        self,
+        base_url: str | None = None,
+        idcache: Any = None,
+        client_ids: bool = False,
+        max_entries: int = 500,
+        max_bytes: int = 8 * 1024 * 1024,
+    ) -> None:
+        """
+        :param base_url: The server's base URL, used for the fullUrl of PUT entries
+        :param idcache: Used to find the server's ids for resources that are already there
+        :type idcache: RIdCache
+        :param client_ids: Treat the resources' own ids as their ids on the server
+        :param max_entries: Most entries a single bundle should contain
+        :param max_bytes: Largest a single bundle should be, once serialized
+        """
+        assert max_entries > 0, "max_entries must be positive"
+        self.base_url = None if base_url is None else base_url.rstrip("/")
+        self.idcache = idcache
+        self.client_ids = client_ids
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.resources: list[dict[str, Any]] = []
+
+    def add(self, resource: dict[str, Any]) -> None:
+        self.resources.append(resource)
+
+    def add_all(self, resources: Iterable[dict[str, Any]]) -> None:
+        for resource in resources:
+            self.add(resource)
+
+    def _server_id(self, resource: dict[str, Any]) -> str | None:
+        if self.idcache is not None:
+            for identifier in _identifiers(resource)[0:1]:
+                if "system" in identifier and "value" in identifier:
+                    found = self.idcache.get_id(identifier["system"], identifier["value"])
+                    if found is not None and found[0] == resource["resourceType"]:
+                        return found[1]
+        if self.client_ids:
+            return resource.get("id")
+        return None
+
+    def bundles(self) -> list[dict[str, Any]]:
+        """Return the transaction bundles, in the order they should be sent"""
+        count = len(self.resources)
+
+        # Where each resource can be found: Type/id and conditional references
+        index: dict[str, int] = {}
+        for position, resource in enumerate(self.resources):
+            resource_type = resource["resourceType"]
+            if "id" in resource:
+                index[f"{resource_type}/{resource['id']}"] = position
+            for identifier in _identifiers(resource):
+                if "system" in identifier and "value" in identifier:
+                    index[
+                        f"{resource_type}?identifier={identifier['system']}|{identifier['value']}"
+                    ] = position
+
+        server_ids = [self._server_id(resource) for resource in self.resources]
+        targets = []
+        for resource, server_id in zip(self.resources, server_ids):
+            if server_id is None:
+                targets.append(f"urn:uuid:{uuid.uuid4()}")
+            else:
+                targets.append(f"{resource['resourceType']}/{server_id}")
+
+        # Resources joined by references to POSTed resources must share a
+        # bundle. References to PUT resources only constrain the order
+        parent = list(range(count))
+
+        def find(node: int) -> int:
+            while parent[node] != node:
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+            return node
+
+        depends_on: list[set[int]] = [set() for _ in range(count)]
+        entries = []
+        for position, resource in enumerate(self.resources):
+            references: set[int] = set()
+            content = self._rewrite(deepcopy(resource), index, targets, references)
+            references.discard(position)
+
+            for target in references:
+                if server_ids[target] is None:
+                    parent[find(position)] = find(target)
+                else:
+                    depends_on[position].add(target)
+
+            server_id = server_ids[position]
+            if server_id is None:
+                content.pop("id", None)
+                entry = {
+                    "fullUrl": targets[position],
+                    "resource": content,
+                    "request": {"method": "POST", "url": resource["resourceType"]},
+                }
+            else:
+                content["id"] = server_id
+                full_url = targets[position]
+                if self.base_url is not None:
+                    full_url = f"{self.base_url}/{full_url}"
+                entry = {
+                    "fullUrl": full_url,
+                    "resource": content,
+                    "request": {"method": "PUT", "url": targets[position]},
+                }
+            entries.append(entry)
+
+        groups: dict[int, list[int]] = {}
+        for position in range(count):
+            groups.setdefault(find(position), []).append(position)
+
+        group_deps: dict[int, set[int]] = {root: set() for root in groups}
+        for position in range(count):
+            for target in depends_on[position]:
+                if find(target) != find(position):
+                    group_deps[find(position)].add(find(target))
+
+        bundles: list[dict[str, Any]] = []
+        current: list[dict[str, Any]] = []
+        current_bytes = 0
+        for component in self._ordered(group_deps):
+            members = [position for root in component for position in groups[root]]
+            sizes = [len(dumps(entries[position])) for position in members]
+            if len(current) > 0 and (
+                len(current) + len(members) > self.max_entries
+                or current_bytes + sum(sizes) > self.max_bytes
+            ):
+                bundles.append(self._bundle(current))
+                current, current_bytes = [], 0
+
+            if len(members) > self.max_entries or sum(sizes) > self.max_bytes:
+                logger.warning(
+                    f"{len(members)} linked resources exceed the bundle limits and will be sent together"
+                )
+            current += [entries[position] for position in sorted(members)]
+            current_bytes += sum(sizes)
+
+        if len(current) > 0:
+            bundles.append(self._bundle(current))
+        return bundles
+
+    def _rewrite(
+        self, content: Any, index: dict[str, int], targets: list[str], references: set[int]
+    ) -> Any:
+        """Point references to resources in the input at their new locations, noting which were found"""
+        if isinstance(content, dict):
+            for key, value in content.items():
+                if key == "reference" and isinstance(value, str):
+                    position = index.get(value)
+                    if position is None:
+                        ref = reference_key(value)
+                        position = None if ref is None else index.get(ref)
+                    if position is not None:
+                        content[key] = targets[position]
+                        references.add(position)
+                else:
+                    self._rewrite(value, index, targets, references)
+        elif isinstance(content, list):
+            for item in content:
+                self._rewrite(item, index, targets, references)
+        return content
+
+    @staticmethod
+    def _ordered(deps: dict[int, set[int]]) -> list[list[int]]:
+        """Group nodes into strongly connected components, dependencies first (Tarjan)"""
+        order: dict[int, int] = {}
+        low: dict[int, int] = {}
+        stack: list[int] = []
+        on_stack: set[int] = set()
+        components: list[list[int]] = []
+
+        for start in deps:
+            if start in order:
+                continue
+            # Iterative, since a long chain of references would blow the recursion limit
+            work = [(start, iter(sorted(deps[start])))]
+            order[start] = low[start] = len(order)
+            stack.append(start)
+            on_stack.add(start)
+            while work:
+                node, children = work[-1]
+                child = next(children, None)
+                if child is not None:
+                    if child not in order:
+                        order[child] = low[child] = len(order)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(sorted(deps[child]))))
+                    elif child in on_stack:
+                        low[node] = min(low[node], order[child])
+                    continue
+
+                work.pop()
+                if work:
+                    low[work[-1][0]] = min(low[work[-1][0]], low[node])
+                if low[node] == order[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+        return components
+
+    @staticmethod
+    def _bundle(entries: list[dict[str, Any]]) -> dict[str, Any]:
+        return {"resourceType": "Bundle", "type": "transaction", "entry": entries}
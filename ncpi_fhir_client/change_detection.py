@@ -0,0 +1,163 @@
+"""
+Content-hash based change detection for the write path.
+
+Each resource is hashed from a canonical serialization (sorted keys, no
+whitespace) that ignores meta, since the server rewrites versionId and
+lastUpdated on every write. If the hash matches the one recorded the last
+time the resource was written (or the hash of the server's current version),
+the write can be skipped.
+
+Hashes are keyed by Type/id, so only writes to a known id (PUTs) can be
+skipped. The store is an append-only TSV file (key<tab>hash), one per host,
+so nothing is lost if a run dies part way through. Later lines win when the
+file is read back and compact() rewrites the file with only the current
+hashes.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+from json import dumps
+from pathlib import Path
+from threading import Lock
+from typing import Any, TextIO
+
+# Elements that are ignored when comparing resource content
+ignored_elements = ["meta"]
+
+
+def canonical_json(resource: dict[str, Any]) -> str:
+    """Serialize a resource such that equivalent content always serializes the same way"""
+    content = {k: v for k, v in resource.items() if k not in ignored_elements}
+    return dumps(content, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def resource_hash(resource: dict[str, Any]) -> str:
+    return hashlib.blake2b(
+        canonical_json(resource).encode("utf-8"), digest_size=16
+    ).hexdigest()
+
+
+class ChangeTracker:
+    def __init__(self, store_path: str | Path | None = None) -> None:
+        """
+        :param store_path: File in which the hashes are persisted. If None, hashes are only kept in memory
+        """
+        self.store_path = None if store_path is None else Path(store_path)
+
+        # Type/id => hash
+        self.hashes: dict[str, str] = {}
+        self.lock = Lock()
+        self._store: TextIO | None = None
+
+        # Just some statistics to let the user know how much was skipped
+        self.unchanged_count = 0
+        self.changed_count = 0
+
+        if self.store_path is not None and self.store_path.is_file():
+            with self.store_path.open("rt") as f:
+                for line in f:
+                    pieces = line.rstrip("\n").split("\t")
+                    # A crash can leave a partial last line behind
+                    if len(pieces) == 2 and len(pieces[1]) == 32:
+                        self.hashes[pieces[0]] = pieces[1]
+
+    @classmethod
+    def for_host(
+        cls, host_desc: str, directory: str | Path = ".change_cache"
+    ) -> ChangeTracker:
+        """Return a tracker whose store is specific to a single host"""
+        return cls(Path(directory) / f"{host_desc}.hashes")
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def is_unchanged(self, resource_type: str, resource: dict[str, Any]) -> bool:
+        """True if resource matches the content last recorded for its Type/id"""
+        if "id" not in resource:
+            return False
+
+        key = f"{resource_type}/{resource['id']}"
+        with self.lock:
+            unchanged = self.hashes.get(key) == resource_hash(resource)
+            if unchanged:
+                self.unchanged_count += 1
+            else:
+                self.changed_count += 1
+        return unchanged
+
+    def record(
+        self,
+        resource_type: str,
+        resource: dict[str, Any],
+        id: str | None = None,
+        persist: bool = True,
+    ) -> None:
+        """Record the content of a resource that is now on the server
+
+        :param id: The id assigned by the server, if the resource didn't have one
+        :param persist: Write the hash to the store as well as keeping it in memory
+        """
+        if id is not None and resource.get("id") != id:
+            resource = dict(resource, id=id)
+        if "id" not in resource:
+            return
+
+        key = f"{resource_type}/{resource['id']}"
+        content_hash = resource_hash(resource)
+        with self.lock:
+            if self.hashes.get(key) == content_hash:
+                return
+            self.hashes[key] = content_hash
+            if persist and self.store_path is not None:
+                if self._store is None:
+                    self.store_path.parent.mkdir(parents=True, exist_ok=True)
+                    self._store = self.store_path.open("at")
+                self._store.write(f"{key}\t{content_hash}\n")
+                self._store.flush()
+
+    def prime_from_server(
+        self,
+        fhir_client: Any,
+        resource_type: str,
+        ids: list[str],
+        chunk_size: int = 100,
+    ) -> None:
+        """Hash the server's current version of resources, fetched in bulk
+
+        This is useful when there is no store from a previous run (or the
+        store can't be trusted), trading a handful of searches for the
+        writes that would otherwise be sent.
+
+        :param fhir_client: client used to fetch the resources
+        :type fhir_client: FhirClient
+        """
+        for start in range(0, len(ids), chunk_size):
+            chunk = ",".join(ids[start : start + chunk_size])
+            for page in fhir_client.iter_pages(f"{resource_type}?_id={chunk}"):
+                for entry in page.entries:
+                    resource = entry.get("resource", {})
+                    if resource.get("resourceType") == resource_type:
+                        self.record(resource_type, resource, persist=False)
+
+    def compact(self) -> None:
+        """Rewrite the store so that it contains a single line per resource"""
+        if self.store_path is None:
+            return
+
+        with self.lock:
+            if self._store is not None:
+                self._store.close()
+                self._store = None
+            self.store_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.store_path.with_suffix(".tmp")
+            with tmp_path.open("wt") as f:
+                for key, content_hash in self.hashes.items():
+                    f.write(f"{key}\t{content_hash}\n")
+            os.replace(tmp_path, self.store_path)
+
+    def close(self) -> None:
+        with self.lock:
+            if self._store is not None:
+                self._store.close()
+                self._store = None
@@ -0,0 +1,220 @@
+"""
+Checkpoints that let a long paginated search pick up where it left off.
+
+After each page is handled, the checkpoint file records the page's next
+link along with how many pages (and entries) have been seen. If the run
+dies, the next run with the same checkpoint resumes from that link rather
+than from the first page.
+
+Some servers expire their paging cursors, so a saved next link may no
+longer work by the time it is used. With window=True, the search is sorted
+by _lastUpdated and the checkpoint also records the latest lastUpdated seen
+(and the ids of the resources with that timestamp). When a next link fails,
+the search is restarted from that point with _lastUpdated=ge..., dropping
+the resources at the boundary which have already been handled.
+
+get() has to return every entry, not just the ones after the checkpoint, so
+it asks the checkpoint to spool each page's entries to disk as well
+(spool=True).
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterator
+from urllib.parse import parse_qsl, quote, urlsplit
+
+
+def add_param(url: str, param: str) -> str:
+    sep = "&" if "?" in url else "?"
+    return f"{url}{sep}{param}"
+
+
+_instant = re.compile(
+    r"^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.(\d+))?(Z|[+-]\d{2}:\d{2})?$"
+)
+
+
+def parse_instant(value: str) -> datetime | None:
+    """A FHIR instant as a timezone aware datetime, or None if it isn't one
+
+    Instants vary in precision and offset, so they can't be compared as
+    strings. Fractions beyond microseconds are dropped, and an instant
+    without an offset is taken to be UTC.
+    """
+    match = _instant.match(value)
+    if match is None:
+        return None
+    base, fraction, offset = match.groups()
+    fraction = (fraction or "")[:6].ljust(6, "0")
+    if offset is None or offset == "Z":
+        offset = "+00:00"
+    return datetime.fromisoformat(f"{base}.{fraction}{offset}")
+
+
+class PaginationCheckpoint:
+    def __init__(self, path: str | Path, window: bool = False, spool: bool = False) -> None:
+        """
+        :param path: File in which the progress is saved
+        :param window: Sort by _lastUpdated so that an expired cursor can be replaced with a windowed search
+        :param spool: Keep each page's entries in a file alongside the checkpoint
+        """
+        self.path = Path(path)
+        self.spool_path = self.path.with_name(f"{self.path.name}.entries")
+        self.window = window
+        self.spool = spool
+        self.reset()
+
+    def reset(self, url: str | None = None) -> None:
+        self.url = url
+        self.next: str | None = None
+        self.pages = 0
+        self.entries = 0
+        self.complete = False
+        # The latest lastUpdated seen and the ids of the resources having it
+        self.last_updated: str | None = None
+        self.boundary_ids: list[str] = []
+
+    def prepare(self, url: str) -> str:
+        """Return the URL to search, sorted by _lastUpdated if windowing
+
+        A window can only be reopened from the last resource seen if that is
+        the order, so windowing any other sort is refused.
+        """
+        if not self.window:
+            return url
+        sorts = [value for name, value in parse_qsl(urlsplit(url).query) if name == "_sort"]
+        if len(sorts) == 0:
+            return add_param(url, "_sort=_lastUpdated")
+        if sorts != ["_lastUpdated"]:
+            raise ValueError(
+                f"Windowed searches are sorted by _lastUpdated, not _sort={','.join(sorts)}"
+            )
+        return url
+
+    def resume(self, url: str) -> bool:
+        """Load the saved progress for url, returning True if there is a page to resume from
+
+        Progress saved for some other search, or for one that was
+        completed, is thrown away.
+        """
+        self.reset(url)
+        if self.path.is_file():
+            state = json.loads(self.path.read_text())
+            if state.get("url") == url and not state.get("complete"):
+                self.next = state["next"]
+                self.pages = state["pages"]
+                self.entries = state["entries"]
+                self.last_updated = state.get("last_updated")
+                self.boundary_ids = state.get("boundary_ids", [])
+                self._truncate_spool()
+                return self.next is not None
+
+        self.clear()
+        self.url = url
+        return False
+
+    def completed(self) -> bool:
+        """True if the saved progress is for a search that was finished"""
+        if not self.path.is_file():
+            return False
+        return bool(json.loads(self.path.read_text()).get("complete"))
+
+    def window_url(self) -> str | None:
+        """The search to use in place of an expired next link, if windowing"""
+        if not self.window or self.url is None:
+            return None
+        if self.last_updated is None:
+            return self.url
+        return add_param(self.url, f"_lastUpdated=ge{quote(self.last_updated, safe=':')}")
+
+    def drop_seen(self, response: dict[str, Any]) -> None:
+        """Remove the boundary resources that were already handled from a windowed page"""
+        if "entry" not in response or len(self.boundary_ids) == 0:
+            return
+        seen = set(self.boundary_ids)
+        response["entry"] = [
+            entry for entry in response["entry"] if self._id(entry) not in seen
+        ]
+
+    @staticmethod
+    def _id(entry: dict[str, Any]) -> str | None:
+        resource = entry.get("resource", {})
+        if "id" not in resource:
+            return None
+        return f"{resource.get('resourceType')}/{resource['id']}"
+
+    def record(self, response: dict[str, Any], next_url: str | None) -> None:
+        """Save the progress made by handling a page"""
+        entries = response.get("entry", [])
+        self.pages += 1
+        self.entries += len(entries)
+        self.next = next_url
+        self.complete = next_url is None
+
+        # The original string is kept for the _lastUpdated=ge search
+        latest = None if self.last_updated is None else parse_instant(self.last_updated)
+        for entry in entries:
+            last_updated = entry.get("resource", {}).get("meta", {}).get("lastUpdated")
+            if last_updated is None:
+                continue
+            when = parse_instant(last_updated)
+            if when is None:
+                continue
+            if latest is None or when > latest:
+                latest = when
+                self.last_updated = last_updated
+                self.boundary_ids = []
+            if when == latest:
+                self.boundary_ids.append(self._id(entry) or "")
+
+        if self.spool:
+            with self.spool_path.open("at") as f:
+                f.write(json.dumps(entries) + "\n")
+        self.save()
+
+    def _truncate_spool(self) -> None:
+        """Drop any page spooled after the checkpoint was last saved"""
+        if not self.spool_path.is_file():
+            return
+        with self.spool_path.open("rt") as f:
+            lines = [line for _, line in zip(range(self.pages), f)]
+        with self.spool_path.open("wt") as f:
+            f.writelines(lines)
+
+    def spooled_pages(self) -> Iterator[list[dict[str, Any]]]:
+        """Yield the entries of each spooled page in turn, so only one is ever in memory"""
+        if self.spool and self.spool_path.is_file():
+            with self.spool_path.open("rt") as f:
+                for line in f:
+                    yield json.loads(line)
+
+    def spooled_entries(self) -> list[dict[str, Any]]:
+        entries: list[dict[str, Any]] = []
+        for page in self.spooled_pages():
+            entries += page
+        return entries
+
+    def save(self) -> None:
+        state = {
+            "url": self.url,
+            "next": self.next,
+            "pages": self.pages,
+            "entries": self.entries,
+            "complete": self.complete,
+            "last_updated": self.last_updated,
+            "boundary_ids": self.boundary_ids,
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        tmp_path.write_text(json.dumps(state))
+        os.replace(tmp_path, self.path)
+
+    def clear(self) -> None:
+        """Forget any saved progress"""
+        self.path.unlink(missing_ok=True)
+        self.spool_path.unlink(missing_ok=True)
+        self.reset(self.url)
@@ -0,0 +1,69 @@
+"""
+Compression negotiation for requests sent to a FHIR server.
+
+Each host can configure compression in its fhir_hosts entry:
+
+    dev:
+        compression:
+            request_bodies: true    # gzip request bodies (Content-Encoding)
+            min_size: 65536         # ...but only those at least this many bytes
+            level: 6                # gzip compression level (1-9)
+            responses: true         # ask for compressed responses (Accept-Encoding)
+
+Request bodies are sent uncompressed unless request_bodies is true, since not
+every server accepts Content-Encoding on requests. If responses is left out,
+the Accept-Encoding header is whatever the auth module and requests decide
+(requests asks for gzip, but the KF OpenID proxy requires identity). Setting
+it to true or false overrides that for the host.
+"""
+from __future__ import annotations
+
+import gzip
+from dataclasses import dataclass
+from json import dumps
+from typing import Any
+
+
+@dataclass
+class CompressionSettings:
+    request_bodies: bool = False
+    min_size: int = 64 * 1024
+    level: int = 6
+    responses: bool | None = None
+
+    @classmethod
+    def from_cfg(cls, cfg: dict[str, Any]) -> CompressionSettings:
+        """Build the settings from a host's configuration"""
+        settings = cfg.get("compression") or {}
+        unknown = set(settings) - set(cls.__dataclass_fields__)
+        if len(unknown) > 0:
+            raise ValueError(f"Unknown compression settings: {sorted(unknown)}")
+
+        compression = cls(**settings)
+        if not 1 <= compression.level <= 9:
+            raise ValueError("compression level must be between 1 and 9")
+        if compression.min_size < 0:
+            raise ValueError("compression min_size must not be negative")
+        return compression
+
+    def update_request_args(self, request_args: dict[str, Any]) -> dict[str, Any]:
+        """Return a copy of request_args with the body compressed and headers set as configured
+
+        The original request_args are left alone so that the uncompressed body
+        is still available for logging and error reporting.
+        """
+        request_args = dict(request_args)
+        headers = dict(request_args.get("headers") or {})
+
+        if self.responses is not None:
+            headers["Accept-Encoding"] = "gzip, deflate" if self.responses else "identity"
+
+        if self.request_bodies and request_args.get("json") is not None:
+            body = dumps(request_args["json"]).encode("utf-8")
+            if len(body) >= self.min_size:
+                del request_args["json"]
+                request_args["data"] = gzip.compress(body, compresslevel=self.level)
+                headers["Content-Encoding"] = "gzip"
+
+        request_args["headers"] = headers
+        return request_args
@@ -0,0 +1,210 @@
+"""
+Bulk loading of conformance resources (CodeSystems, ValueSets,
+StructureDefinitions and the like), such as the artifacts of an IG.
+
+FhirClient.load handles these one at a time: a search by url, perhaps a
+delete and a poll waiting for it to take, then the write. The
+ConformanceLoader does the same job in a handful of round trips:
+
+  * The server's copies are found with one search per resource type per
+    chunk of canonical urls (Type?url=a,b,c...).
+  * An artifact whose version and content (see change_detection) match the
+    server's copy is skipped.
+  * Everything else is written over the server's copy (PUT to its id) or
+    created, either by a pool of worker threads or as transaction bundles.
+    Extra copies of the same canonical url are deleted, since the write no
+    longer depends on a search to find its target there is no need to wait
+    for the deletes to take.
+
+    loader = client.conformance_loader(transaction=True)
+    summary = loader.load(artifacts)
+"""
+from __future__ import annotations
+
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Iterable
+
+from ncpi_fhir_client.change_detection import resource_hash
+
+
+@dataclass
+class LoadSummary:
+    skipped: int = 0
+    created: int = 0
+    updated: int = 0
+    deleted: int = 0
+    # (Type/url, status_code, response) for every write that failed
+    failures: list[tuple[str, int, Any]] = field(default_factory=list)
+
+
+def _escape(url: str) -> str:
+    """Escape the characters that have meaning inside a search parameter's value"""
+    return url.replace("\\", "\\\\").replace(",", "\\,").replace("$", "\\$").replace("|", "\\|")
+
+
+class ConformanceLoader:
+    def __init__(
+        self,
+        fhir_client: Any,
+        chunk_size: int = 50,
+        workers: int | None = None,
+        transaction: bool = False,
+        bundle_size: int = 100,
+    ) -> None:
+        """
+        :param fhir_client: client used to reach the server
+        :type fhir_client: FhirClient
+        :param chunk_size: Canonical urls per search
+        :param workers: Writes in flight at once, defaults to the host's performance concurrency
+        :param transaction: Write the artifacts as transaction bundles rather than one request each
+        :param bundle_size: Most entries per transaction bundle
+        """
+        self.fhir_client = fhir_client
+        self.chunk_size = chunk_size
+        self.workers = workers if workers is not None else fhir_client.performance.concurrency
+        self.transaction = transaction
+        self.bundle_size = bundle_size
+
+    def existing(self, resource_type: str, urls: Iterable[str]) -> dict[str, list[dict[str, Any]]]:
+        """Return the server's copies of each canonical url, a chunk of urls per search"""
+        urls = sorted(set(urls))
+        found: dict[str, list[dict[str, Any]]] = defaultdict(list)
+        for start in range(0, len(urls), self.chunk_size):
+            chunk = ",".join(_escape(url) for url in urls[start : start + self.chunk_size])
+            for entry in self.fhir_client.get(f"{resource_type}?url={chunk}").entries:
+                resource = entry.get("resource")
+                if resource is not None and resource.get("url") is not None:
+                    found[resource["url"]].append(resource)
+        return found
+
+    def plan(
+        self, resources: Iterable[dict[str, Any]], summary: LoadSummary
+    ) -> tuple[list[dict[str, Any]], list[str]]:
+        """Work out what has to be written and deleted, skipping what is already on the server
+
+        :return: (resources to write, Type/id of the copies to delete)
+        """
+        by_type: defaultdict[str, list[dict[str, Any]]] = defaultdict(list)
+        for resource in resources:
+            assert "url" in resource, "Conformance resources must have a canonical url"
+            by_type[resource["resourceType"]].append(resource)
+
+        writes = []
+        deletes = []
+        for resource_type, artifacts in sorted(by_type.items()):
+            found = self.existing(resource_type, [artifact["url"] for artifact in artifacts])
+            for artifact in artifacts:
+                copies = found.get(artifact["url"], [])
+                if len(copies) == 0:
+                    writes.append(artifact)
+                    continue
+
+                # Prefer the copy with the same version (and the same id, if we have one)
+                copies = sorted(
+                    copies,
+                    key=lambda copy: (
+                        copy.get("version") != artifact.get("version"),
+                        copy.get("id") != artifact.get("id", copy.get("id")),
+                    ),
+                )
+                current = copies[0]
+                deletes += [f"{resource_type}/{copy['id']}" for copy in copies[1:]]
+
+                artifact = dict(artifact, id=artifact.get("id", current["id"]))
+                if (
+                    artifact["id"] == current["id"]
+                    and current.get("version") == artifact.get("version")
+                    and resource_hash(current) == resource_hash(artifact)
+                ):
+                    summary.skipped += 1
+                else:
+                    if artifact["id"] != current["id"]:
+                        deletes.append(f"{resource_type}/{current['id']}")
+                    writes.append(artifact)
+        return writes, deletes
+
+    def load(self, resources: Iterable[dict[str, Any]]) -> LoadSummary:
+        summary = LoadSummary()
+        writes, deletes = self.plan(resources, summary)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for result in executor.map(self._delete, deletes):
+                if 200 <= result["status_code"] < 300:
+                    summary.deleted += 1
+
+            if self.transaction:
+                for start in range(0, len(writes), self.bundle_size):
+                    self._send_bundle(writes[start : start + self.bundle_size], summary)
+            else:
+                for resource, result in zip(writes, executor.map(self._write, writes)):
+                    self._tally(resource, result["status_code"], result.get("response"), summary)
+        return summary
+
+    def _delete(self, reference: str) -> dict[str, Any]:
+        resource_type, id = reference.split("/")
+        return self.fhir_client.delete_by_record_id(resource_type, id, silence_warnings=True)
+
+    def _write(self, resource: dict[str, Any]) -> dict[str, Any]:
+        resource_type = resource["resourceType"]
+        endpoint = f"{self.fhir_client.target_service_url}/{resource_type}"
+        verb = "POST"
+        if "id" in resource:
+            verb = "PUT"
+            endpoint = f"{endpoint}/{resource['id']}"
+
+        success, result = self.fhir_client.send_request(verb, endpoint, json=resource)
+        self.fhir_client.record_write(resource_type, resource, result)
+        return result
+
+    def _send_bundle(self, resources: list[dict[str, Any]], summary: LoadSummary) -> None:
+        entries = []
+        for resource in resources:
+            resource_type = resource["resourceType"]
+            if "id" in resource:
+                entries.append(
+                    {
+                        "fullUrl": f"{self.fhir_client.target_service_url}/{resource_type}/{resource['id']}",
+                        "resource": resource,
+                        "request": {"method": "PUT", "url": f"{resource_type}/{resource['id']}"},
+                    }
+                )
+            else:
+                entries.append(
+                    {
+                        "fullUrl": f"urn:uuid:{uuid.uuid4()}",
+                        "resource": resource,
+                        "request": {"method": "POST", "url": resource_type},
+                    }
+                )
+
+        bundle = {"resourceType": "Bundle", "type": "transaction", "entry": entries}
+        success, result = self.fhir_client.send_request(
+            "POST", self.fhir_client.target_service_url, json=bundle
+        )
+        if not success:
+            # A transaction stands or falls as a whole
+            for resource in resources:
+                self._tally(resource, result["status_code"], result.get("response"), summary)
+            return
+
+        response_entries = result["response"].get("entry", [])
+        for resource, entry in zip(resources, response_entries):
+            status = entry.get("response", {}).get("status", "")
+            status_code = int(status.split(" ")[0]) if status[:3].isdigit() else 200
+            self._tally(resource, status_code, entry.get("response"), summary)
+
+    @staticmethod
+    def _tally(
+        resource: dict[str, Any], status_code: int, response: Any, summary: LoadSummary
+    ) -> None:
+        if status_code == 201:
+            summary.created += 1
+        elif 200 <= status_code < 300:
+            summary.updated += 1
+        else:
+            summary.failures.append(
+                (f"{resource['resourceType']}/{resource['url']}", status_code, response)
+            )
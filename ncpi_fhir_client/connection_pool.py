@@ -0,0 +1,148 @@
+"""
+Per-host connection pools shared by every FhirClient talking to that host.
+
+requests mounts an HTTPAdapter with room for 10 connections per pool, which
+threaded callers quickly outgrow; every connection beyond that is thrown
+away after use, so the next request pays for another TCP (and TLS)
+handshake. Instead, each host gets a single adapter, sized by its fhir_hosts
+entry, which is shared by all of the clients for that host:
+
+    dev:
+        connection_pool:
+            pool_maxsize: 64        # connections kept open per pool
+            pool_block: false       # wait for a free connection rather than open an extra one
+            tcp_keepalive: true     # enable TCP keep-alive probes on idle connections
+            keepalive_idle: 60      # seconds idle before the first probe
+
+urllib3's pools are thread-safe, so sharing the adapter (rather than the
+requests Session) is safe across threads.
+"""
+from __future__ import annotations
+
+import socket
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Hashable
+from urllib.parse import urlsplit
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+@dataclass(frozen=True)
+class PoolSettings:
+    pool_connections: int = 10
+    pool_maxsize: int = 64
+    pool_block: bool = False
+    tcp_keepalive: bool = True
+    keepalive_idle: int = 60
+
+    @classmethod
+    def from_cfg(cls, cfg: dict[str, Any]) -> PoolSettings:
+        """Build the settings from a host's configuration"""
+        settings = dict(cfg.get("connection_pool") or {})
+        unknown = set(settings) - set(cls.__dataclass_fields__)
+        if len(unknown) > 0:
+            raise ValueError(f"Unknown connection_pool settings: {sorted(unknown)}")
+
+        # The performance profile may size the pool as well
+        profile_maxsize = (cfg.get("performance") or {}).get("pool_maxsize")
+        if profile_maxsize is not None:
+            settings.setdefault("pool_maxsize", profile_maxsize)
+
+        pool = cls(**settings)
+        for name in ("pool_maxsize", "pool_connections"):
+            if not getattr(pool, name) > 0:
+                raise ValueError(f"connection_pool {name} must be positive")
+        return pool
+
+    def socket_options(self) -> list[tuple[int, int, int]]:
+        options = [(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)]
+        if self.tcp_keepalive:
+            options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+            # Not every platform lets us tune the probes
+            if hasattr(socket, "TCP_KEEPIDLE"):
+                options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.keepalive_idle))
+        return options
+
+
+class PooledAdapter(HTTPAdapter):
+    def __init__(self, settings: PoolSettings, max_retries: Retry | int = 0) -> None:
+        self.settings = settings
+        super().__init__(
+            pool_connections=settings.pool_connections,
+            pool_maxsize=settings.pool_maxsize,
+            pool_block=settings.pool_block,
+            max_retries=max_retries,
+        )
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        kwargs["socket_options"] = self.settings.socket_options()
+        super().init_poolmanager(*args, **kwargs)
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """Return usage statistics for each of the adapter's connection pools
+
+        requests is the number of requests sent through the pool, and
+        new_connections is how many connections had to be opened to send them.
+        The difference is the number of requests that reused a connection.
+        """
+        pools = self.poolmanager.pools
+        with pools.lock:
+            pool_list = list(pools._container.values())
+
+        stats = {}
+        for pool in pool_list:
+            stats[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                "requests": pool.num_requests,
+                "new_connections": pool.num_connections,
+                "reused_connections": pool.num_requests - pool.num_connections,
+                "idle_connections": pool.pool.qsize() if pool.pool is not None else 0,
+            }
+        return stats
+
+
+# (scheme, host, settings, retries) => the adapter shared by all clients for that host
+_adapters: dict[tuple[str, str, PoolSettings, Hashable], PooledAdapter] = {}
+_adapters_lock = Lock()
+
+
+def _retry_key(max_retries: Retry | int) -> Hashable:
+    """What distinguishes one retry strategy from another (Retry compares by identity)"""
+    if not isinstance(max_retries, Retry):
+        return max_retries
+    return (
+        type(max_retries),
+        max_retries.total,
+        max_retries.connect,
+        max_retries.read,
+        max_retries.status,
+        max_retries.other,
+        max_retries.redirect,
+        max_retries.backoff_factor,
+        max_retries.backoff_max,
+        tuple(max_retries.status_forcelist or ()),
+        # False (retry every method) or a collection of methods
+        max_retries.allowed_methods
+        if isinstance(max_retries.allowed_methods, bool)
+        else frozenset(max_retries.allowed_methods or ()),
+        max_retries.raise_on_status,
+        max_retries.respect_retry_after_header,
+    )
+
+
+def host_adapter(
+    target_service_url: str, settings: PoolSettings, max_retries: Retry | int = 0
+) -> PooledAdapter:
+    """Return the adapter shared by every client for the host behind target_service_url
+
+    Clients only share an adapter when their retry strategies match as well,
+    since the adapter is what retries.
+    """
+    url = urlsplit(target_service_url)
+    key = (url.scheme, url.netloc, settings, _retry_key(max_retries))
+
+    with _adapters_lock:
+        if key not in _adapters:
+            _adapters[key] = PooledAdapter(settings, max_retries=max_retries)
+        return _adapters[key]
@@ -0,0 +1,141 @@
+"""
+End-to-end deadlines for client operations.
+
+Timeouts passed to requests only bound a single wait for a connection or
+for the next bytes of a response. A deadline bounds a whole operation, such
+as a get that follows hundreds of pages, along with the retries and token
+refreshes made on its behalf:
+
+    with deadline_scope(Deadline(600, "harvest")):
+        client.get("Patient")
+
+The deadline in force is kept per thread, so it reaches the code that sends
+each request without being passed through every call. Each request's
+timeout is cut down to the time remaining, retries are abandoned once their
+backoff would run past the deadline and a DeadlineExceeded is raised as
+soon as the deadline has passed. Work handed to other threads (such as by
+fetch_graph) isn't covered by the caller's deadline.
+"""
+from __future__ import annotations
+
+import threading
+from contextlib import contextmanager
+from time import monotonic
+from typing import TYPE_CHECKING, Any, Iterator
+
+from urllib3.util.retry import Retry
+
+if TYPE_CHECKING:
+    from typing_extensions import Self
+
+_local = threading.local()
+
+# Used by the auth modules when fetching tokens, which have no host profile
+token_request_timeout = (10, 60)
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, deadline: Deadline, progress: dict[str, Any] | None = None) -> None:
+        """
+        :param deadline: The deadline that passed
+        :param progress: What had been done by the time it passed, such as pages fetched
+        """
+        self.deadline = deadline
+        self.elapsed = deadline.elapsed()
+        self.progress = progress if progress is not None else {}
+        # Whatever the operation had to show for itself, such as a partial FhirResult
+        self.partial: Any = None
+        super().__init__()
+
+    def __str__(self) -> str:
+        msg = f"{self.deadline.operation or 'Operation'} exceeded its {self.deadline.seconds}s deadline after {self.elapsed:.1f}s"
+        if len(self.progress) > 0:
+            msg += f" ({', '.join(f'{k}={v}' for k, v in self.progress.items())})"
+        return msg
+
+
+class Deadline:
+    def __init__(self, seconds: float, operation: str = "") -> None:
+        """
+        :param seconds: Time allowed from now
+        :param operation: Description used when reporting that the deadline passed
+        """
+        assert seconds > 0, "deadline must be positive"
+        self.seconds = seconds
+        self.operation = operation
+        self.started = monotonic()
+        self.expires = self.started + seconds
+
+    def elapsed(self) -> float:
+        return monotonic() - self.started
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - monotonic())
+
+    def expired(self) -> bool:
+        return monotonic() >= self.expires
+
+    def check(self, progress: dict[str, Any] | None = None) -> None:
+        """Raise DeadlineExceeded if the deadline has passed"""
+        if self.expired():
+            raise DeadlineExceeded(self, progress)
+
+    def clamp(self, timeout: Any) -> Any:
+        """Cut a requests timeout (seconds or a (connect, read) tuple) down to the time remaining"""
+        remaining = self.remaining()
+        if isinstance(timeout, tuple):
+            return tuple(remaining if t is None else min(t, remaining) for t in timeout)
+        if timeout is None:
+            return remaining
+        return min(timeout, remaining)
+
+
+def current_deadline() -> Deadline | None:
+    """The deadline in force on this thread, if any"""
+    return getattr(_local, "deadline", None)
+
+
+@contextmanager
+def deadline_scope(deadline: Deadline | None) -> Iterator[Deadline | None]:
+    """Put deadline in force on this thread. An earlier, enclosing deadline still applies"""
+    previous = current_deadline()
+    if deadline is None or (previous is not None and previous.expires <= deadline.expires):
+        yield previous
+        return
+
+    _local.deadline = deadline
+    try:
+        yield deadline
+    finally:
+        _local.deadline = previous
+
+
+def request_timeout(timeout: Any) -> Any:
+    """timeout, cut down to fit the deadline in force (raising if it has already passed)"""
+    deadline = current_deadline()
+    if deadline is None:
+        return timeout
+    deadline.check()
+    return deadline.clamp(timeout)
+
+
+def check_backoff(retry: Retry, response: Any = None) -> None:
+    """Raise DeadlineExceeded if retry would back off (or wait out response's
+    Retry-After) past the deadline in force"""
+    deadline = current_deadline()
+    if deadline is None:
+        return
+    wait = retry.get_backoff_time()
+    if response is not None and retry.respect_retry_after_header:
+        wait = max(wait, retry.get_retry_after(response) or 0.0)
+    if wait >= deadline.remaining():
+        raise DeadlineExceeded(deadline, {"retries": len(retry.history)})
+
+
+class DeadlineRetry(Retry):
+    """A urllib3 Retry that gives up rather than back off past the deadline in force"""
+
+    def increment(self, *args: Any, **kwargs: Any) -> Self:
+        retry = super().increment(*args, **kwargs)
+        check_backoff(retry)
+        return retry
@@ -0,0 +1,157 @@
+"""
+Structured capture of failed requests.
+
+Rather than writing each failure to a file in the working directory (which
+threads overwrite for one another) or printing whole request bodies, the
+FhirClient keeps its most recent failures in a bounded, in-memory ring
+buffer. Each holds the request, the status, a truncated copy of the
+response (and request) body and how long the request took:
+
+    for failure in client.errors.failures():
+        print(failure.method, failure.url, failure.status_code, failure.body)
+
+Failures can also be spilled, in full, to a file per request. Spilling is
+done by a background thread, so the thread that sent the request never
+waits on the disk. Both are set in a host's fhir_hosts entry:
+
+    dev:
+        error_capture:
+            capacity: 200           # failures kept in memory
+            max_body: 2000          # characters of each body kept in memory
+            spill_dir: errors       # write each failure to its own file here (off by default)
+"""
+from __future__ import annotations
+
+import json
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+from threading import Lock
+from typing import Any
+
+
+@dataclass
+class CapturedFailure:
+    method: str
+    url: str
+    status_code: int
+    reason: str
+    # Response (and request) bodies, truncated to max_body characters
+    body: str
+    request_body: str | None
+    elapsed: float
+    timestamp: str
+    # Where the untruncated failure was spilled, if it was
+    spill_path: str | None = None
+
+
+def _text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    return json.dumps(content, default=str)
+
+
+def _truncate(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text) - limit} more characters]"
+
+
+class ErrorCapture:
+    def __init__(
+        self, capacity: int = 200, max_body: int = 2000, spill_dir: str | Path | None = None
+    ) -> None:
+        """
+        :param capacity: Number of failures kept. Older ones are dropped
+        :param max_body: Characters of each body kept in memory
+        :param spill_dir: If provided, every failure is also written, in full, to a file in here
+        """
+        if capacity <= 0:
+            raise ValueError("error_capture capacity must be positive")
+        self.capacity = capacity
+        self.max_body = max_body
+        self.spill_dir = None if spill_dir is None else Path(spill_dir)
+
+        self._failures: deque[CapturedFailure] = deque(maxlen=capacity)
+        self.lock = Lock()
+        # Every failure seen, including those that have since been dropped
+        self.total = 0
+        self._spiller: ThreadPoolExecutor | None = None
+
+    @classmethod
+    def from_cfg(cls, cfg: dict[str, Any]) -> ErrorCapture:
+        """Build the capture from a host's configuration"""
+        settings = cfg.get("error_capture") or {}
+        unknown = set(settings) - {"capacity", "max_body", "spill_dir"}
+        if len(unknown) > 0:
+            raise ValueError(f"Unknown error_capture settings: {sorted(unknown)}")
+        return cls(**settings)
+
+    def __len__(self) -> int:
+        return len(self._failures)
+
+    def record(
+        self,
+        method: str,
+        url: str,
+        status_code: int,
+        reason: str,
+        body: Any,
+        request_body: Any = None,
+        elapsed: float = 0.0,
+    ) -> CapturedFailure:
+        """Capture a failure. This is cheap; the bodies are only serialized and truncated"""
+        body_text = _text(body)
+        request_text = None if request_body is None else _text(request_body)
+        failure = CapturedFailure(
+            method=method,
+            url=url,
+            status_code=status_code,
+            reason=reason,
+            body=_truncate(body_text, self.max_body),
+            request_body=None if request_text is None else _truncate(request_text, self.max_body),
+            elapsed=elapsed,
+            timestamp=datetime.now().isoformat(),
+        )
+
+        with self.lock:
+            self.total += 1
+            number = self.total
+            self._failures.append(failure)
+
+            if self.spill_dir is not None:
+                name = re.sub(r"[^A-Za-z0-9_.-]", "_", f"{number:06d}-{method}-{status_code}")
+                failure.spill_path = str(self.spill_dir / f"{name}.json")
+                if self._spiller is None:
+                    self._spiller = ThreadPoolExecutor(max_workers=1)
+                self._spiller.submit(
+                    self._spill, failure.spill_path, failure, body_text, request_text
+                )
+        return failure
+
+    def _spill(
+        self, path: str, failure: CapturedFailure, body: str, request_body: str | None
+    ) -> None:
+        content = dict(asdict(failure), body=body, request_body=request_body)
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wt") as f:
+            json.dump(content, f, indent=2)
+
+    def failures(self) -> list[CapturedFailure]:
+        """The failures still held, oldest first"""
+        with self.lock:
+            return list(self._failures)
+
+    def clear(self) -> None:
+        with self.lock:
+            self._failures.clear()
+
+    def close(self) -> None:
+        """Wait for any spilled failures to be written"""
+        with self.lock:
+            spiller, self._spiller = self._spiller, None
+        if spiller is not None:
+            spiller.shutdown(wait=True)
@@ -4,9 +4,14 @@
 """
 
 import datetime
+from threading import Lock
+
 import requests
 from rich import print
 
+from ncpi_fhir_client.deadline import request_timeout, token_request_timeout
+from ncpi_fhir_client.tracing import span
+
 
 class AuthKfOpenid:
     def __init__(self, cfg):
@@ -15,28 +20,36 @@ class AuthKfOpenid:
         self.token_url = cfg["token_url"]
         self.token_expire = datetime.datetime.now()
         self.token = None
+        # Only one thread should refresh the token when it expires
+        self.token_lock = Lock()
 
     def access_token(self, lifetime=60):
-        curtime = datetime.datetime.now()
-
-        if curtime >= self.token_expire:
-            response = requests.post(
-                self.token_url,
-                headers={"Content-Type": "application/x-www-form-urlencoded"},
-                data={
-                    "grant_type": "client_credentials",
-                    "client_id": self.client_id,
-                    "client_secret": self.client_secret,
-                },
-            )
-
-            response = response.json()
-            self.token = response["access_token"]
-            self.token_expire = curtime + datetime.timedelta(
-                seconds=response["expires_in"]
-            )
-
-        return self.token
+        with self.token_lock:
+            curtime = datetime.datetime.now()
+
+            if curtime >= self.token_expire:
+                with span(
+                    "token refresh", {"auth.module": "auth_kf_openid", "http.url": self.token_url}
+                ) as refresh_span:
+                    response = requests.post(
+                        self.token_url,
+                        headers={"Content-Type": "application/x-www-form-urlencoded"},
+                        data={
+                            "grant_type": "client_credentials",
+                            "client_id": self.client_id,
+                            "client_secret": self.client_secret,
+                        },
+                        timeout=request_timeout(token_request_timeout),
+                    )
+                    refresh_span.set_attribute("http.status_code", response.status_code)
+
+                response = response.json()
+                self.token = response["access_token"]
+                self.token_expire = curtime + datetime.timedelta(
+                    seconds=response["expires_in"]
+                )
+
+            return self.token
 
     def update_request_args(self, request_args):
         """Add the bearer token to the header based on the token provided"""
@@ -18,6 +18,10 @@ import json
 import datetime
 import requests
 import sys
+
+from ncpi_fhir_client.deadline import request_timeout, token_request_timeout
+from ncpi_fhir_client.tracing import span
+from threading import Lock
 from rich import pretty
 
 pretty.install()
@@ -33,6 +37,8 @@ class GoogleAuth(object):
 
         self.token_expire = datetime.datetime.now()
         self.token = None
+        # Only one thread should refresh the token when it expires
+        self.token_lock = Lock()
         print(f"GA Initialized: {datetime.datetime.now().strftime('%H:%M:%S')}")
 
         # Target Service is probably the most appropriate way to 
@@ -65,6 +71,10 @@ class GoogleAuth(object):
 
     def access_token(self, lifetime=60):
         """Generate the token that is to be used to access the server"""
+        with self.token_lock:
+            return self._access_token(lifetime=lifetime)
+
+    def _access_token(self, lifetime=60):
         if self.target_service:
             curtime = datetime.datetime.now()
 
@@ -80,13 +90,16 @@ class GoogleAuth(object):
                 signature = jwt.encode(claim_set, self.private_key, algorithm=self.algorithm)
                 try:
                     print(f"GA Getting Token: {datetime.datetime.now().strftime('%H:%M:%S')}")
-                    req = requests.post(self.token_uri, 
-                                data={
-                                    'grant_type': 'urn:ietf:params:oauth:grant-type:jwt-bearer',
-                                    'assertion': signature,
-                                    'response_type': 'code'
-                                    }
-                                )
+                    with span("token refresh", {"auth.module": "google_auth", "http.url": self.token_uri}) as refresh_span:
+                        req = requests.post(self.token_uri, 
+                                    data={
+                                        'grant_type': 'urn:ietf:params:oauth:grant-type:jwt-bearer',
+                                        'assertion': signature,
+                                        'response_type': 'code'
+                                        },
+                                    timeout=request_timeout(token_request_timeout)
+                                    )
+                        refresh_span.set_attribute("http.status_code", req.status_code)
                 except requests.exceptions.RequestException:
                     print(f"Unable to get token: {datetime.datetime.now().strftime('%H:%M:%S')}")
                     sys.exit(1)
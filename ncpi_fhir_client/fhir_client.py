@@ -4,26 +4,56 @@ logger = logging.getLogger(__name__)
 # from ncpi_fhir_utility.client import FhirApiClient
 
 import sys
+import threading
 import urllib.parse
 from argparse import ArgumentParser, FileType
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from datetime import datetime
-from json import decoder, dump, dumps
+from functools import wraps
+from json import decoder, dumps
 from pathlib import Path
 from pprint import pformat
 from threading import Lock
-from time import sleep
+from time import perf_counter, sleep
 
+import requests
 import urllib3
 from rich import print
+from rich.console import Console
 
 from ncpi_fhir_client import requests_retry_session
+from ncpi_fhir_client.bundle_builder import BundleBuilder
+from ncpi_fhir_client.change_detection import ChangeTracker
+from ncpi_fhir_client.compression import CompressionSettings
+from ncpi_fhir_client.conformance_loader import ConformanceLoader
+from ncpi_fhir_client.connection_pool import PoolSettings, host_adapter
+from ncpi_fhir_client.deadline import (
+    Deadline,
+    DeadlineExceeded,
+    current_deadline,
+    deadline_scope,
+)
+from ncpi_fhir_client.error_capture import ErrorCapture
 from ncpi_fhir_client.fhir_auth import get_auth
 from ncpi_fhir_client.fhir_result import FhirResult
 from ncpi_fhir_client.host_config import get_host_config
+from ncpi_fhir_client.json_patch import make_patch, patch_size
+from ncpi_fhir_client.page_sizer import PageSizer, requested_count, with_count
+from ncpi_fhir_client.performance import PerformanceProfile
+from ncpi_fhir_client.profiling import Profiler, memory_section, timed
+from ncpi_fhir_client.progress import ProgressReporter
+from ncpi_fhir_client.query_stream import (
+    QueryStreamer,
+    output_formats,
+    summary_table,
+)
+from ncpi_fhir_client.rate_limit import RateLimiter, rate_limit_scope
+from ncpi_fhir_client.resource_graph import ResourceGraph
+from ncpi_fhir_client.tracing import get_tracer, span
+from ncpi_fhir_client.write_journal import WriteJournal
 
 urllib3.disable_warnings()
-http = urllib3.PoolManager(maxsize=64)
 
 # Just make sure our logs aren't unreadable due to threads
 log_lock = Lock()
@@ -51,7 +81,71 @@ def getIdentifier(resource):
     return idnt
 
 
+def _deadline_scoped(method):
+    """Run method under a deadline, passed as deadline= or set by the host's operation_timeout"""
+
+    @wraps(method)
+    def wrapper(self, resource, *args, deadline=None, **kwargs):
+        with self.deadline(deadline, operation=f"{method.__name__} {resource}"):
+            return method(self, resource, *args, **kwargs)
+
+    return wrapper
+
+
+def _memory_profiled(method):
+    """Track method's peak memory, if the client's profiler is tracking memory"""
+
+    @wraps(method)
+    def wrapper(self, resource, *args, **kwargs):
+        with memory_section(self.profiler, f"{method.__name__} {resource}"):
+            return method(self, resource, *args, **kwargs)
+
+    return wrapper
+
+
+def _resource_type(resource):
+    """The resource type at the start of a query (or Type/id)"""
+    return resource.split("?")[0].split("/")[0]
+
+
+def _traced(method):
+    """Wrap method in a span, if there is a tracer"""
+
+    @wraps(method)
+    def wrapper(self, resource, *args, **kwargs):
+        if get_tracer() is None:
+            return method(self, resource, *args, **kwargs)
+
+        attributes = {"fhir.resource_type": _resource_type(resource)}
+        with span(f"FhirClient.{method.__name__}", attributes) as call_span:
+            result = method(self, resource, *args, **kwargs)
+            if isinstance(result, dict):
+                call_span.set_attribute("http.status_code", result.get("status_code"))
+            elif isinstance(result, FhirResult):
+                call_span.set_attribute("http.status_code", result.status_code)
+                call_span.set_attribute("fhir.entries", len(result.entries))
+            return result
+
+    return wrapper
+
+
+def _server_managed(resource):
+    """Drop the meta elements the server maintains itself so they don't end up in a diff"""
+    meta = resource.get("meta")
+    if meta is None:
+        return resource
+
+    meta = {
+        k: v for k, v in meta.items() if k not in ["versionId", "lastUpdated", "source"]
+    }
+    resource = {k: v for k, v in resource.items() if k != "meta"}
+    if meta:
+        resource["meta"] = meta
+    return resource
+
+
 class FhirClient:
+    # Attempts made by post, unless the host's performance profile sets post_retries
     retry_post_count = 5
     fhir_version = "4.0.1"
     # fhir_version = "4.3.0"
@@ -61,7 +155,16 @@ class FhirClient:
         "methods": set(["POST", "PUT", "DELETE", "PATCH"]),
     }
 
-    def __init__(self, cfg, idcache=None, cmdlog=None, exit_on_dupes=False):
+    def __init__(
+        self,
+        cfg,
+        idcache=None,
+        cmdlog=None,
+        exit_on_dupes=False,
+        change_tracker=None,
+        journal=None,
+        profiler=None,
+    ):
         """cfg is a dictionary containing all relevant details suitable for host and authentication
 
         idcache is an optional substitute for the GET behavior we use when an entry isn't in our
@@ -71,15 +174,52 @@ class FhirClient:
         application because those should be cached by another, more permanent mechanism)
 
         When idcache is not in use, we'll fall back onto the GET approach
+
+        change_tracker is an optional ChangeTracker used to skip writes (post, update and load)
+        whose content matches what is already on the server. If the host's configuration sets
+        change_detection to true, a tracker whose store is specific to this host is used.
+
+        journal is an optional WriteJournal recording each write made by post, so that a rerun
+        skips the resources an earlier (possibly interrupted) run already wrote. If the host's
+        configuration sets write_journal to true, a journal specific to this host is used.
+
+        profiler is an optional Profiler timing the client's requests (and tracking the memory
+        used by its gets), see ncpi_fhir_client.profiling.
         """
 
         self.host_desc = cfg.get("host_desc")
         self.auth = get_auth(cfg)
+        self.compression = CompressionSettings.from_cfg(cfg)
+        self.performance = PerformanceProfile.from_cfg(cfg)
+        self.page_sizer = PageSizer.from_profile(self.performance)
+        # Recent failures, see error_capture
+        self.errors = ErrorCapture.from_cfg(cfg)
+        # How much post reports as it goes, see progress
+        self.progress = ProgressReporter.from_cfg(cfg)
+        # Shared by every thread using this client
+        self.rate_limiter = RateLimiter.from_cfg(cfg)
+        self.profiler = profiler
         self.logger = logger
 
         self.rest_log = None
 
-        self.session = requests_retry_session()
+        # URL associated with the host. If it's a non-standard port, use appropriate URL:XXXXX format
+        self.target_service_url = cfg.get("target_service_url")
+
+        # All clients for the same host share its connection pool
+        self.pool_settings = PoolSettings.from_cfg(cfg)
+        self.adapter = host_adapter(
+            self.target_service_url, self.pool_settings, max_retries=self.performance.retry()
+        )
+        # requests doesn't promise that a Session is thread-safe, so each thread
+        # gets its own (see the session property). They all share the adapter.
+        self._local = threading.local()
+
+        # Guard the state shared by threads using this client
+        self.rest_log_lock = Lock()
+        self.bundle_lock = Lock()
+        self.capability_lock = Lock()
+
         if cmdlog is not None:
             log_dir = Path(cmdlog).parent
             log_dir.mkdir(parents=True, exist_ok=True)
@@ -90,9 +230,6 @@ class FhirClient:
 
         self.idcache = idcache
 
-        # URL associated with the host. If it's a non-standard port, use appropriate URL:XXXXX format
-        self.target_service_url = cfg.get("target_service_url")
-
         self.is_valid = False
         self._client = (
             None  # Cache the client so we don't have to rebuild it between calls
@@ -103,14 +240,51 @@ class FhirClient:
         # Make the host desc suitable for filenames
         self.host_desc = self.host_desc.replace("/", "-").replace(" ", "_").lower()
 
+        if change_tracker is None and cfg.get("change_detection"):
+            change_tracker = ChangeTracker.for_host(self.host_desc)
+        self.change_tracker = change_tracker
+
+        if journal is None and cfg.get("write_journal"):
+            journal = WriteJournal.for_host(self.host_desc)
+        self.journal = journal
+
         # will remain None until a bundle file is initialized
         self.bundle = None
 
+        # Fetched the first time we need to know what the server supports
+        self._capability_statement = None
+        self._search_param_support = {}
+
         if self.idcache is not None:
             self.idcache.load_ids_from_host(self, exit_on_dupes=exit_on_dupes)
 
             print("Cache loaded")
 
+    @property
+    def session(self):
+        """The calling thread's requests Session"""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests_retry_session(adapter=self.adapter)
+            self._local.session = session
+        return session
+
+    def deadline(self, seconds=None, operation=""):
+        """Context manager putting a deadline in force for everything this thread sends
+
+        :param seconds: Time allowed, or a Deadline. Defaults to the host's operation_timeout
+        :param operation: Description used when reporting that the deadline passed
+        """
+        if seconds is None:
+            seconds = self.performance.operation_timeout
+        if seconds is not None and not isinstance(seconds, Deadline):
+            seconds = Deadline(seconds, operation)
+        return deadline_scope(seconds)
+
+    def pool_stats(self):
+        """Connection reuse statistics for the pool(s) shared by this host's clients"""
+        return self.adapter.stats()
+
     def logwrite(self, method, url, response, **kwargs):
         if self.rest_log:
             if method in FhirClient.resource_logging["methods"]:
@@ -123,7 +297,9 @@ class FhirClient:
                 for k, v in kwargs.items():
                     if k not in FhirClient.resource_logging["skipped_params"]:
                         logentry[k] = v
-                self.rest_log.write(dumps(logentry, sort_keys=True, indent=2) + "\n")
+                entry = dumps(logentry, sort_keys=True, indent=2) + "\n"
+                with self.rest_log_lock:
+                    self.rest_log.write(entry)
 
     def init_log(self):
         """make sure this uses the current logging, which probably changes based on user's input"""
@@ -148,12 +324,9 @@ class FhirClient:
         if self.bundle:
             # For now, let's just skip the ID so that it works in a more general sense
             destination = f"{resource['resourceType']}"  # /{resource['id']}"
-            if self.write_comma:
-                self.bundle.write(",")
-            self.write_comma = True
             resource_data = dumps(resource)
             full_url = f"""{self.target_service_url}/{resource["resourceType"]}/{resource["id"]}"""
-            self.bundle.write(
+            entry = (
                 """    {
       "fullUrl": \""""
                 + full_url
@@ -169,16 +342,54 @@ class FhirClient:
       }
     }"""
             )
+            with self.bundle_lock:
+                if self.write_comma:
+                    self.bundle.write(",")
+                self.write_comma = True
+                self.bundle.write(entry)
         return response
 
     def close_bundle(self):
         if self.bundle:
-            self.bundle.write(
-                """
+            with self.bundle_lock:
+                self.bundle.write(
+                    """
     ]
 }"""
-            )
-            self.bundle.close()
+                )
+                self.bundle.close()
+
+    def close(self):
+        """Stop the aggregate status line, leaving the final counts behind, and sync
+        the write journal (and any spilled failures) to disk. The client can still
+        be used afterwards"""
+        self.progress.stop()
+        if self.journal is not None:
+            self.journal.close()
+        self.errors.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def bundle_builder(self, **kwargs):
+        """Return a BundleBuilder for transactions against this host
+
+        Resources already known to the idcache are written with PUT. See
+        BundleBuilder for the other options.
+        """
+        return BundleBuilder(
+            base_url=self.target_service_url, idcache=self.idcache, **kwargs
+        )
+
+    def conformance_loader(self, **kwargs):
+        """Return a ConformanceLoader for loading many conformance resources (such as an IG) at once
+
+        See ConformanceLoader for the options.
+        """
+        return ConformanceLoader(self, **kwargs)
 
     def get_login_header(self, headers=None):
         """Just emulating what the fhir tools library does, but it's easy to find if we decide to add to it"""
@@ -194,6 +405,7 @@ class FhirClient:
             headers.update(base_fhir_headers)
         return headers
 
+    @_traced
     def delete_by_query(self, resource, qry):
         responses = []
         for response in self.get(f"{resource}?{qry}").entries:
@@ -205,6 +417,7 @@ class FhirClient:
             return responses[0]
         return responses
 
+    @_traced
     def delete_by_record_id(self, resource, id, silence_warnings=False):
         """Just a basic delete wrapper"""
         endpoint = f"{self.target_service_url}/{resource}/{id}"
@@ -214,32 +427,112 @@ class FhirClient:
                 self.logger.error(pformat(result))
         return result
 
-    # TODO: Allow this function to pull the data first and merge changes in
-    def update(self, resource, id, data):
-        """Update the current instance by overwriting it."""
+    @_traced
+    def update(self, resource, id, data, diff=False, current=None):
+        """Update the current instance by overwriting it.
+
+        With diff, only the changes are sent: the current version (either the
+        one provided or one fetched from the server) is compared to data and
+        the resulting json-patch is sent, guarded by If-Match on the current
+        version. If the patch wouldn't be any smaller than the resource itself,
+        the whole resource is PUT instead, guarded the same way. Should the
+        server's version have changed in the meantime (409/412), the current
+        version is fetched again and diffed once more; a second conflict is
+        returned to the caller rather than overwriting someone else's changes.
+
+        :param diff: Send a json-patch of the changes rather than the whole resource
+        :type diff: Boolean
+        :param current: The version of the resource currently on the server, if the caller already has it
+        :type current: dict
+        """
         endpoint = f"{self.target_service_url}/{resource}/{id}"
 
+        unchanged = self._unchanged_result(resource, dict(data, id=id), endpoint)
+        if unchanged is not None:
+            return unchanged
+
+        if diff:
+            for attempt in range(2):
+                if current is None:
+                    success, result = self.send_request("get", endpoint)
+                    if not success:
+                        if attempt > 0:
+                            return result
+                        # Nothing to diff against, so it is a plain PUT after all
+                        break
+                    current = result["response"]
+
+                result = self._patch_changes(resource, id, current, dict(data, id=id))
+                if result["status_code"] not in [409, 412]:
+                    break
+                # Someone else changed it since we looked, so look again
+                current = None
+            else:
+                return result
+
+            if current is not None:
+                self.record_write(resource, dict(data, id=id), result)
+                return result
+
         success, result = self.send_request("put", endpoint, json=data)
+        self.record_write(resource, dict(data, id=id), result)
 
         return result
 
-    def patch(self, resource, id, data):
+    def _patch_changes(self, resource, id, current, data):
+        """Turn current into data with a patch, or a PUT when that is no larger,
+        either way only if the server is still at current's version"""
+        version = current.get("meta", {}).get("versionId")
+        patch = make_patch(_server_managed(current), _server_managed(data))
+        if len(patch) == 0:
+            return {
+                "status_code": 200,
+                "request_url": f"{self.target_service_url}/{resource}/{id}",
+                "response": current,
+                "response_headers": {},
+                "response_bytes": 0,
+                "unchanged": True,
+            }
+
+        if patch_size(patch) >= len(dumps(data, separators=(",", ":"))):
+            headers = {}
+            if version is not None:
+                headers["If-Match"] = f'W/"{version}"'
+            success, result = self.send_request(
+                "put",
+                f"{self.target_service_url}/{resource}/{id}",
+                json=data,
+                headers=headers,
+            )
+            return result
+
+        return self.patch(resource, id, patch, version=version)
+
+    @_traced
+    def patch(self, resource, id, data, version=None):
         """Patch in partial changes to an existing record rather than overwriting everything.
 
         Please note that this accepts json-patch data and not a traditional fhir record
+
+        :param version: Only apply the patch if the record is still at this versionId (If-Match)
+        :type version: str
         """
         headers = {
             "Content-Type": "application/json-patch+json",
             "Prefer": "return=representation",
         }
+        if version is not None:
+            headers["If-Match"] = f'W/"{version}"'
 
         endpoint = f"{self.target_service_url}/{resource}/{id}"
-        success, result = self.client().send_request(
+        success, result = self.send_request(
             "patch", endpoint, json=data, headers=headers
         )
 
         return result
 
+    @_traced
+    @_deadline_scoped
     def load(self, resource, data, validate_only=False, skip_insert_if_present=False):
         objs = data
 
@@ -250,6 +543,11 @@ class FhirClient:
             verb = "POST"
             endpoint = f"{self.target_service_url}/{resource}"
 
+            if not validate_only and "id" in obj:
+                unchanged = self._unchanged_result(resource, obj, endpoint)
+                if unchanged is not None:
+                    return unchanged
+
             # Certainly don't want to delete anything if we are just validating something
             # that may coincidentally overlap with the current resource's URL
             if not validate_only:
@@ -266,6 +564,18 @@ class FhirClient:
                             return {"status_code": 201, "response": response}
                         if "id" not in obj:
                             obj["id"] = response["resource"]["id"]
+
+                            # We already have the server's copy, so there's
+                            # no need to rely on the store to compare them
+                            if self.change_tracker is not None:
+                                self.change_tracker.record(
+                                    resource, response["resource"], persist=False
+                                )
+                                unchanged = self._unchanged_result(
+                                    resource, obj, endpoint
+                                )
+                                if unchanged is not None:
+                                    return unchanged
                         else:
                             # Only delete if we encounter the same thing more than once
                             self.delete_by_record_id(
@@ -275,8 +585,9 @@ class FhirClient:
                                 gendpoint,
                                 0,
                                 message=f"Deleting {response['resource']['id']} / {gendpoint}",
+                                count_only=True,
                             )
-                            if fresponse.success:
+                            if fresponse.success():
                                 responses.append(fresponse)
                             else:
                                 print(
@@ -293,6 +604,8 @@ class FhirClient:
                     endpoint = f"{self.target_service_url}/{resource}/{obj['id']}"
 
             success, result = self.send_request(verb, endpoint, json=obj)
+            if not validate_only:
+                self.record_write(resource, obj, result)
 
             return result
 
@@ -316,6 +629,8 @@ class FhirClient:
         if not success:
             print("There was a problem with the request for the GET")
 
+    @_traced
+    @_deadline_scoped
     def post(
         self,
         resource,
@@ -348,14 +663,32 @@ class FhirClient:
 
             if validate_only:
                 endpoint += "/$validate"
-                # Currently assuming only one profile
-                if "profile" in data["meta"]:
-                    profile = data["meta"]["profile"][0]
+                # Currently assuming only one profile (see ValidationPipeline
+                # for validating many resources at once)
+                if "profile" in obj.get("meta", {}):
+                    profile = obj["meta"]["profile"][0]
 
                     endpoint = f"{endpoint}?profile={profile}"
-                    print(f"Woohoo! {endpoint}")
 
             verb = "POST"
+
+            # Journaled as given, before an id is filled in below
+            journaled = None
+            if self.journal is not None and not validate_only and resource != "Bundle":
+                journaled = dict(obj)
+                written_id = self.journal.written_id(resource, journaled)
+                if written_id is not None:
+                    obj["id"] = written_id
+                    self.logger.debug(f"Skipping journaled {resource}/{written_id}")
+                    return {
+                        "status_code": 200,
+                        "request_url": endpoint,
+                        "response": obj,
+                        "response_headers": {},
+                        "response_bytes": 0,
+                        "journaled": True,
+                    }
+
             if not validate_only:
                 if identifier is not None:
                     if self.idcache:
@@ -372,11 +705,13 @@ class FhirClient:
                             pass
 
                     else:
-                        result = self.get(f"{resource}?{identifier_type}={identifier}")
+                        result = self.get(
+                            f"{resource}?{identifier_type}={identifier}", elements="id"
+                        )
                         # If it wasn't found, then we just plan to create
                         if result.success():
                             if result.entry_count > 0:
-                                print(
+                                self.progress.message(
                                     f"get returned more than one ({result.entry_count}) resource: {identifier}"
                                 )
                                 entry = result.entries[0]
@@ -391,11 +726,20 @@ class FhirClient:
 
                     endpoint = f"{self.target_service_url}/{resource}/{obj['id']}"
 
+                if resource != "Bundle":
+                    unchanged = self._unchanged_result(resource, obj, endpoint)
+                    if unchanged is not None:
+                        return unchanged
+
+            if retry_count is None:
+                retry_count = self.performance.post_retries
             if retry_count is None:
                 retry_count = FhirClient.retry_post_count
 
             while retry_count > 0:
-                print(f"{verb}: {endpoint} url={obj.get('url')} id={obj.get('id')}")
+                self.progress.message(
+                    f"{verb}: {endpoint} url={obj.get('url')} id={obj.get('id')}"
+                )
                 success, result = self.send_request(verb, endpoint, json=obj)
 
                 # 422 just means something was preventing it from succeeding, so
@@ -406,21 +750,81 @@ class FhirClient:
                 if result["status_code"] not in [422, 409]:
                     retry_count = 0
                 else:
-                    print(f"Request failed with {result['status_code']}")
-
                     sleep(1)
-                    print(pformat(data))
-                    print("------------------")
-                    for issue in result["response"]["issue"]:
-                        if issue["severity"] == "error":
-                            print(pformat(issue))
+                    # Formatting the whole resource is expensive, so only
+                    # bother when it is going to be shown
+                    if self.progress.verbose:
+                        self.progress.message(
+                            f"Request failed with {result['status_code']}",
+                            detail=pformat(data),
+                        )
+                        self.progress.message("------------------")
+                        for issue in result["response"]["issue"]:
+                            if issue["severity"] == "error":
+                                self.progress.message(pformat(issue))
                     retry_count -= 1
-                    print(f"{result['status_code']} - {getIdentifier(obj)['value']}")
+                    self.progress.message(
+                        f"{result['status_code']} - {getIdentifier(obj)['value']}"
+                    )
                     if retry_count > 0:
-                        print(f"Retrying {retry_count} more times")
+                        self.progress.message(f"Retrying {retry_count} more times")
+
+            self.progress.record(ok=200 <= result["status_code"] < 300)
+
+            if not validate_only and resource != "Bundle":
+                self.record_write(resource, obj, result)
+            if journaled is not None:
+                self.journal.record(
+                    resource,
+                    journaled,
+                    self._written_id(resource, result),
+                    result["status_code"],
+                )
 
             return result
 
+    def _unchanged_result(self, resource, obj, endpoint):
+        """Return a stand-in result if the change tracker knows obj is already on the server"""
+        if self.change_tracker is None or not self.change_tracker.is_unchanged(
+            resource, obj
+        ):
+            return None
+
+        self.logger.debug(f"Skipping unchanged {resource}/{obj['id']}")
+        return {
+            "status_code": 200,
+            "request_url": endpoint,
+            "response": obj,
+            "response_headers": {},
+            "response_bytes": 0,
+            "unchanged": True,
+        }
+
+    def record_write(self, resource, obj, result):
+        """Let the change tracker know what is now on the server after a successful write
+
+        post, update and load do this themselves; it's for writes made directly
+        with send_request (result being what that returned).
+        """
+        if self.change_tracker is None or not (200 <= result["status_code"] < 300):
+            return
+
+        self.change_tracker.record(resource, obj, id=self._written_id(resource, result))
+
+    def _written_id(self, resource, result):
+        """The id of the resource a write created or updated, if the result says"""
+        # POSTs don't know their id until the server assigns it
+        response = result["response"]
+        if isinstance(response, dict) and response.get("resourceType") == resource:
+            return response.get("id")
+        elif "Location" in result["response_headers"]:
+            location = result["response_headers"]["Location"].split("/_history")[0]
+            return location.split("/")[-1]
+        return None
+
+    @_traced
+    @_memory_profiled
+    @_deadline_scoped
     def get(
         self,
         resource,
@@ -430,16 +834,28 @@ class FhirClient:
         elements=None,
         headers=None,
         except_on_error=True,
+        summary=None,
+        checkpoint=None,
     ):
         """Wrapper for basic http:get
 
         :param resource: FHIR Resource type
         :param recurse: Aggregate responses across pages, defaults to True
         :type recurse: Boolean
-        :param rec_count: records per page, defaults to 250
-        :type rec_count: int
+        :param rec_count: records per page, defaults to the server's choice. "auto" lets the
+            client's PageSizer choose, adjusting it from page to page
+        :type rec_count: int or "auto"
         :param raw_result: Return the actual result from the server instead of wrapping it as a FhirResult, defaults to False
         :type raw_result: Boolean
+        :param elements: Project the results onto these elements (_elements)
+        :type elements: str or list of strings
+        :param summary: Request a summary form of the results (_summary), such as "data" or "count"
+        :type summary: str
+        :param checkpoint: Save progress here so that a failed harvest can resume where it left off
+        :type checkpoint: PaginationCheckpoint
+        :param deadline: Seconds (or a Deadline) allowed for every page, retry and token refresh,
+            defaults to the host's operation_timeout. If it passes, the DeadlineExceeded carries
+            the pages fetched so far as its partial result
         :return: zero or more records inside a FhirResult (or raw response from server)
         :rtype: FhirResult
 
@@ -447,25 +863,294 @@ class FhirClient:
         attention for less straightforward queries
         """
 
-        count = ""
-        if rec_count > 0:
-            count = f"?_count={rec_count}"
+        url = self._query_url(
+            resource, rec_count=rec_count, elements=elements, summary=summary
+        )
+        page_type = self._page_type(resource, rec_count)
+        if checkpoint is not None and recurse and not raw_result:
+            return self._checkpointed_get(url, checkpoint, headers=headers, page_type=page_type)
 
-            if "?" in resource:
-                count = f"&_count={rec_count}"
+        pages = self._paginate(
+            url, headers=headers, except_on_error=except_on_error, page_type=page_type
+        )
+        result = next(pages)
 
-        if elements is not None:
-            if "?" in resource or "?" in count:
-                count = f"{count}&_elements={elements}"
+        if raw_result:
+            return result
+        content = FhirResult(result)
+
+        # Follow paginated results if so desired
+        if recurse:
+            page_count = 1
+            try:
+                for result in pages:
+                    content.append(result)
+                    page_count += 1
+            except DeadlineExceeded as e:
+                e.progress.update(pages=page_count, entries=len(content.entries))
+                e.partial = content
+                raise
+        return content
+
+    def _checkpointed_get(self, url, checkpoint, headers=None, page_type=None):
+        """get, with each page spooled by the checkpoint so a resumed run still returns everything"""
+        checkpoint.spool = True
+        content = None
+        for result in self._paginate(
+            url, headers=headers, checkpoint=checkpoint, page_type=page_type
+        ):
+            if content is None:
+                content = FhirResult(result)
+                # The pages from before we resumed come back from the spool
+                content.entries = checkpoint.spooled_entries() + content.entries
+                content.entry_count = len(content.entries)
             else:
-                count = f"?_elements={elements}"
+                content.append(result)
+
+        # Everything has been handed back, so there is nothing left to resume
+        checkpoint.clear()
+        return content
+
+    def iter_pages(
+        self,
+        resource,
+        rec_count=-1,
+        elements=None,
+        headers=None,
+        except_on_error=True,
+        summary=None,
+        checkpoint=None,
+    ):
+        """Yield each page of a query as its own FhirResult
+
+        Unlike get, the entries are never aggregated, so callers that process
+        results a page at a time (such as fhirq's streaming output) only ever
+        hold a single page in memory.
+
+        :param resource: FHIR Resource type or query (or a full URL)
+        :param rec_count: records per page, defaults to the server's choice. "auto" lets the
+            client's PageSizer choose, adjusting it from page to page
+        :type rec_count: int or "auto"
+        :param checkpoint: Save progress here so that a failed harvest can resume where it left off.
+            When resuming, only the pages that weren't handled last time are yielded
+        :type checkpoint: PaginationCheckpoint
+        :return: generator of FhirResult, one per page
+        """
+        url = self._query_url(
+            resource, rec_count=rec_count, elements=elements, summary=summary
+        )
+        for result in self._paginate(
+            url,
+            headers=headers,
+            except_on_error=except_on_error,
+            checkpoint=checkpoint,
+            page_type=self._page_type(resource, rec_count),
+        ):
+            yield FhirResult(result)
+
+    def _page_type(self, resource, rec_count):
+        """The resource type whose page size is adapted as resource is paged through, if any"""
+        if rec_count != "auto":
+            return None
+        return resource.split("?")[0].rstrip("/").split("/")[-1]
+
+    def page_size(self, resource_type):
+        """The page size the PageSizer would use for resource_type, probing the server's limit first"""
+        if not self.page_sizer.probed:
+            self.page_sizer.probe(self, resource_type)
+        return self.page_sizer.size_for(resource_type)
+
+    def _query_url(self, resource, rec_count=-1, elements=None, summary=None):
+        """Build the full URL for a query, adding _count, _elements and _summary if provided"""
+        if rec_count == "auto":
+            rec_count = self.page_size(self._page_type(resource, rec_count))
+
+        params = []
+        if rec_count > 0:
+            params.append(f"_count={rec_count}")
+
+        if elements is not None:
+            if not isinstance(elements, str):
+                elements = ",".join(elements)
+            params.append(f"_elements={elements}")
+
+        if summary is not None:
+            params.append(f"_summary={summary}")
+
+        if len(params) > 0:
+            sep = "&" if "?" in resource else "?"
+            resource = f"{resource}{sep}{'&'.join(params)}"
 
         if resource[0:4] == "http":
-            url = f"{resource}{count}"
+            return resource
+        return f"{self.target_service_url}/{resource}"
+
+    def capability_statement(self, reset=False):
+        """Return the server's CapabilityStatement, fetching it only once"""
+        with self.capability_lock:
+            if reset or self._capability_statement is None:
+                self._capability_statement = self.get(
+                    "metadata", recurse=False
+                ).entries[0]
+                self._search_param_support = {}
+            return self._capability_statement
+
+    def supports_search_param(self, name, resource_type=None):
+        """Report whether the server honors a search (or result) parameter
+
+        Returns True if the CapabilityStatement declares the parameter, either
+        for all resources or for resource_type. Many servers support _summary
+        and _elements without declaring them, so an undeclared parameter is
+        reported as None (unknown) until a response shows whether or not it was
+        honored. A parameter found to be ignored is reported as False.
+        """
+        key = (name, resource_type)
+        if key not in self._search_param_support:
+            cs = self.capability_statement()
+            declared = None
+            for rest in cs.get("rest", []):
+                params = list(rest.get("searchParam", []))
+                for resource in rest.get("resource", []):
+                    if resource_type is None or resource.get("type") == resource_type:
+                        params += resource.get("searchParam", [])
+                if name in [param.get("name") for param in params]:
+                    declared = True
+            self._search_param_support[key] = declared
+        return self._search_param_support[key]
+
+    @_traced
+    def count(self, resource, headers=None):
+        """Return the number of records matching a search without downloading them
+
+        Uses _summary=count when the server honors it, otherwise falls back to
+        paging through the ids alone.
+        """
+        resource_type = resource.split("?")[0].split("/")[0]
+        key = ("_summary", resource_type)
+        if self.supports_search_param("_summary", resource_type) is not False:
+            result = self.get(resource, recurse=False, summary="count", headers=headers)
+            if "total" in result.response:
+                return result.response["total"]
+            self._search_param_support[key] = False
+
+        total = 0
+        for page in self.iter_pages(resource, elements="id", headers=headers):
+            if "total" in page.response:
+                return page.response["total"]
+            total += page.entry_count
+        return total
+
+    def get_ids(self, resource, identifiers=False, rec_count=-1, headers=None):
+        """Harvest just the ids (and, optionally, the identifiers) of matching records
+
+        :param resource: FHIR Resource type or search
+        :param identifiers: Also return each record's identifiers
+        :type identifiers: Boolean
+        :return: list of ids or, when identifiers is True, a dict mapping id => list of identifiers
+        """
+        elements = ["id"]
+        if identifiers:
+            elements.append("identifier")
+
+        ids = {}
+        for page in self.iter_pages(
+            resource, rec_count=rec_count, elements=elements, headers=headers
+        ):
+            for entry in page.entries:
+                record = entry.get("resource", entry)
+                if "id" in record:
+                    idnt = record.get("identifier", [])
+                    if type(idnt) is not list:
+                        idnt = [idnt]
+                    ids[record["id"]] = idnt
+
+        if identifiers:
+            return ids
+        return list(ids.keys())
+
+    @_traced
+    def fetch_graph(
+        self,
+        resource_type,
+        ids=None,
+        query=None,
+        include=None,
+        revinclude=None,
+        chunk_size=50,
+        max_workers=None,
+        graph=None,
+    ):
+        """Fetch resources along with those they reference or are referenced by
+
+        Each search uses _include/_revinclude so that a whole hop of the graph
+        comes back together rather than one search per hop per resource. When
+        ids are provided, they are split into chunks (_id=a,b,c...) which are
+        searched in parallel.
+
+        :param resource_type: The type of the resources to start from
+        :param ids: ids (or Type/id references) of the starting resources
+        :type ids: list of strings
+        :param query: search parameters used to find the starting resources when ids aren't provided
+        :type query: str
+        :param include: _include values, such as "Specimen:subject"
+        :type include: list of strings
+        :param revinclude: _revinclude values, such as "Condition:subject"
+        :type revinclude: list of strings
+        :param max_workers: Searches run at once, defaults to the host's performance concurrency
+        :type max_workers: int
+        :param graph: Add the resources to an existing graph, such as one from an earlier hop
+        :type graph: ResourceGraph
+        :return: every resource returned, indexed by Type/id
+        :rtype: ResourceGraph
+        """
+        if graph is None:
+            graph = ResourceGraph()
+        if max_workers is None:
+            max_workers = self.performance.concurrency
+
+        params = [f"_include={value}" for value in include or []]
+        params += [f"_revinclude={value}" for value in revinclude or []]
+
+        searches = []
+        if ids is None:
+            if query is not None:
+                params = [query] + params
+            searches.append("&".join(params))
         else:
-            url = f"{self.target_service_url}/{resource}{count}"
+            ids = [id.split("/")[-1] for id in ids]
+            for start in range(0, len(ids), chunk_size):
+                chunk = ",".join(ids[start : start + chunk_size])
+                searches.append("&".join([f"_id={chunk}"] + params))
+
+        def fetch(search):
+            qry = resource_type
+            if search:
+                qry = f"{resource_type}?{search}"
+            for page in self.iter_pages(qry):
+                graph.add_entries(page.entries)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Make sure any exceptions raised by the searches make it back to us
+            for _ in executor.map(fetch, searches):
+                pass
+
+        return graph
+
+    def _paginate(
+        self, url, headers=None, except_on_error=True, checkpoint=None, page_type=None
+    ):
+        """Yield the raw result for url followed by each page it links to
+
+        When page_type is given, each page's _count is adjusted by the PageSizer.
+        """
+        if checkpoint is not None:
+            yield from self._checkpointed_pages(
+                url, checkpoint, headers=headers, page_type=page_type
+            )
+            return
 
-        success, result = self.send_request("GET", f"{url}", headers=headers)
+        page_number = 1
+        success, result, elapsed = self._fetch_page(url, page_number, headers=headers)
 
         # We'll skip printing this if we return the error to the calling function
         if not success and except_on_error:
@@ -476,27 +1161,106 @@ class FhirClient:
         if except_on_error:
             ExceptOnFailure(success, url, result)
 
-        if raw_result:
-            return result
-        content = FhirResult(result)
+        yield result
 
-        # Follow paginated results if so desired
-        while recurse and content.next is not None:
-            # print(content.next)
-            success, result = self.send_request("GET", content.next, headers=headers)
+        next_url = self._next_page(page_type, url, result, elapsed)
+        while next_url is not None:
+            page_number += 1
+            success, result, elapsed = self._fetch_page(next_url, page_number, headers=headers)
 
             ExceptOnFailure(success, url, result)
-            content.append(result)
-        return content
+            yield result
+            next_url = self._next_page(page_type, next_url, result, elapsed)
+
+    def _fetch_page(self, page_url, page_number, headers=None):
+        """GET a page of a search, returning (success, result, seconds it took)"""
+        with span(
+            "page", {"fhir.page": page_number, "http.url": page_url}
+        ) as page_span:
+            started = perf_counter()
+            success, result = self.send_request("GET", page_url, headers=headers)
+            elapsed = perf_counter() - started
+            if isinstance(result["response"], dict):
+                page_span.set_attribute(
+                    "fhir.entries", len(result["response"].get("entry", []))
+                )
+        return success, result, elapsed
+
+    def _next_page(self, page_type, page_url, result, elapsed):
+        """The page after result, with its _count adjusted when paging adaptively"""
+        next_url = FhirResult(result).next
+        if page_type is None or not isinstance(result["response"], dict):
+            return next_url
+
+        size = self.page_sizer.observe(
+            page_type,
+            requested_count(page_url) or 0,
+            result["response"],
+            elapsed,
+            result.get("response_bytes", 0),
+        )
+        if next_url is not None and requested_count(next_url) is not None:
+            next_url = with_count(next_url, size)
+        return next_url
+
+    def _checkpointed_pages(self, url, checkpoint, headers=None, page_type=None):
+        """Like _paginate, but saving progress to (and resuming from) checkpoint
+
+        Progress is saved once the caller asks for the page after the one it
+        was given, so a page is never skipped because the run died while it
+        was being handled.
+        """
+        url = checkpoint.prepare(url)
+        page_url = url
+        if checkpoint.resume(url):
+            page_url = checkpoint.next
+            print(
+                f"Resuming {url} after {checkpoint.pages} pages ({checkpoint.entries} entries)"
+            )
+
+        page_number = checkpoint.pages
+        while page_url is not None:
+            page_number += 1
+            success, result, elapsed = self._fetch_page(page_url, page_number, headers=headers)
+
+            # The cursor may have expired, so restart the search from where we were
+            if not success and page_url != url:
+                window_url = checkpoint.window_url()
+                if window_url is not None:
+                    print(f"Unable to follow {page_url}, continuing with {window_url}")
+                    success, result = self.send_request("GET", window_url, headers=headers)
+                    if success:
+                        checkpoint.drop_seen(result["response"])
+
+            ExceptOnFailure(success, url, result)
+            yield result
+
+            page_url = self._next_page(page_type, page_url, result, elapsed)
+            checkpoint.record(result["response"], page_url)
 
     def sleep_until(
-        self, endpt_orig, target_count, sleep_time=5, timeout=360, message=""
+        self,
+        endpt_orig,
+        target_count,
+        sleep_time=5,
+        timeout=360,
+        message="",
+        count_only=False,
     ):
+        """Poll a query until it matches target_count records or timeout seconds pass
+
+        count_only asks the server for just the count (_summary=count), which
+        keeps each poll small when the matching records aren't needed.
+        """
         endpt = endpt_orig
 
+        summary = None
+        if count_only and self.supports_search_param("_summary") is not False:
+            summary = "count"
+
         n = 0
         while True:
-            response = self.get(endpt, rec_count=-1)
+            response = self.get(endpt, rec_count=-1, summary=summary)
             entries = response.entries
 
             if len(entries) > 0:
@@ -511,19 +1275,23 @@ class FhirClient:
             entry_count = len(entries)
             if "total" in response.response:
                 entry_count = response.response["total"]
+            # Progress is reported a whole line at a time so that threads
+            # waiting on different queries don't garble each other's output
             if entry_count == target_count or n >= timeout:
                 if n > 0:
-                    print(f"{n} seconds. ")
+                    with log_lock:
+                        print(f"{message} - {n} seconds. ")
                 return response
             if n == 0:
-                print(
-                    f"{message} - Waiting for {target_count}. Sleeping {sleep_time}",
-                    end="",
-                    flush=True,
-                )
+                with log_lock:
+                    print(
+                        f"{message} - Waiting for {target_count}. Sleeping {sleep_time}"
+                    )
             n += sleep_time
+            deadline = current_deadline()
+            if deadline is not None:
+                deadline.check({"polled": n})
             sleep(sleep_time)
-            print(".", end="", flush=True)
 
     # The next few methods are pulled form the KF client object. These should be
     # revisited to make sure we really need them and that they work as well as
@@ -533,6 +1301,9 @@ class FhirClient:
         Comb list of issues in FHIR response and return the ones marked error
         """
         response_body = response_body or {}
+        if isinstance(response_body, str):
+            # Not JSON, so there are no issues to comb through
+            return []
         try:
             return [
                 issue
@@ -547,10 +1318,11 @@ class FhirClient:
         Try to parse response body as JSON, otherwise return the
         text version of body
         """
-        try:
-            resp_content = response.json()
-        except decoder.JSONDecodeError:
-            resp_content = response.text
+        with timed(self.profiler, "json"):
+            try:
+                resp_content = response.json()
+            except decoder.JSONDecodeError:
+                resp_content = response.text
         return resp_content
 
     def send_request(self, request_method_name, url, **request_kwargs):
@@ -568,6 +1340,7 @@ class FhirClient:
                 'status_code': response.status_code,
                 'response': response.json() or response.text,
                 'response_headers': response.headers,
+                'response_bytes': len(response.content),
             }
 
         :param request_method_name: requests method name
@@ -579,6 +1352,23 @@ class FhirClient:
         :returns: tuple of the form
         (success boolean, result dict)
         """
+        if get_tracer() is None:
+            return self._send_request(request_method_name, url, **request_kwargs)
+
+        attributes = {"http.method": request_method_name.upper(), "http.url": url}
+        if url.startswith(f"{self.target_service_url}/"):
+            path = url[len(self.target_service_url) + 1 :]
+            if path and path[0].isupper():
+                attributes["fhir.resource_type"] = _resource_type(path)
+        with span("send_request", attributes) as request_span:
+            success, result = self._send_request(request_method_name, url, **request_kwargs)
+            request_span.set_attribute("http.status_code", result["status_code"])
+            request_span.set_attribute("fhir.response_bytes", result["response_bytes"])
+            request_span.set_attribute("fhir.success", success)
+            return success, result
+
+    def _send_request(self, request_method_name, url, **request_kwargs):
+        """send_request, without the tracing"""
         success = False
 
         headers = self.get_login_header(headers=request_kwargs.get("headers"))
@@ -594,20 +1384,48 @@ class FhirClient:
         # Requested by Alex to overcome issue with authentication
         # 2025-10-31
         request_kwargs["allow_redirects"] = False
-        self.auth.update_request_args(request_kwargs)
+        with timed(self.profiler, "auth"):
+            self.auth.update_request_args(request_kwargs)
 
-        # Send request
+        # Send request. Compression is applied to a copy of the arguments so
+        # that the uncompressed body is still around for the logs
         request_method = getattr(self.session, request_method_name.lower())
 
-        response = request_method(url, **request_kwargs)
-        resp_content = self._response_content(response)
+        timeout = self.performance.timeout()
+        if timeout is not None:
+            request_kwargs.setdefault("timeout", timeout)
 
+        # Token refreshes and rate limiting count against the deadline too, and
+        # rather than wait for the rate limit past the deadline, give up now
+        deadline = current_deadline()
+        if deadline is not None:
+            deadline.check({"url": url})
         try:
-            response.json()
-        except decoder.JSONDecodeError:
-            print(f"{request_method_name}:{url}")
-            with open("Error_message.html", "wt") as outf:
-                outf.write(resp_content)
+            self.rate_limiter.acquire(request_method_name, deadline)
+        except DeadlineExceeded as e:
+            e.progress["url"] = url
+            raise
+        if deadline is not None:
+            deadline.check({"url": url})
+            request_kwargs["timeout"] = deadline.clamp(request_kwargs.get("timeout"))
+
+        started = perf_counter()
+        try:
+            # urllib3's retries take their tokens from this client's budget
+            with timed(self.profiler, "network"), rate_limit_scope(self.rate_limiter):
+                response = request_method(
+                    url, **self.compression.update_request_args(request_kwargs)
+                )
+        except requests.exceptions.RequestException as e:
+            if deadline is not None and deadline.expired():
+                raise DeadlineExceeded(deadline, {"url": url}) from e
+            raise
+        elapsed = perf_counter() - started
+        if response.status_code == 429:
+            self.rate_limiter.throttle(
+                request_method_name, response.headers.get("Retry-After")
+            )
+        resp_content = self._response_content(response)
 
         # Determine success and log result
         request_method_name = request_method_name.upper()
@@ -623,7 +1441,15 @@ class FhirClient:
                 self.logger.debug(f"{request_method_name} {request_url} succeeded. ")
             else:
                 self.logwrite(request_method_name, url, errors, **request_kwargs)
-                print(request_kwargs["json"])
+                self.errors.record(
+                    request_method_name,
+                    request_url,
+                    response.status_code,
+                    "error issues",
+                    resp_content,
+                    request_body=request_kwargs.get("json"),
+                    elapsed=elapsed,
+                )
                 self.logger.error(f"{request_method_name} {request_url} failed. ")
         else:
             self.logwrite(
@@ -631,13 +1457,20 @@ class FhirClient:
             )
             self.logwrite(request_method_name, url, resp_content, **request_kwargs)
 
-            if request_method_name.lower() == "POST":
-                print(
-                    pformat(
-                        f"There was an issue with the POST: \n{request_kwargs['json']}"
-                    )
-                )
-                print(pformat(response.json()))
+            # Proxies and load balancers tend to answer with HTML
+            if isinstance(resp_content, str) and resp_content.strip():
+                reason = "non-JSON response"
+            else:
+                reason = f"HTTP {response.status_code}"
+            self.errors.record(
+                request_method_name,
+                request_url,
+                response.status_code,
+                reason,
+                resp_content,
+                request_body=request_kwargs.get("json"),
+                elapsed=elapsed,
+            )
             self.logger.error(
                 f"{request_method_name} {request_url} failed, "
                 f"status {response.status_code}. "
@@ -650,6 +1483,7 @@ class FhirClient:
                 "request_url": request_url,
                 "response": resp_content,
                 "response_headers": response.headers,
+                "response_bytes": len(response.content),
             },
         )
 
@@ -705,80 +1539,97 @@ def exec():
         help="A query to pass to the host. You need only the portion starting with the resource type. ",
     )
 
-    args = parser.parse_args(sys.argv[1:])
-    fhir_client = FhirClient(host_config[args.host])
+    parser.add_argument(
+        "--query-file",
+        type=FileType("rt"),
+        help="File containing one query per line. Blank lines and lines starting with # are ignored.",
+    )
+    parser.add_argument(
+        "--format",
+        "-f",
+        choices=output_formats,
+        default="json",
+        help="Output format: a single JSON document (json) or one resource per line (jsonl). Either way, results are written page by page as they arrive.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        "-c",
+        type=int,
+        default=None,
+        help="Number of queries to run at the same time (defaults to the host's performance concurrency, 4 unless configured)",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        help="Profile the run, writing cProfile output and a breakdown of where the time went to this directory. cProfile only sees the main thread, so use -c 1 to profile the queries themselves.",
+    )
+    parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help="Also track the peak memory of each query (slows things down considerably)",
+    )
 
-    print(f"FHIR Server: {fhir_client.target_service_url}")
+    args = parser.parse_args(sys.argv[1:])
+    profiler = None
+    if args.profile is not None:
+        profiler = Profiler(args.profile, track_memory=args.profile_memory)
+        profiler.start()
+    fhir_client = FhirClient(host_config[args.host], profiler=profiler)
+
+    queries = list(args.query or [])
+    if args.query_file is not None:
+        for line in args.query_file:
+            line = line.strip()
+            if line and line[0] != "#":
+                queries.append(line)
 
     out_log = args.out
     if out_log is None:
         out_log = sys.stdout
-    if args.out is not None:
-        out_log.write("[\n  ")
-        dump(
-            {
-                "FHIR Server": fhir_client.target_service_url,
-                "Time Stamp": str(datetime.now()),
-            },
-            out_log,
-            indent=2,
-        )
-        out_log.write(",\n  ")
 
-    do_continue = True
-    query_count = 0
+    # Keep the summaries out of the results when they are going to stdout
+    console = Console(stderr=args.out is None)
+    console.print(f"FHIR Server: {fhir_client.target_service_url}")
+
+    concurrency = args.concurrency
+    if concurrency is None:
+        concurrency = fhir_client.performance.concurrency
+    streamer = QueryStreamer(fhir_client, out_log, fmt=args.format, concurrency=concurrency)
+    streamer.begin(
+        {
+            "FHIR Server": fhir_client.target_service_url,
+            "Time Stamp": str(datetime.now()),
+        }
+    )
 
-    while do_continue:
-        try:
-            if args.query is None or len(args.query) == 0:
+    summaries = []
+    if len(queries) > 0:
+        summaries = streamer.run(queries)
+    else:
+        while True:
+            try:
                 qry = input("FHIR Query (or 'exit'): ")
-                do_continue = qry.lower() != "exit"
-            else:
-                qry = args.query[query_count]
-
-            if do_continue:
-                start_time = datetime.now()
-                response = fhir_client.get(qry, except_on_error=False)
-                query_time = datetime.now()
-
-                if args.out is not None:
-                    if query_count > 0:
-                        out_log.write(",\n")
-                    out_log.write("  ")
-
-                if response.success():
-                    dump(
-                        {
-                            "Query": qry,
-                            "Query Time": str(query_time - start_time),
-                            "Time Stamp": str(datetime.now()),
-                            "Status Code": response.status_code,
-                            "Record Count": len(response.entries),
-                            "Entries": response.entries,
-                        },
-                        out_log,
-                        indent=2,
-                    )
-                    if args.out is not None:
-                        print(response.entries[0:2])
-                        print(f"Total Responses: {len(response.entries)}")
-                else:
-                    dump(
-                        {
-                            "Query": qry,
-                            "Query Time": str(query_time - start_time),
-                            "Time Stamp": str(datetime.now()),
-                            "Status Code": response.status_code,
-                            "Response": response.response,
-                        },
-                        out_log,
-                        indent=2,
-                    )
-                    print(f"ERROR: {response.response['issue']}")
-                query_count += 1
+            except EOFError:
+                break
+            if qry.strip() == "" or qry.lower() == "exit":
+                break
+            summary = streamer.run([qry])[0]
+            out_log.flush()
+            summaries.append(summary)
+            console.print(summary_table([summary]))
 
-        except Exception:
-            do_continue = False
+    streamer.end()
 
-    if args.out:
-        out_log.write("\n]\n")
+    if args.out is not None:
+        args.out.close()
+    if len(queries) > 0:
+        console.print(summary_table(summaries))
+
+    for summary in summaries:
+        if not summary.success():
+            console.print(f"ERROR ({summary.query}): {pformat(summary.error)}")
+
+    if profiler is not None:
+        profiler.stop()
+        for path in profiler.write():
+            console.print(f"Profile written to {path}")
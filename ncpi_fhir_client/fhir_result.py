@@ -15,6 +15,8 @@ class FhirResult:
         self.status_code = payload['status_code']
         self.request_url = payload['request_url']
         self.response = payload['response']
+        # Size of the raw response body, when the caller knows it
+        self.response_bytes: int = payload.get('response_bytes', 0)
 
         # Empty bundles don't have an entry
         if 'total' in self.response and self.response['total'] == 0:
@@ -12,6 +12,22 @@ from yaml import safe_load
 from rich import print
 from . import die_if
 from . import fhir_auth
+from .compression import CompressionSettings
+from .connection_pool import PoolSettings
+from .error_capture import ErrorCapture
+from .performance import PerformanceProfile
+from .progress import ProgressReporter
+from .rate_limit import RateLimitSettings
+
+# Sections of a host's configuration checked before any work is done
+checked_sections = {
+    "performance": PerformanceProfile.from_cfg,
+    "compression": CompressionSettings.from_cfg,
+    "connection_pool": PoolSettings.from_cfg,
+    "rate_limit": RateLimitSettings.from_cfg,
+    "error_capture": ErrorCapture.from_cfg,
+    "progress": ProgressReporter.from_cfg,
+}
 
 def example_config(writer: TextIO, auth_type: str | None = None) -> None:
     """Returns a block of text containing one or all possible auth modules example configurations"""
@@ -32,7 +48,11 @@ def example_config(writer: TextIO, auth_type: str | None = None) -> None:
 #                         by the specified host
 #
 # Please note that there can be multiple hosts that use the same authentication
-# mechanism. Users must ensure that each host has a unique "key" """,
+# mechanism. Users must ensure that each host has a unique "key"
+#
+# Hosts may also carry a performance section (page_size, concurrency, retries,
+# timeouts, etc.) to tune the client for that server. See
+# ncpi_fhir_client.performance for the full list of settings. """,
         file=writer,
     )
     for key in modules.keys():
@@ -55,4 +75,19 @@ found. Example configuration has been written to stout providing examples
 for each of the auth types currently supported.\n"""
         )
 
-    return safe_load(host_config_filename.open("rt"))
\ No newline at end of file
+    host_config = safe_load(host_config_filename.open("rt"))
+
+    # Catch typos in the settings before any work is done
+    for name, cfg in (host_config or {}).items():
+        if isinstance(cfg, dict):
+            for section, from_cfg in checked_sections.items():
+                try:
+                    from_cfg(cfg)
+                except (ValueError, TypeError) as e:
+                    die_if(True, f"Invalid {section} settings for host, {name}: {e}")
+    return host_config
+
+
+def performance_profile(cfg: dict[str, Any]) -> PerformanceProfile:
+    """Return the performance profile for a single host's configuration"""
+    return PerformanceProfile.from_cfg(cfg)
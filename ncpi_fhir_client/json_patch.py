@@ -0,0 +1,143 @@
+"""
+Generate (and apply) RFC 6902 JSON Patch documents.
+
+make_patch aims for a small patch rather than a provably minimal one: lists
+have their common prefix and suffix trimmed so that insertions and deletions
+don't turn into a replace for every element that follows, and any nested
+diff that would serialize larger than simply replacing the value is swapped
+for that replace.
+"""
+from __future__ import annotations
+
+from copy import deepcopy
+from json import dumps
+from typing import Any
+
+
+def escape(key: str) -> str:
+    """Escape a key for use in a JSON Pointer"""
+    return key.replace("~", "~0").replace("/", "~1")
+
+
+def unescape(token: str) -> str:
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def patch_size(patch: list[dict[str, Any]]) -> int:
+    return len(dumps(patch, separators=(",", ":")))
+
+
+def make_patch(source: Any, target: Any, path: str = "") -> list[dict[str, Any]]:
+    """Return the operations required to turn source into target
+
+    :param path: JSON Pointer to the location of source within the document being patched
+    """
+    if source == target:
+        return []
+
+    if type(source) is not type(target) or not isinstance(source, (dict, list)):
+        return [{"op": "replace", "path": path, "value": target}]
+
+    if isinstance(source, dict):
+        patch = _diff_dicts(source, target, path)
+    else:
+        patch = _diff_lists(source, target, path)
+
+    replace = [{"op": "replace", "path": path, "value": target}]
+    if path and patch_size(replace) < patch_size(patch):
+        return replace
+    return patch
+
+
+def _diff_dicts(
+    source: dict[str, Any], target: dict[str, Any], path: str
+) -> list[dict[str, Any]]:
+    patch = []
+    for key in source:
+        if key not in target:
+            patch.append({"op": "remove", "path": f"{path}/{escape(key)}"})
+
+    for key, value in target.items():
+        if key not in source:
+            patch.append({"op": "add", "path": f"{path}/{escape(key)}", "value": value})
+        else:
+            patch += make_patch(source[key], value, f"{path}/{escape(key)}")
+    return patch
+
+
+def _diff_lists(source: list[Any], target: list[Any], path: str) -> list[dict[str, Any]]:
+    # Trim the items the lists have in common at either end
+    prefix = 0
+    while (
+        prefix < len(source)
+        and prefix < len(target)
+        and source[prefix] == target[prefix]
+    ):
+        prefix += 1
+
+    suffix = 0
+    while (
+        suffix < len(source) - prefix
+        and suffix < len(target) - prefix
+        and source[-1 - suffix] == target[-1 - suffix]
+    ):
+        suffix += 1
+
+    source_middle = source[prefix : len(source) - suffix]
+    target_middle = target[prefix : len(target) - suffix]
+
+    patch = []
+    for index in range(min(len(source_middle), len(target_middle))):
+        patch += make_patch(
+            source_middle[index], target_middle[index], f"{path}/{prefix + index}"
+        )
+
+    # Each removal shifts the rest down, so they all happen at the same index
+    for _ in range(len(target_middle), len(source_middle)):
+        patch.append({"op": "remove", "path": f"{path}/{prefix + len(target_middle)}"})
+
+    for index in range(len(source_middle), len(target_middle)):
+        patch.append(
+            {"op": "add", "path": f"{path}/{prefix + index}", "value": target_middle[index]}
+        )
+    return patch
+
+
+def apply_patch(document: Any, patch: list[dict[str, Any]]) -> Any:
+    """Apply the add, remove and replace operations of a patch to a copy of document"""
+    document = deepcopy(document)
+
+    for operation in patch:
+        tokens = [unescape(token) for token in operation["path"].split("/")[1:]]
+        if len(tokens) == 0:
+            if operation["op"] == "remove":
+                document = None
+            else:
+                document = deepcopy(operation["value"])
+            continue
+
+        parent = document
+        for token in tokens[:-1]:
+            parent = parent[int(token)] if isinstance(parent, list) else parent[token]
+
+        last = tokens[-1]
+        op = operation["op"]
+        if isinstance(parent, list):
+            index = len(parent) if last == "-" else int(last)
+            if op == "add":
+                parent.insert(index, deepcopy(operation["value"]))
+            elif op == "remove":
+                del parent[index]
+            elif op == "replace":
+                parent[index] = deepcopy(operation["value"])
+            else:
+                raise ValueError(f"Unsupported patch operation, {op}")
+        else:
+            if op in ("add", "replace"):
+                parent[last] = deepcopy(operation["value"])
+            elif op == "remove":
+                del parent[last]
+            else:
+                raise ValueError(f"Unsupported patch operation, {op}")
+
+    return document
@@ -0,0 +1,174 @@
+"""
+Adaptive page sizes (_count) for searches.
+
+A fixed _count is a poor fit for every resource type: 200 ids come back in
+a blink, while 200 large Observations or DocumentReferences can take long
+enough to run into the server's (or a proxy's) timeout. Searches made with
+rec_count="auto" let a PageSizer pick the _count instead:
+
+  * The largest page the server honors is found by probing: a search asking
+    for max_page_size records that comes back with fewer, and a next link,
+    shows the server's cap. (The CapabilityStatement has no standard place
+    for this, so it is learned from the responses.) Every page is also
+    checked, in case the cap differs between resource types, but a short
+    page of a smaller _count is only taken as a cap once the same number of
+    matches comes back again, since servers also return short pages when
+    some results are filtered out.
+  * Each resource type's page size then follows the observed time and bytes
+    per entry, aiming for pages that take target_page_seconds and are no
+    larger than max_page_bytes. Sizes shrink straight away but only double
+    at most per page, so a single quick page can't overshoot.
+
+Within a search, the new size is applied by rewriting _count in the next
+link, which the common servers (HAPI, Smile and the GCP Healthcare API)
+honor. The limits come from the host's performance profile:
+
+    dev:
+        performance:
+            adaptive_paging: true       # use "auto" for the id harvest
+            min_page_size: 20
+            max_page_size: 1000
+            target_page_seconds: 10
+            max_page_bytes: 16777216
+"""
+from __future__ import annotations
+
+import re
+from collections import Counter
+from threading import Lock
+from typing import Any
+
+from ncpi_fhir_client.checkpoint import add_param
+
+# Matched in place so the rest of a server's next link is left exactly as it was
+_count_param = re.compile(r"([?&])_count=(\d+)")
+
+
+def with_count(url: str, count: int) -> str:
+    """url with its _count (added if need be) set to count"""
+    if _count_param.search(url) is None:
+        return add_param(url, f"_count={count}")
+    return _count_param.sub(lambda match: f"{match.group(1)}_count={count}", url, count=1)
+
+
+def requested_count(url: str) -> int | None:
+    """The _count url asks for, if any"""
+    match = _count_param.search(url)
+    return None if match is None else int(match.group(2))
+
+
+class PageSizer:
+    def __init__(
+        self,
+        initial: int = 200,
+        min_size: int = 20,
+        max_size: int = 1000,
+        target_seconds: float = 10,
+        max_bytes: int = 16 * 1024 * 1024,
+    ) -> None:
+        """
+        :param initial: Page size used for a resource type before anything is known about it
+        :param min_size: Smallest page size to use
+        :param max_size: Largest page size to use (and to probe for)
+        :param target_seconds: How long each page should take the server
+        :param max_bytes: Largest a page's response should be
+        """
+        assert 0 < min_size <= max_size, "page sizes must be positive, with min_size <= max_size"
+        self.min_size = min_size
+        self.max_size = max_size
+        self.initial = max(min_size, min(initial, max_size))
+        self.target_seconds = target_seconds
+        self.max_bytes = max_bytes
+
+        # The most the server will return in a single page, once known
+        self.server_limit: int | None = None
+        # How often each short page size has been seen
+        self.short_pages: Counter[int] = Counter()
+        self.probed = False
+        self.sizes: dict[str, int] = {}
+        self.lock = Lock()
+
+    @classmethod
+    def from_profile(cls, profile: Any) -> PageSizer:
+        """
+        :param profile: the host's settings
+        :type profile: PerformanceProfile
+        """
+        return cls(
+            initial=profile.page_size,
+            min_size=profile.min_page_size,
+            max_size=profile.max_page_size,
+            target_seconds=profile.target_page_seconds,
+            max_bytes=profile.max_page_bytes,
+        )
+
+    def _limit(self, size: float) -> int:
+        size = max(self.min_size, min(int(size), self.max_size))
+        if self.server_limit is not None:
+            size = min(size, self.server_limit)
+        return size
+
+    def size_for(self, resource_type: str) -> int:
+        """The _count to use for the next page of resource_type"""
+        with self.lock:
+            return self._limit(self.sizes.get(resource_type, self.initial))
+
+    def probe(self, fhir_client: Any, resource_type: str) -> int | None:
+        """Ask for a page of max_size ids to find out how many the server is willing to return
+
+        :param fhir_client: client used to reach the server
+        :type fhir_client: FhirClient
+        :return: The server's limit, if it has one
+        """
+        url = f"{fhir_client.target_service_url}/{resource_type}?_elements=id&_count={self.max_size}"
+        success, result = fhir_client.send_request("GET", url)
+        with self.lock:
+            self.probed = True
+        if success and isinstance(result["response"], dict):
+            self._check_limit(self.max_size, result["response"])
+        return self.server_limit
+
+    def _check_limit(self, requested: int, bundle: dict[str, Any]) -> None:
+        # _include'd resources and OperationOutcomes don't count towards _count
+        returned = sum(
+            1
+            for entry in bundle.get("entry", [])
+            if entry.get("search", {}).get("mode", "match") == "match"
+        )
+        has_next = any(link.get("relation") == "next" for link in bundle.get("link", []))
+        if not (has_next and 0 < returned < requested):
+            return
+        with self.lock:
+            self.short_pages[returned] += 1
+            if requested < self.max_size and self.short_pages[returned] < 2:
+                return
+            if self.server_limit is None or returned < self.server_limit:
+                self.server_limit = returned
+
+    def observe(
+        self, resource_type: str, requested: int, bundle: Any, seconds: float, nbytes: int
+    ) -> int:
+        """Learn from a page of resource_type, returning the size to use for the next one
+
+        :param requested: The _count the page was requested with
+        :param bundle: The page itself
+        :param seconds: How long the page took
+        :param nbytes: Size of the response
+        """
+        entries = len(bundle.get("entry", [])) if isinstance(bundle, dict) else 0
+        if entries == 0:
+            return self.size_for(resource_type)
+
+        self._check_limit(requested, bundle)
+        ideal = float(self.max_size)
+        if seconds > 0:
+            ideal = min(ideal, self.target_seconds * entries / seconds)
+        if nbytes > 0:
+            ideal = min(ideal, self.max_bytes * entries / nbytes)
+
+        with self.lock:
+            current = self.sizes.get(resource_type, self.initial)
+            # Shrink right away, but grow gradually
+            size = self._limit(min(ideal, max(current, requested) * 2))
+            self.sizes[resource_type] = size
+            return size
@@ -0,0 +1,170 @@
+"""
+Per-host performance profiles, so that each server can be tuned from its
+fhir_hosts entry rather than by changing code:
+
+    dev:
+        performance:
+            page_size: 200              # _count used when harvesting ids
+            adaptive_paging: false      # let a PageSizer choose the harvest's _count
+            min_page_size: 20           # limits on the adaptive page sizes
+            max_page_size: 1000
+            target_page_seconds: 10     # how long an adaptive page should take
+            max_page_bytes: 16777216    # largest an adaptive page should be
+            concurrency: 4              # default worker threads for the CLIs and fetch_graph
+            retries: 10                 # retries on read errors and retryable statuses
+            connect_retries: 1          # retries on connection errors
+            backoff_factor: 5           # urllib3 backoff between retries
+            retry_statuses: [429, 500, 502, 503, 504]
+            post_retries: 5             # attempts made by post (FhirClient.retry_post_count)
+            connect_timeout: 10         # seconds to wait for a connection
+            read_timeout: 300           # seconds to wait between bytes of the response
+            operation_timeout: 3600     # deadline for a whole get, post or load (unset means none)
+            pool_maxsize: 64            # same as connection_pool's pool_maxsize
+
+Every setting is optional and the defaults match the values that used to be
+hardcoded, other than the timeouts (requests used to wait forever) and
+retrying 429s (after the server's Retry-After). See
+ncpi_fhir_client.deadline for how operation_timeout is applied. pool_maxsize
+is accepted here for convenience; the connection_pool section wins if both
+set it.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any
+
+from urllib3.util.retry import Retry
+
+from ncpi_fhir_client import retry_strategy
+from ncpi_fhir_client.deadline import check_backoff, current_deadline
+from ncpi_fhir_client.rate_limit import current_rate_limiter
+from ncpi_fhir_client.tracing import get_tracer, span
+
+if TYPE_CHECKING:
+    from typing_extensions import Self
+
+
+class HostRetry(Retry):
+    """The urllib3 Retry mounted for each host, which also
+
+    - gives up rather than back off, wait out a Retry-After or wait for the
+      rate limit past the deadline in force (see deadline)
+    - takes a token from the sending client's rate limit budget for each
+      retry, since urllib3 re-sends without going through send_request, and
+      after a 429 lets the budget's wait stand in for its own (see rate_limit)
+    - makes each backoff a span (see tracing)
+    """
+
+    def increment(self, *args: Any, **kwargs: Any) -> Self:
+        retry = super().increment(*args, **kwargs)
+        check_backoff(retry)
+        return retry
+
+    def sleep(self, response: Any = None) -> None:
+        last = self.history[-1] if len(self.history) > 0 else None
+        with span("retry", self._span_attributes()):
+            limiter = current_rate_limiter()
+            if limiter is None or last is None or last.method is None:
+                check_backoff(self, response)
+                super().sleep(response)
+                return
+
+            retry_after = None if response is None else response.headers.get("Retry-After")
+            if not limiter.before_retry(last.method, last.status, retry_after):
+                check_backoff(self, response)
+                super().sleep(response)
+            # Waits out a 429's Retry-After as well, so it is bound by the deadline too
+            limiter.acquire(last.method, current_deadline())
+
+    def _span_attributes(self) -> dict[str, Any]:
+        if get_tracer() is None:
+            return {}
+        attributes: dict[str, Any] = {
+            "retry.attempt": len(self.history),
+            "retry.backoff": self.get_backoff_time(),
+        }
+        if len(self.history) > 0:
+            last = self.history[-1]
+            attributes["http.method"] = last.method
+            attributes["http.url"] = last.url
+            attributes["http.status_code"] = last.status
+            if last.error is not None:
+                attributes["retry.error"] = repr(last.error)
+        return attributes
+
+
+@dataclass(frozen=True)
+class PerformanceProfile:
+    page_size: int = 200
+    adaptive_paging: bool = False
+    min_page_size: int = 20
+    max_page_size: int = 1000
+    target_page_seconds: float = 10
+    max_page_bytes: int = 16 * 1024 * 1024
+    concurrency: int = 4
+    retries: int = 10
+    connect_retries: int = 1
+    backoff_factor: float = 5
+    retry_statuses: tuple[int, ...] = field(default=(429, 500, 502, 503, 504))
+    # None falls back on FhirClient.retry_post_count
+    post_retries: int | None = None
+    connect_timeout: float | None = 10
+    read_timeout: float | None = 300
+    operation_timeout: float | None = None
+    pool_maxsize: int | None = None
+
+    @classmethod
+    def from_cfg(cls, cfg: dict[str, Any]) -> PerformanceProfile:
+        """Build the profile from a host's configuration"""
+        settings = dict(cfg.get("performance") or {})
+        unknown = set(settings) - set(cls.__dataclass_fields__)
+        if len(unknown) > 0:
+            raise ValueError(f"Unknown performance settings: {sorted(unknown)}")
+
+        if "retry_statuses" in settings:
+            settings["retry_statuses"] = tuple(settings["retry_statuses"])
+        profile = cls(**settings)
+
+        for name in (
+            "page_size",
+            "min_page_size",
+            "target_page_seconds",
+            "max_page_bytes",
+            "concurrency",
+        ):
+            if not getattr(profile, name) > 0:
+                raise ValueError(f"performance {name} must be positive")
+        for name in ("retries", "connect_retries", "backoff_factor"):
+            if not getattr(profile, name) >= 0:
+                raise ValueError(f"performance {name} can't be negative")
+        for name in (
+            "post_retries",
+            "connect_timeout",
+            "read_timeout",
+            "operation_timeout",
+            "pool_maxsize",
+        ):
+            value = getattr(profile, name)
+            if not (value is None or value > 0):
+                raise ValueError(f"performance {name} must be positive")
+        if profile.min_page_size > profile.max_page_size:
+            raise ValueError("performance min_page_size can't be larger than max_page_size")
+        return profile
+
+    def retry(self) -> Retry:
+        """The urllib3.Retry to mount for this host"""
+        return retry_strategy(
+            total=self.retries,
+            read=self.retries,
+            connect=self.connect_retries,
+            status=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=self.retry_statuses,
+            retry_class=HostRetry,
+        )
+
+    def timeout(self) -> tuple[float | None, float | None] | None:
+        """The timeout to pass to requests, or None to wait forever"""
+        if self.connect_timeout is None and self.read_timeout is None:
+            return None
+        return (self.connect_timeout, self.read_timeout)
@@ -0,0 +1,212 @@
+"""
+Profiling for slow loads and harvests, without having to wrap the CLIs in
+profilers by hand. fhirq and ridcache take --profile DIR, which writes:
+
+    cprofile.pstats     cProfile output for the main thread (pstats, snakeviz...)
+    cprofile.txt        the functions with the most cumulative time
+    timings.json        wall clock time spent on the network, decoding JSON,
+                        in auth (including token refreshes) and everything else
+
+--profile-memory adds tracemalloc, writing memory.txt with the peak memory
+of RIdCache.load_ids_from_host, each get and each fhirq query, along with the
+top allocations at the highest peak. tracemalloc slows everything down
+considerably, so it is kept apart from the timings.
+
+Code can do the same by handing a Profiler to the client:
+
+    with Profiler("profile") as profiler:
+        client = FhirClient(cfg, profiler=profiler)
+        client.get("Observation")
+
+Network, JSON and auth times are summed over every thread, so with several
+threads they can add up to more than the wall clock; local processing is
+whatever wall clock time is left over. Memory peaks are for the whole
+process, so sections running at the same time share them.
+"""
+from __future__ import annotations
+
+import cProfile
+import json
+import pstats
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Lock
+from time import perf_counter
+from typing import Any, ContextManager, Iterator
+
+# What the wall clock time is broken down into (besides local processing)
+timing_categories = ["network", "json", "auth"]
+
+# Handed out when there is nothing to profile, so the hooks cost next to nothing
+_unprofiled = nullcontext()
+
+
+def timed(profiler: Profiler | None, category: str) -> ContextManager[Any]:
+    """Time the block as category, if there is a profiler"""
+    if profiler is None:
+        return _unprofiled
+    return profiler.timer(category)
+
+
+def memory_section(profiler: Profiler | None, label: str) -> ContextManager[Any]:
+    """Track the block's peak memory, if there is a profiler tracking memory"""
+    if profiler is None or not profiler.track_memory:
+        return _unprofiled
+    return profiler.memory(label)
+
+
+@dataclass
+class MemorySection:
+    label: str
+    # Traced memory when the section began
+    start: int
+    peak: int = 0
+
+    @property
+    def growth(self) -> int:
+        return max(0, self.peak - self.start)
+
+
+class Profiler:
+    def __init__(
+        self,
+        output_dir: str | Path,
+        cpu: bool = True,
+        track_memory: bool = False,
+        top: int = 50,
+    ) -> None:
+        """
+        :param output_dir: Where the results are written
+        :param cpu: Run cProfile (on the thread that starts the profiler)
+        :param track_memory: Use tracemalloc to find the peak memory of each section
+        :param top: Number of functions (and allocations) to list in the text reports
+        """
+        self.output_dir = Path(output_dir)
+        self.cpu = cpu
+        self.track_memory = track_memory
+        self.top = top
+
+        self.lock = Lock()
+        self.seconds: dict[str, float] = {category: 0.0 for category in timing_categories}
+        self.calls: dict[str, int] = {category: 0 for category in timing_categories}
+        self.started: float | None = None
+        self.wall = 0.0
+
+        self.sections: list[MemorySection] = []
+        self._active: list[MemorySection] = []
+        self._peak_allocations: list[str] = []
+        self._highest_peak = -1
+        self._profile: cProfile.Profile | None = None
+        self._started_tracemalloc = False
+
+    def start(self) -> None:
+        self.started = perf_counter()
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        if self.cpu:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def stop(self) -> None:
+        if self._profile is not None:
+            self._profile.disable()
+        if self.started is not None:
+            self.wall = perf_counter() - self.started
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    @contextmanager
+    def timer(self, category: str) -> Iterator[None]:
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - started
+            with self.lock:
+                self.seconds[category] = self.seconds.get(category, 0.0) + elapsed
+                self.calls[category] = self.calls.get(category, 0) + 1
+
+    def _fold_peak(self) -> None:
+        """Credit the peak so far to every active section, then start a new one"""
+        _, peak = tracemalloc.get_traced_memory()
+        for section in self._active:
+            section.peak = max(section.peak, peak)
+        tracemalloc.reset_peak()
+
+    @contextmanager
+    def memory(self, label: str) -> Iterator[MemorySection]:
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("The profiler must be started, with track_memory, to track memory")
+
+        with self.lock:
+            self._fold_peak()
+            section = MemorySection(label, start=tracemalloc.get_traced_memory()[0])
+            self._active.append(section)
+        try:
+            yield section
+        finally:
+            with self.lock:
+                self._fold_peak()
+                self._active.remove(section)
+                self.sections.append(section)
+
+                # Only worth the cost of a snapshot when it's the highest so far
+                if section.peak > self._highest_peak:
+                    self._highest_peak = section.peak
+                    statistics = tracemalloc.take_snapshot().statistics("lineno")
+                    self._peak_allocations = [
+                        f"After {label}:"
+                    ] + [str(stat) for stat in statistics[: self.top]]
+
+    def breakdown(self) -> dict[str, Any]:
+        """Seconds (and calls) for each category, with whatever is left over as local processing"""
+        with self.lock:
+            seconds = dict(self.seconds)
+            calls = dict(self.calls)
+        wall = self.wall if self.wall > 0 or self.started is None else perf_counter() - self.started
+        seconds["local"] = max(0.0, wall - sum(seconds.values()))
+        return {"wall": wall, "seconds": seconds, "calls": calls}
+
+    def write(self) -> list[Path]:
+        """Write the results to output_dir, returning the files written"""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        written = []
+
+        if self._profile is not None:
+            path = self.output_dir / "cprofile.pstats"
+            self._profile.dump_stats(path)
+            written.append(path)
+
+            path = self.output_dir / "cprofile.txt"
+            with path.open("wt") as f:
+                stats = pstats.Stats(self._profile, stream=f)
+                stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+            written.append(path)
+
+        path = self.output_dir / "timings.json"
+        path.write_text(json.dumps(self.breakdown(), indent=2))
+        written.append(path)
+
+        if self.track_memory:
+            path = self.output_dir / "memory.txt"
+            with path.open("wt") as f:
+                f.write("Peak MB\tGrowth MB\tSection\n")
+                for section in sorted(self.sections, key=lambda s: s.peak, reverse=True):
+                    f.write(f"{section.peak / 1e6:.1f}\t{section.growth / 1e6:.1f}\t{section.label}\n")
+                if self._peak_allocations:
+                    f.write("\n" + "\n".join(self._peak_allocations) + "\n")
+            written.append(path)
+
+        return written
+
+    def __enter__(self) -> Profiler:
+        self.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+        self.write()
@@ -0,0 +1,194 @@
+"""
+Progress reporting for bulk operations.
+
+Printing a line (or a whole resource) for every request costs real CPU time
+once a load reaches thousands of requests per second. A ProgressReporter
+lets the caller choose how much is shown:
+
+    quiet       nothing at all
+    aggregate   a single status line (throughput, error rate and, when the
+                total is known, ETA) refreshed every interval seconds
+    verbose     a line per request, along with the details of failures (the
+                way FhirClient.post has always reported)
+
+FhirClient.post reports through client.progress, whose level comes from the
+host's fhir_hosts entry (verbose unless set):
+
+    dev:
+        progress: aggregate         # or {level: aggregate, interval: 1}
+
+The CLIs that write in bulk (fhirload, fhirreplay, fhirvalidate and the
+ridcache harvest) take --progress to override it for a run. Verbose
+messages go to stdout, as they always have, while the aggregate line is
+written to stderr so it stays out of any output sent to stdout.
+"""
+from __future__ import annotations
+
+from datetime import timedelta
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Any, Callable
+
+from rich import print
+from rich.console import Console
+from rich.live import Live
+
+progress_levels = ["quiet", "aggregate", "verbose"]
+
+
+class ProgressReporter:
+    def __init__(
+        self,
+        level: str = "verbose",
+        interval: float = 1.0,
+        label: str = "Requests",
+        total: int | None = None,
+        console: Console | None = None,
+    ) -> None:
+        """
+        :param level: quiet, aggregate or verbose
+        :param interval: Seconds between refreshes of the aggregate status line
+        :param label: What is being counted
+        :param total: How many there will be, if known, for the ETA
+        :param console: Where to report, defaults to stderr
+        """
+        if level not in progress_levels:
+            raise ValueError(f"progress level must be one of {progress_levels}")
+        if interval <= 0:
+            raise ValueError("progress interval must be positive")
+        self.level = level
+        self.interval = interval
+        self.label = label
+        self.total = total
+        self.console = console if console is not None else Console(stderr=True)
+
+        # Fraction of the work done, for when that isn't completed / total
+        # (such as bytes read from a file)
+        self.fraction: Callable[[], float] | None = None
+
+        self.completed = 0
+        self.failed = 0
+        # Other counts shown on the status line, such as ids found
+        self.notes: dict[str, Any] = {}
+        self.started = monotonic()
+        self.lock = Lock()
+
+        self._running = False
+        self._live: Live | None = None
+        self._thread: Thread | None = None
+        self._stop = Event()
+
+    @classmethod
+    def from_cfg(cls, cfg: dict[str, Any]) -> ProgressReporter:
+        """Build the reporter from a host's configuration"""
+        settings = cfg.get("progress") or {}
+        if isinstance(settings, str):
+            settings = {"level": settings}
+        unknown = set(settings) - {"level", "interval"}
+        if len(unknown) > 0:
+            raise ValueError(f"Unknown progress settings: {sorted(unknown)}")
+        return cls(**settings)
+
+    @property
+    def verbose(self) -> bool:
+        return self.level == "verbose"
+
+    def message(self, text: str, detail: Any = None) -> None:
+        """A per-request message, only shown when verbose"""
+        if self.level == "verbose":
+            print(text)
+            if detail is not None:
+                print(detail)
+
+    def record(self, ok: bool = True, count: int = 1) -> None:
+        """Count finished work, starting the status line if need be"""
+        with self.lock:
+            self.completed += count
+            if not ok:
+                self.failed += count
+        if self.level == "aggregate" and not self._running:
+            self.start()
+
+    def note(self, name: str, value: Any) -> None:
+        with self.lock:
+            self.notes[name] = value
+
+    def rate(self) -> float:
+        return self.completed / max(monotonic() - self.started, 1e-6)
+
+    def eta(self) -> float | None:
+        """Seconds left, if the total (or fraction done) is known"""
+        if self.fraction is not None:
+            fraction = self.fraction()
+        elif self.total:
+            fraction = self.completed / self.total
+        else:
+            return None
+        if fraction <= 0:
+            return None
+        return (monotonic() - self.started) * (1 - min(fraction, 1.0)) / fraction
+
+    def render(self) -> str:
+        with self.lock:
+            completed, failed, notes = self.completed, self.failed, dict(self.notes)
+
+        done = str(completed) if self.total is None else f"{completed}/{self.total}"
+        status = f"{self.label}: {done} ({self.rate():.1f}/s)"
+        for name, value in notes.items():
+            status += f", {value} {name}"
+        status += f", {failed} failed ({failed / max(completed, 1):.1%})"
+
+        eta = self.eta()
+        if eta is not None:
+            status += f", ETA {timedelta(seconds=round(eta))}"
+        return status
+
+    def start(self) -> None:
+        """Begin refreshing the status line (only done for the aggregate level)"""
+        with self.lock:
+            if self.level != "aggregate" or self._running:
+                return
+            self._running = True
+            self.started = monotonic()
+
+        if self.console.is_terminal:
+            self._live = Live(
+                console=self.console,
+                get_renderable=self.render,
+                refresh_per_second=1 / self.interval,
+                redirect_stdout=False,
+                redirect_stderr=False,
+            )
+            self._live.start()
+        else:
+            # Logs get a line per interval rather than a line redrawn in place
+            self._stop.clear()
+            self._thread = Thread(target=self._print_status, daemon=True)
+            self._thread.start()
+
+    def _print_status(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.console.print(self.render())
+
+    def stop(self) -> None:
+        """Stop refreshing, leaving the final status behind"""
+        with self.lock:
+            if not self._running:
+                return
+            self._running = False
+
+        if self._live is not None:
+            self._live.stop()
+            self._live = None
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self.console.print(self.render())
+
+    def __enter__(self) -> ProgressReporter:
+        self.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
@@ -0,0 +1,211 @@
+"""
+Streaming query output for fhirq.
+
+Results are written page by page as they arrive from the server rather than
+being collected first, so memory use stays flat no matter how large a query's
+result set is. Two output formats are supported:
+
+    json  - A single JSON array: a header object followed by one object per
+            query whose "Entries" are streamed in as each page arrives.
+    jsonl - JSON Lines: one resource per line. Lines from concurrent queries
+            may interleave, but each page's lines are written together.
+
+Queries can be run concurrently. For the json format, each query is streamed
+into its own spool file (which only stays in memory while small) and the
+spools are spliced into the output in the order the queries were given.
+"""
+from __future__ import annotations
+
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from json import dumps
+from tempfile import SpooledTemporaryFile
+from threading import Lock
+from time import perf_counter
+from typing import IO, Any
+
+from rich.table import Table
+
+from ncpi_fhir_client.profiling import memory_section
+
+output_formats = ["json", "jsonl"]
+
+# Per-query spools larger than this roll over from memory onto disk
+spool_size = 1024 * 1024
+
+
+@dataclass
+class QuerySummary:
+    query: str
+    status_code: int | None = None
+    record_count: int = 0
+    page_count: int = 0
+    bytes_received: int = 0
+    bytes_written: int = 0
+    elapsed: float = 0.0
+    error: Any = None
+
+    def success(self) -> bool:
+        return self.error is None
+
+
+class QueryStreamer:
+    def __init__(
+        self, fhir_client: Any, out: IO[str], fmt: str = "json", concurrency: int = 1
+    ) -> None:
+        """
+        :param fhir_client: client used to run the queries
+        :type fhir_client: FhirClient
+        :param out: where the results are written
+        :param fmt: one of output_formats
+        :param concurrency: number of queries to run at the same time
+        """
+        assert fmt in output_formats, f"Unknown output format, {fmt}"
+        self.fhir_client = fhir_client
+        self.out = out
+        self.fmt = fmt
+        self.concurrency = max(1, concurrency)
+
+        # Only matters for jsonl, where concurrent queries share the output
+        self.out_lock = Lock()
+
+        # Used to place commas between the records of the json array
+        self.record_count = 0
+
+    def begin(self, header: dict[str, Any] | None = None) -> None:
+        if self.fmt == "json":
+            self.out.write("[\n")
+            if header is not None:
+                self._write_separator()
+                self.out.write(dumps(header))
+
+    def end(self) -> None:
+        if self.fmt == "json":
+            self.out.write("\n]\n")
+        self.out.flush()
+
+    def run(self, queries: list[str]) -> list[QuerySummary]:
+        """Run each of the queries, streaming the results to out, and return their summaries in order"""
+        if self.concurrency == 1 or len(queries) < 2:
+            summaries = []
+            for query in queries:
+                if self.fmt == "json":
+                    self._write_separator()
+                summaries.append(self.run_query(query, self.out))
+            return summaries
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            if self.fmt == "jsonl":
+                return list(
+                    executor.map(lambda query: self.run_query(query, self.out), queries)
+                )
+
+            futures = [executor.submit(self._run_spooled, query) for query in queries]
+            summaries = []
+            for future in futures:
+                spool, summary = future.result()
+                self._write_separator()
+                spool.seek(0)
+                shutil.copyfileobj(spool, self.out)
+                spool.close()
+                summaries.append(summary)
+            return summaries
+
+    def run_query(self, query: str, sink: IO[str]) -> QuerySummary:
+        """Stream the results of a single query to sink, one page at a time"""
+        with memory_section(getattr(self.fhir_client, "profiler", None), f"query {query}"):
+            return self._run_query(query, sink)
+
+    def _run_query(self, query: str, sink: IO[str]) -> QuerySummary:
+        summary = QuerySummary(query)
+        start = perf_counter()
+
+        if self.fmt == "json":
+            self._write(
+                sink, summary, f'{{"Query": {dumps(query)}, "Entries": [\n'
+            )
+
+        try:
+            for page in self.fhir_client.iter_pages(query, except_on_error=False):
+                summary.page_count += 1
+                summary.status_code = page.status_code
+                summary.bytes_received += page.response_bytes
+
+                if not page.success():
+                    summary.error = page.response
+                    break
+
+                if page.entry_count > 0:
+                    if self.fmt == "jsonl":
+                        chunk = "".join(
+                            dumps(entry.get("resource", entry)) + "\n"
+                            for entry in page.entries
+                        )
+                    else:
+                        chunk = ",\n".join(dumps(entry) for entry in page.entries)
+                        if summary.record_count > 0:
+                            chunk = ",\n" + chunk
+                    self._write(sink, summary, chunk)
+                    summary.record_count += page.entry_count
+        except Exception as e:
+            summary.error = str(e)
+
+        summary.elapsed = perf_counter() - start
+
+        if self.fmt == "json":
+            details = {
+                "Status Code": summary.status_code,
+                "Record Count": summary.record_count,
+                "Page Count": summary.page_count,
+                "Bytes Received": summary.bytes_received,
+                "Query Time": f"{summary.elapsed:.3f}",
+                "Time Stamp": str(datetime.now()),
+            }
+            if summary.error is not None:
+                details["Response"] = summary.error
+            self._write(sink, summary, "\n], " + dumps(details)[1:])
+
+        return summary
+
+    def _run_spooled(self, query: str) -> tuple[IO[str], QuerySummary]:
+        spool: IO[str] = SpooledTemporaryFile(max_size=spool_size, mode="w+t")  # type: ignore[assignment]
+        return spool, self.run_query(query, spool)
+
+    def _write(self, sink: IO[str], summary: QuerySummary, chunk: str) -> None:
+        summary.bytes_written += len(chunk)
+        if sink is self.out:
+            with self.out_lock:
+                sink.write(chunk)
+        else:
+            sink.write(chunk)
+
+    def _write_separator(self) -> None:
+        if self.record_count > 0:
+            self.out.write(",\n")
+        self.record_count += 1
+
+
+def summary_table(summaries: list[QuerySummary]) -> Table:
+    table = Table(title="Query Summary")
+    table.add_column("Query", justify="left", style="cyan")
+    table.add_column("Status", justify="right")
+    table.add_column("Records", justify="right", style="yellow")
+    table.add_column("Pages", justify="right")
+    table.add_column("Bytes", justify="right")
+    table.add_column("Time (s)", justify="right")
+
+    for summary in summaries:
+        status = str(summary.status_code)
+        if not summary.success():
+            status = f"[red]{status}[/red]"
+        table.add_row(
+            summary.query,
+            status,
+            str(summary.record_count),
+            str(summary.page_count),
+            f"{summary.bytes_received:,}",
+            f"{summary.elapsed:.3f}",
+        )
+    return table
@@ -0,0 +1,208 @@
+"""
+Client-side rate limiting, so that hosts with request quotas (such as the
+GCP Healthcare API) see a steady rate just under the quota rather than
+bursts that end in 429s and long retry backoffs.
+
+Each host can set separate budgets for reads (GET/HEAD) and writes
+(everything else) in its fhir_hosts entry:
+
+    dev:
+        rate_limit:
+            reads_per_second: 50
+            writes_per_second: 10
+            read_burst: 50          # requests allowed back to back (defaults to one second's worth)
+            write_burst: 10
+
+A budget that is left out is unlimited. The limiter belongs to a FhirClient,
+so it is shared by all of the threads using that client.
+
+Every request sent counts against the budget, including urllib3's retries
+(see performance.HostRetry). A 429 holds back everyone using the budget for the
+server's Retry-After (or a second, if it doesn't say), rather than just the
+request that was turned away.
+"""
+from __future__ import annotations
+
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from threading import Lock
+from time import monotonic, sleep, time
+from typing import Any, Iterator
+
+from ncpi_fhir_client.deadline import Deadline, DeadlineExceeded
+
+# The limiter of the client sending a request on this thread, for its retries
+_local = threading.local()
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float | None = None) -> None:
+        """
+        :param rate: tokens added per second
+        :param burst: most tokens the bucket holds, defaults to rate (but at least 1)
+        """
+        assert rate > 0, "rate must be positive"
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(rate, 1.0)
+        assert self.capacity >= 1, "burst must be at least 1"
+
+        self.tokens = self.capacity
+        self.updated = monotonic()
+        self.lock = Lock()
+
+        # Total time callers have spent waiting on this bucket
+        self.waited = 0.0
+
+    def acquire(self, tokens: float = 1.0, deadline: Deadline | None = None) -> float:
+        """Take tokens from the bucket, waiting until they are available
+
+        Tokens are reserved before waiting (the balance may go negative), so
+        callers are served in the order they arrive and nobody has to poll.
+
+        :param deadline: Raise DeadlineExceeded, without taking any tokens,
+            rather than wait past this
+        :return: the number of seconds spent waiting
+        """
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            balance = self.tokens - tokens
+            wait = -balance / self.rate if balance < 0 else 0.0
+            if deadline is not None and wait >= deadline.remaining():
+                raise DeadlineExceeded(deadline, {"rate_limit_wait": round(wait, 1)})
+            self.tokens = balance
+            self.waited += wait
+
+        if wait > 0:
+            sleep(wait)
+        return wait
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every caller for at least seconds"""
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # The next caller has to wait for the balance to refill from here
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+@dataclass
+class RateLimitSettings:
+    reads_per_second: float | None = None
+    writes_per_second: float | None = None
+    read_burst: float | None = None
+    write_burst: float | None = None
+
+    @classmethod
+    def from_cfg(cls, cfg: dict[str, Any]) -> RateLimitSettings:
+        """Build the settings from a host's configuration"""
+        settings = cfg.get("rate_limit") or {}
+        unknown = set(settings) - set(cls.__dataclass_fields__)
+        if len(unknown) > 0:
+            raise ValueError(f"Unknown rate_limit settings: {sorted(unknown)}")
+
+        limits = cls(**settings)
+        for name in ("reads_per_second", "writes_per_second"):
+            value = getattr(limits, name)
+            if not (value is None or value > 0):
+                raise ValueError(f"rate_limit {name} must be positive")
+        for name in ("read_burst", "write_burst"):
+            value = getattr(limits, name)
+            if not (value is None or value >= 1):
+                raise ValueError(f"rate_limit {name} must be at least 1")
+        return limits
+
+
+class RateLimiter:
+    read_methods = {"GET", "HEAD"}
+
+    def __init__(self, settings: RateLimitSettings | None = None) -> None:
+        if settings is None:
+            settings = RateLimitSettings()
+        self.settings = settings
+
+        self.reads: TokenBucket | None = None
+        if settings.reads_per_second is not None:
+            self.reads = TokenBucket(settings.reads_per_second, settings.read_burst)
+
+        self.writes: TokenBucket | None = None
+        if settings.writes_per_second is not None:
+            self.writes = TokenBucket(settings.writes_per_second, settings.write_burst)
+
+    @classmethod
+    def from_cfg(cls, cfg: dict[str, Any]) -> RateLimiter:
+        return cls(RateLimitSettings.from_cfg(cfg))
+
+    def bucket(self, method: str) -> TokenBucket | None:
+        """The budget method counts against, if it has one"""
+        return self.reads if method.upper() in self.read_methods else self.writes
+
+    def acquire(self, method: str, deadline: Deadline | None = None) -> float:
+        """Wait until the budget for method allows another request, returning the seconds waited
+
+        :param deadline: Raise DeadlineExceeded rather than wait past this
+        """
+        bucket = self.bucket(method)
+        if bucket is None:
+            return 0.0
+        return bucket.acquire(deadline=deadline)
+
+    def throttle(self, method: str, retry_after: str | float | None = None) -> None:
+        """The server answered 429, so hold back method's budget for retry_after
+        (seconds or an HTTP date, as in the Retry-After header), or a second"""
+        bucket = self.bucket(method)
+        if bucket is not None:
+            bucket.pause(retry_after_seconds(retry_after))
+
+    def before_retry(
+        self, method: str, status: int | None, retry_after: str | float | None = None
+    ) -> bool:
+        """Hold back method's budget if the server answered 429
+
+        :return: True if the budget's wait stands in for the retry's own backoff
+        """
+        if status != 429 or self.bucket(method) is None:
+            return False
+        self.throttle(method, retry_after)
+        return True
+
+    def stats(self) -> dict[str, float]:
+        """Seconds spent waiting for each budget"""
+        return {
+            "read_wait": 0.0 if self.reads is None else self.reads.waited,
+            "write_wait": 0.0 if self.writes is None else self.writes.waited,
+        }
+
+
+def retry_after_seconds(retry_after: str | float | None, default: float = 1.0) -> float:
+    """Seconds to wait for a Retry-After header's value"""
+    if retry_after is None:
+        return default
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(str(retry_after)).timestamp() - time())
+    except (TypeError, ValueError):
+        return default
+
+
+def current_rate_limiter() -> RateLimiter | None:
+    """The limiter for the request being sent on this thread, if any"""
+    return getattr(_local, "limiter", None)
+
+
+@contextmanager
+def rate_limit_scope(limiter: RateLimiter) -> Iterator[RateLimiter]:
+    """Make limiter the one that retries on this thread count against"""
+    previous = current_rate_limiter()
+    _local.limiter = limiter
+    try:
+        yield limiter
+    finally:
+        _local.limiter = previous
@@ -0,0 +1,483 @@
+"""
+Replay bundle (and NDJSON) files against a FHIR server without loading
+them into memory.
+
+Bundle files, such as those written by FhirClient.write_to_bundle, are
+parsed incrementally: the file is read a chunk at a time and each entry is
+decoded as soon as all of it has been read, so memory use depends on the
+size of the largest entry rather than the size of the file.
+
+Entries are either sent one at a time by a pool of workers, or re-chunked
+into batch (or transaction) bundles of batch_size entries. Only a bounded
+number of requests are ever in flight. Splitting a bundle up means
+urn:uuid references between its entries can no longer be resolved, so
+bundles that depend on those (such as the ones BundleBuilder creates)
+should be sent as they are.
+
+NDJSON lines are resources rather than entries, so they are written the
+same way post would write them: PUT if they have an id, POST otherwise.
+"""
+from __future__ import annotations
+
+import codecs
+import json
+import re
+import sys
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from threading import Lock
+from time import monotonic
+from typing import Any, BinaryIO, Callable, Iterator, TextIO
+
+from rich import print
+from rich.console import Console
+from rich.table import Table
+
+from ncpi_fhir_client.host_config import get_host_config
+from ncpi_fhir_client.progress import progress_levels
+
+_whitespace = " \t\r\n"
+_structural = re.compile(r'[{}\[\]"]')
+_string_special = re.compile(r'["\\]')
+_scalar_end = re.compile(r"[,\]}\s]")
+
+# Called with the number of bytes read from the file so far
+Progress = Callable[[int], None]
+
+
+class _Scanner:
+    """Just enough of a JSON tokenizer to walk a file that doesn't fit in memory"""
+
+    def __init__(self, f: BinaryIO, chunk_size: int, progress: Progress | None = None) -> None:
+        self.f = f
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json_decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.bytes_read = 0
+
+    def read(self) -> str:
+        """Read and decode the next chunk of the file"""
+        data = self.f.read(self.chunk_size)
+        self.bytes_read += len(data)
+        if self.progress is not None:
+            self.progress(self.bytes_read)
+        self.eof = len(data) == 0
+        return self.decoder.decode(data, final=self.eof)
+
+    def fill(self) -> None:
+        # Drop whatever has been consumed so the buffer only holds what's pending
+        self.buf = self.buf[self.pos :] + self.read()
+        self.pos = 0
+
+    def peek(self) -> str:
+        """Return the next character that isn't whitespace (or "" at the end of the file)"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _whitespace:
+                self.pos += 1
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos : self.pos + 1]
+            self.fill()
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected '{char}' but found '{found}' in {self.f.name}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        first = self.peek()
+        try:
+            value, end = self.json_decoder.raw_decode(self.buf, self.pos)
+            # A number at the end of the buffer may not be over yet
+            if end < len(self.buf) or self.eof:
+                self.pos = end
+                return value
+        except json.JSONDecodeError:
+            if self.eof:
+                raise
+
+        # Decoding again after every chunk is quadratic in the size of the value, so
+        # only look for where it ends as the rest arrives and decode it once
+        value_end = _ValueEnd(first)
+        parts = [self.buf[self.pos :]]
+        found = value_end.find(parts[0])
+        while not found and not self.eof:
+            parts.append(self.read())
+            found = value_end.find(parts[-1])
+        self.buf = "".join(parts)
+        self.pos = 0
+        value, self.pos = self.json_decoder.raw_decode(self.buf)
+        return value
+
+
+class _ValueEnd:
+    """Follows nesting and strings through the text of one JSON value, chunk by chunk"""
+
+    def __init__(self, first: str) -> None:
+        self.scalar = first not in '{["'
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def find(self, text: str) -> bool:
+        """Whether the value ends in this chunk of its text"""
+        if self.scalar:
+            return _scalar_end.search(text) is not None
+
+        i = 0
+        while True:
+            if self.in_string:
+                if self.escaped:
+                    if i >= len(text):
+                        return False
+                    self.escaped = False
+                    i += 1
+                match = _string_special.search(text, i)
+                if match is None:
+                    return False
+                i = match.end()
+                if match.group() == "\\":
+                    self.escaped = True
+                    continue
+                self.in_string = False
+                if self.depth == 0:
+                    return True
+            else:
+                match = _structural.search(text, i)
+                if match is None:
+                    return False
+                i = match.end()
+                char = match.group()
+                if char == '"':
+                    self.in_string = True
+                elif char in "{[":
+                    self.depth += 1
+                else:
+                    self.depth -= 1
+                    if self.depth == 0:
+                        return True
+
+
+def iter_bundle_entries(
+    path: str | Path, chunk_size: int = 1024 * 1024, progress: Progress | None = None
+) -> Iterator[dict[str, Any]]:
+    """Yield the entries of a Bundle file, one at a time"""
+    with open(path, "rb") as f:
+        scanner = _Scanner(f, chunk_size, progress)
+        scanner.expect("{")
+        if scanner.peek() == "}":
+            return
+
+        while True:
+            key = scanner.value()
+            scanner.expect(":")
+            if key == "entry":
+                scanner.expect("[")
+                if scanner.peek() == "]":
+                    scanner.pos += 1
+                else:
+                    while True:
+                        yield scanner.value()
+                        separator = scanner.peek()
+                        scanner.pos += 1
+                        if separator == "]":
+                            break
+                        if separator != ",":
+                            raise ValueError(f"Unexpected '{separator}' in the entries of {path}")
+            else:
+                scanner.value()
+
+            separator = scanner.peek()
+            scanner.pos += 1
+            if separator == "}":
+                return
+            if separator != ",":
+                raise ValueError(f"Unexpected '{separator}' in {path}")
+
+
+def iter_ndjson_entries(
+    path: str | Path, progress: Progress | None = None
+) -> Iterator[dict[str, Any]]:
+    """Yield each resource of an NDJSON file as a bundle entry (without a request)"""
+    bytes_read = 0
+    with open(path, "rb") as f:
+        for line in f:
+            bytes_read += len(line)
+            if progress is not None:
+                progress(bytes_read)
+            if line.strip():
+                yield {"resource": json.loads(line)}
+
+
+def iter_entries(path: str | Path, progress: Progress | None = None) -> Iterator[dict[str, Any]]:
+    """Yield the entries of a bundle or NDJSON file (based on its extension)"""
+    if Path(path).suffix in (".ndjson", ".jsonl"):
+        return iter_ndjson_entries(path, progress)
+    return iter_bundle_entries(path, progress=progress)
+
+
+def entry_request(entry: dict[str, Any]) -> tuple[str, str]:
+    """Return the method and (relative) url an entry should be sent with"""
+    request = entry.get("request") or {}
+    resource = entry.get("resource") or {}
+
+    method = request.get("method")
+    if method is None:
+        method = "PUT" if "id" in resource else "POST"
+
+    url = request.get("url")
+    if url is None:
+        url = resource["resourceType"]
+        if method == "PUT":
+            url = f"{url}/{resource['id']}"
+    return method, url
+
+
+@dataclass
+class ReplayStats:
+    entries: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    requests: int = 0
+    bytes_read: int = 0
+    total_bytes: int = 0
+    started: float = field(default_factory=monotonic)
+
+    @property
+    def elapsed(self) -> float:
+        return monotonic() - self.started
+
+    def rate(self) -> float:
+        return self.entries / max(self.elapsed, 1e-6)
+
+
+class BundleReplayer:
+    def __init__(
+        self,
+        fhir_client: Any,
+        workers: int = 4,
+        batch_size: int | None = None,
+        bundle_type: str = "batch",
+        progress_interval: float = 10.0,
+        failures: TextIO | None = None,
+    ) -> None:
+        """
+        :param fhir_client: client the entries are sent through
+        :type fhir_client: FhirClient
+        :param workers: Number of requests in flight at once
+        :param batch_size: If provided, send the entries in bundles of this many entries rather than one at a time
+        :param bundle_type: The type of the bundles sent when batching, batch or transaction
+        :param progress_interval: Seconds between progress reports (0 for none)
+        :param failures: Where to write (as NDJSON) the entries that failed along with the server's response
+        """
+        assert bundle_type in ("batch", "transaction"), "bundle_type must be batch or transaction"
+        self.fhir_client = fhir_client
+        self.workers = workers
+        self.batch_size = batch_size
+        self.bundle_type = bundle_type
+        self.progress_interval = progress_interval
+        self.failures = failures
+
+        self.lock = Lock()
+        self.stats = ReplayStats()
+        self._last_report = monotonic()
+
+    def _record(self, succeeded: int, failed: list[tuple[dict[str, Any], Any]]) -> None:
+        with self.lock:
+            self.stats.requests += 1
+            self.stats.succeeded += succeeded
+            self.stats.failed += len(failed)
+            if self.failures is not None:
+                for entry, response in failed:
+                    self.failures.write(json.dumps({"entry": entry, "response": response}) + "\n")
+
+    def _send_entry(self, entry: dict[str, Any]) -> None:
+        method, url = entry_request(entry)
+        args = {}
+        if entry.get("resource") is not None:
+            args["json"] = entry["resource"]
+
+        success, result = self.fhir_client.send_request(
+            method, f"{self.fhir_client.target_service_url}/{url}", **args
+        )
+        if success:
+            self._record(1, [])
+        else:
+            self._record(0, [(entry, result["response"])])
+
+    def _send_batch(self, entries: list[dict[str, Any]]) -> None:
+        for entry in entries:
+            method, url = entry_request(entry)
+            entry["request"] = {"method": method, "url": url}
+
+        bundle = {"resourceType": "Bundle", "type": self.bundle_type, "entry": entries}
+        success, result = self.fhir_client.send_request(
+            "POST", self.fhir_client.target_service_url, json=bundle
+        )
+
+        response = result["response"]
+        if not success:
+            self._record(0, [(entry, response) for entry in entries])
+            return
+
+        # Each entry of a batch succeeds (or fails) on its own
+        outcomes = response.get("entry", []) if isinstance(response, dict) else []
+        succeeded = 0
+        failed = []
+        for index, entry in enumerate(entries):
+            status = "200"
+            if index < len(outcomes):
+                status = outcomes[index].get("response", {}).get("status", "200")
+            if status.strip()[0:1] == "2":
+                succeeded += 1
+            else:
+                failed.append((entry, outcomes[index]))
+        self._record(succeeded, failed)
+
+    def _report(self, force: bool = False) -> None:
+        if self.progress_interval <= 0:
+            return
+        now = monotonic()
+        if not force and now - self._last_report < self.progress_interval:
+            return
+        self._last_report = now
+
+        stats = self.stats
+        progress = f"{stats.entries} entries ({stats.rate():.1f}/s)"
+        if stats.total_bytes > 0:
+            progress += f", {stats.bytes_read / 1e6:.1f} of {stats.total_bytes / 1e6:.1f} MB read"
+        print(f"{progress}, {stats.failed} failed")
+
+    def replay(self, paths: list[str | Path]) -> ReplayStats:
+        """Send every entry in each of the files, in the order given"""
+        self.stats = ReplayStats(total_bytes=sum(Path(path).stat().st_size for path in paths))
+        bytes_done = 0
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # Bounded so that reading doesn't get too far ahead of the server
+            in_flight: deque[Future[None]] = deque()
+
+            def submit(fn: Any, arg: Any) -> None:
+                while len(in_flight) >= self.workers * 2:
+                    in_flight.popleft().result()
+                in_flight.append(executor.submit(fn, arg))
+
+            for path in paths:
+
+                def progress(bytes_read: int) -> None:
+                    self.stats.bytes_read = bytes_done + bytes_read
+
+                batch: list[dict[str, Any]] = []
+                for entry in iter_entries(path, progress):
+                    self.stats.entries += 1
+                    if self.batch_size is None:
+                        submit(self._send_entry, entry)
+                    else:
+                        batch.append(entry)
+                        if len(batch) >= self.batch_size:
+                            submit(self._send_batch, batch)
+                            batch = []
+                    self._report()
+
+                if len(batch) > 0:
+                    submit(self._send_batch, batch)
+                bytes_done += Path(path).stat().st_size
+                self.stats.bytes_read = bytes_done
+
+            while in_flight:
+                in_flight.popleft().result()
+
+        self._report(force=True)
+        return self.stats
+
+
+def exec() -> None:
+    from ncpi_fhir_client.fhir_client import FhirClient
+
+    host_config = get_host_config()
+    env_options = sorted(host_config.keys())
+
+    parser = ArgumentParser(
+        description="Replay bundle (or NDJSON) files against a FHIR server, without reading them into memory"
+    )
+    parser.add_argument(
+        "-e",
+        "--env",
+        choices=env_options,
+        required=True,
+        help="Remote configuration to be used to access the FHIR server.",
+    )
+    parser.add_argument("files", nargs="+", help="Bundle (JSON) or NDJSON files, sent in the order given")
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="Number of requests to have in flight at once (defaults to the host's performance concurrency)",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch-size",
+        type=int,
+        help="Send the entries in bundles of this size rather than one at a time",
+    )
+    parser.add_argument(
+        "--bundle-type",
+        choices=["batch", "transaction"],
+        default="batch",
+        help="The type of bundle to send when using --batch-size",
+    )
+    parser.add_argument(
+        "--failures", type=str, help="Write the entries that failed, and the server's responses, to this file"
+    )
+    parser.add_argument(
+        "--progress",
+        choices=progress_levels,
+        help="How much to report as the entries are sent (defaults to the host's progress setting)",
+    )
+    args = parser.parse_args(sys.argv[1:])
+
+    cfg = host_config[args.env]
+    if args.progress is not None:
+        cfg = dict(cfg, progress=args.progress)
+    failures = None if args.failures is None else open(args.failures, "wt")
+    fhir_client = FhirClient(cfg)
+    replayer = BundleReplayer(
+        fhir_client,
+        workers=args.workers or fhir_client.performance.concurrency,
+        batch_size=args.batch_size,
+        bundle_type=args.bundle_type,
+        progress_interval=0 if fhir_client.progress.level == "quiet" else 10.0,
+        failures=failures,
+    )
+    stats = replayer.replay(args.files)
+    if failures is not None:
+        failures.close()
+
+    table = Table(title="Replay")
+    table.add_column("Entries", justify="right", style="cyan")
+    table.add_column("Succeeded", justify="right", style="green")
+    table.add_column("Failed", justify="right", style="red")
+    table.add_column("Requests", justify="right")
+    table.add_column("Entries/s", justify="right", style="yellow")
+    table.add_row(
+        str(stats.entries),
+        str(stats.succeeded),
+        str(stats.failed),
+        str(stats.requests),
+        f"{stats.rate():.1f}",
+    )
+    Console().print(table, justify="center")
+
+    if stats.failed > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    exec()
@@ -0,0 +1,125 @@
+"""
+In-memory index of resources returned by a graph fetch (see
+FhirClient.fetch_graph) so that references between them can be resolved
+locally rather than with another round trip to the server.
+
+Resources are indexed by their "Type/id" key. References can be given in any
+of the forms that show up inside FHIR resources: a Reference object, a
+relative reference (Patient/123), an absolute URL or a versioned reference
+(Patient/123/_history/2).
+"""
+from __future__ import annotations
+
+from collections import defaultdict
+from threading import Lock
+from typing import Any, Iterator
+
+
+def reference_key(reference: str | dict[str, Any]) -> str | None:
+    """Reduce a reference (or Reference object) to its Type/id key"""
+    ref = reference.get("reference") if isinstance(reference, dict) else reference
+    if ref is None or ref.startswith("#") or ref.startswith("urn:"):
+        return None
+
+    pieces = ref.split("/")
+    if "_history" in pieces:
+        pieces = pieces[: pieces.index("_history")]
+
+    if len(pieces) < 2:
+        return None
+    return "/".join(pieces[-2:])
+
+
+def find_references(resource: Any) -> Iterator[str]:
+    """Yield the Type/id key of every reference found anywhere inside resource"""
+    if isinstance(resource, dict):
+        for key, value in resource.items():
+            if key == "reference" and isinstance(value, str):
+                ref = reference_key(value)
+                if ref is not None:
+                    yield ref
+            else:
+                yield from find_references(value)
+    elif isinstance(resource, list):
+        for item in resource:
+            yield from find_references(item)
+
+
+class ResourceGraph:
+    def __init__(self) -> None:
+        # Type/id => resource
+        self.resources: dict[str, dict[str, Any]] = {}
+
+        # Keys of the resources that matched the search itself (as opposed
+        # to those pulled in by _include/_revinclude)
+        self.matches: set[str] = set()
+
+        # target Type/id => Type/id of resources referencing it. Built on
+        # demand and discarded whenever new resources are added
+        self._referenced_by: defaultdict[str, set[str]] | None = None
+
+        self.lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self.resources)
+
+    def __contains__(self, reference: str | dict[str, Any]) -> bool:
+        return self.resolve(reference) is not None
+
+    def add(self, resource: dict[str, Any], match: bool = False) -> None:
+        key = f"{resource['resourceType']}/{resource['id']}"
+        with self.lock:
+            self.resources[key] = resource
+            if match:
+                self.matches.add(key)
+            self._referenced_by = None
+
+    def add_entries(self, entries: list[dict[str, Any]]) -> None:
+        """Add the resources from a page of search bundle entries"""
+        for entry in entries:
+            resource = entry.get("resource")
+            if resource is not None and "id" in resource:
+                mode = entry.get("search", {}).get("mode", "match")
+                self.add(resource, match=mode == "match")
+
+    def resolve(self, reference: str | dict[str, Any]) -> dict[str, Any] | None:
+        """Return the resource a reference points to, if it is in the graph"""
+        key = reference_key(reference)
+        if key is None:
+            return None
+        return self.resources.get(key)
+
+    def of_type(self, resource_type: str) -> list[dict[str, Any]]:
+        prefix = f"{resource_type}/"
+        return [
+            resource
+            for key, resource in self.resources.items()
+            if key.startswith(prefix)
+        ]
+
+    def ids(self, resource_type: str) -> list[str]:
+        return [resource["id"] for resource in self.of_type(resource_type)]
+
+    def referencing(
+        self, reference: str | dict[str, Any], resource_type: str | None = None
+    ) -> list[dict[str, Any]]:
+        """Return the resources in the graph that refer to reference
+
+        :param reference: The target of the references
+        :param resource_type: Only return resources of this type
+        """
+        key = reference_key(reference)
+        if key is None:
+            return []
+
+        with self.lock:
+            if self._referenced_by is None:
+                self._referenced_by = defaultdict(set)
+                for source, resource in self.resources.items():
+                    for target in find_references(resource):
+                        self._referenced_by[target].add(source)
+            sources = sorted(self._referenced_by.get(key, []))
+
+        if resource_type is not None:
+            sources = [s for s in sources if s.split("/")[0] == resource_type]
+        return [self.resources[source] for source in sources]
@@ -12,18 +12,34 @@ to be up to date and it doesn't take too much memory for servers with
 a single largish dataset. The same may not be true for servers with 
 large numbers of datasets already on board. 
 
+For those servers, the cache can be tiered (see max_memory_ids): only the
+most recently used ids are kept in RAM and everything is spilled to a
+temporary on-disk index (sqlite). It also helps to restrict the load to the
+identifier systems the run will actually touch (see systems) so that the
+other datasets never have to be downloaded at all.
+
 """
 
 from __future__ import annotations
 
 import sys
 import os
+import heapq
 import re
-from collections import defaultdict
+import mmap
+import sqlite3
+import tempfile
+from pathlib import Path
+from collections import OrderedDict, defaultdict
+from collections.abc import Iterable, Iterator
+from contextlib import ExitStack
 from argparse import ArgumentParser
 from typing import Any
 
 from ncpi_fhir_client import default_resources, report_exception
+from ncpi_fhir_client.checkpoint import PaginationCheckpoint
+from ncpi_fhir_client.profiling import Profiler, memory_section
+from ncpi_fhir_client.progress import ProgressReporter, progress_levels
 # The get_id will be run inside a thread, so I guess we need to protect it...not really sure
 # if the read can be interrupted. Probably not but it should be reasonably fast.
 from threading import Lock
@@ -65,18 +81,210 @@ class DuplicateIdentifierFound(Exception):
         return f"""Duplicate key found for {self.target_system}:{self.entity_key} -> {self.entity_type}/{self.target_id} exists with the same key."""
 
 
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+
+def _unescape(text: str) -> str:
+    return re.sub(r"\\(.)", lambda m: {"t": "\t", "n": "\n"}.get(m.group(1), m.group(1)), text)
+
+
+class IdSnapshot:
+    """
+    Read-only, memory-mapped copy of an RIdCache (see RIdCache.write_snapshot)
+
+    The snapshot is a text file with one sorted line per identifier:
+    system<tab>value<tab>resourceType<tab>id. Lookups are a binary search
+    over the mapped file, so nothing has to be loaded up front, and the
+    pages are shared by every process that maps the same file.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self._file = self.path.open("rb")
+        self.mm: mmap.mmap | None = None
+        if self.path.stat().st_size > 0:
+            self.mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def get(self, target_system: str, entity_key: str) -> tuple[str, str] | None:
+        if self.mm is None:
+            return None
+
+        key = f"{_escape(target_system)}\t{_escape(entity_key)}\t".encode("utf-8")
+        lo, hi = 0, len(self.mm)
+        while lo < hi:
+            start = self.mm.rfind(b"\n", 0, (lo + hi) // 2) + 1
+            if start < lo:
+                start = lo
+            end = self.mm.find(b"\n", start)
+            if end < 0:
+                end = len(self.mm)
+
+            line = self.mm[start:end]
+            line_key = line[: line.index(b"\t", line.index(b"\t") + 1) + 1]
+            if line_key == key:
+                resource_type, target_id = line[len(key) :].decode("utf-8").split("\t")
+                return (_unescape(resource_type), _unescape(target_id))
+            if line_key < key:
+                lo = end + 1
+            else:
+                hi = start
+        return None
+
+    def close(self) -> None:
+        if self.mm is not None:
+            self.mm.close()
+        self._file.close()
+
+
+class TieredIdStore:
+    """
+    system => value => (resourceType, id) held in an on-disk sqlite index,
+    with a bounded LRU of the most recently used ids kept in RAM
+
+    The index is a cache like any other, so it is written without a journal
+    and is deleted when the store is closed, unless a path was provided.
+    """
+
+    # Commit after this many writes so the pending transaction stays small
+    commit_every = 10000
+
+    def __init__(self, max_memory_ids: int, path: str | Path | None = None) -> None:
+        assert max_memory_ids > 0, "max_memory_ids must be positive"
+        self.max_memory_ids = max_memory_ids
+
+        self.temporary = path is None
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix="ridcache-", suffix=".sqlite")
+            os.close(fd)
+        self.path = Path(path)
+
+        # All access goes through self.lock, so the connection can be shared
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=OFF")
+        self.db.execute("PRAGMA synchronous=OFF")
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS ids (
+                system TEXT NOT NULL,
+                value TEXT NOT NULL,
+                resource_type TEXT NOT NULL,
+                id TEXT NOT NULL,
+                PRIMARY KEY (system, value)
+            ) WITHOUT ROWID"""
+        )
+
+        self.hot: OrderedDict[tuple[str, str], tuple[str, str]] = OrderedDict()
+        self.lock = Lock()
+        self.pending_writes = 0
+
+        # Just some statistics to help with sizing max_memory_ids
+        self.memory_hits = 0
+        self.disk_hits = 0
+
+    def _remember(self, key: tuple[str, str], value: tuple[str, str]) -> None:
+        self.hot[key] = value
+        self.hot.move_to_end(key)
+        if len(self.hot) > self.max_memory_ids:
+            self.hot.popitem(last=False)
+
+    def get(self, target_system: str, entity_key: str) -> tuple[str, str] | None:
+        key = (target_system, entity_key)
+        with self.lock:
+            if key in self.hot:
+                self.hot.move_to_end(key)
+                self.memory_hits += 1
+                return self.hot[key]
+
+            row = self.db.execute(
+                "SELECT resource_type, id FROM ids WHERE system=? AND value=?", key
+            ).fetchone()
+            if row is None:
+                return None
+
+            self.disk_hits += 1
+            self._remember(key, row)
+            return (row[0], row[1])
+
+    def __contains__(self, key: tuple[str, str]) -> bool:
+        return self.get(*key) is not None
+
+    def put(self, target_system: str, entity_key: str, entity_type: str, target_id: str) -> None:
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO ids VALUES (?, ?, ?, ?)",
+                (target_system, entity_key, entity_type, target_id),
+            )
+            self._remember((target_system, entity_key), (entity_type, target_id))
+
+            self.pending_writes += 1
+            if self.pending_writes >= self.commit_every:
+                self.db.commit()
+                self.pending_writes = 0
+
+    def items(self) -> Iterator[tuple[str, str, str, str]]:
+        """Yield (system, value, resourceType, id) for every id in the store"""
+        # Fetched in batches, in key order, so that everything isn't pulled
+        # into memory at once and the lock isn't held while the caller works
+        last: tuple[str, str] = ("", "")
+        while True:
+            with self.lock:
+                batch = self.db.execute(
+                    """SELECT system, value, resource_type, id FROM ids
+                    WHERE (system, value) > (?, ?) ORDER BY system, value LIMIT ?""",
+                    (*last, self.commit_every),
+                ).fetchall()
+            if len(batch) == 0:
+                return
+            yield from batch
+            last = (batch[-1][0], batch[-1][1])
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM ids").fetchone()[0]
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+        if self.temporary:
+            self.path.unlink(missing_ok=True)
+
+
 class RIdCache:
+    # Lines sorted in memory at a time when writing a snapshot
+    snapshot_run_lines = 1000000
+
     def __init__(
         self,
         study_id: str | None = None,
         resource_types: list[str] | None = None,
         valid_patterns: list[str] | None = None,
+        systems: list[str] | None = None,
+        max_memory_ids: int | None = None,
+        index_path: str | Path | None = None,
+        track_duplicates: bool = False,
+        checkpoint_dir: str | Path | None = None,
+        checkpoint_window: bool = False,
+        page_size: int | str | None = None,
     ) -> None:
         """
         :param resource_types: List of FHIR Resource types expected to be encountered
         :type resource_types: List of strings
         :param valid_patterns: List of text strings which can be expected to be found in the identifiers
         :type valid_patterns: List of strings
+        :param systems: The identifier systems the run will touch. Only ids with one of these systems are loaded
+        :type systems: List of strings
+        :param max_memory_ids: If provided, the cache is tiered, keeping at most this many ids in RAM
+        :type max_memory_ids: int
+        :param index_path: Where to keep the tiered cache's on-disk index (defaults to a temporary file)
+        :param track_duplicates: Record every identifier found on more than one resource (see report_duplicates)
+        :type track_duplicates: bool
+        :param checkpoint_dir: Save each resource type's progress here so an interrupted harvest can resume
+        :param checkpoint_window: Sort the harvest by _lastUpdated so it can resume even if the server's paging cursor expired
+        :type checkpoint_window: bool
+        :param page_size: _count used for the harvest, or "auto" to let the client adapt it as it
+            goes. Defaults to the client's performance profile
+        :type page_size: int or "auto"
 
         The client's target host will be used in the db schema to allow us
         to use a single database for persistance. The client object itself will
@@ -87,6 +295,10 @@ class RIdCache:
         self.resource_types = resource_types
         self.valid_patterns: list[re.Pattern[str]] = []
         self.study_id = study_id
+        self.systems = systems
+        self.checkpoint_dir = None if checkpoint_dir is None else Path(checkpoint_dir)
+        self.checkpoint_window = checkpoint_window
+        self.page_size = page_size
         # log IDs encountered which don't conform to the whistle
         # format
         self.malformed_ids: set[str] = set()
@@ -98,8 +310,22 @@ class RIdCache:
         # resourceType=>system=>value = ID
         self.cache: defaultdict[str, dict[str, tuple[str, str]]] = defaultdict(dict)
 
+        # When tiered, ids are kept here rather than in self.cache
+        self.index: TieredIdStore | None = None
+        if max_memory_ids is not None:
+            self.index = TieredIdStore(max_memory_ids, index_path)
+
         self.missing_identifiers: defaultdict[str, list[dict[str, Any]]] = defaultdict(list)
 
+        # (system, value) => every Type/id found with that identifier. Only
+        # identifiers that turn up more than once are kept here
+        self.track_duplicates = track_duplicates
+        self.duplicates: dict[tuple[str, str], list[str]] = {}
+
+        # Read-only ids shared with other processes. Consulted for anything
+        # that isn't in the cache itself
+        self.snapshot: IdSnapshot | None = None
+
     def load_ids_from_host(self, fhir_client: Any, exit_on_dupes: bool = False) -> None:
         """
         Loads ids from the host via the client object and stores them inside the cache
@@ -107,27 +333,46 @@ class RIdCache:
         :param fhirclient: the FHIR client that will be used to query data
         :type fhirclient: FhirClient
         """
+        with memory_section(getattr(fhir_client, "profiler", None), "RIdCache.load_ids_from_host"):
+            self._load_ids_from_host(fhir_client, exit_on_dupes)
 
+    def _load_ids_from_host(self, fhir_client: Any, exit_on_dupes: bool) -> None:
         if self.resource_types is None:
-            self.resource_types = default_resources(fhir_client, ignore_resources=_ignored_resource_types)
+            self.resource_types = self.system_resource_types(
+                default_resources(fhir_client, ignore_resources=_ignored_resource_types)
+            )
+
+        # The client may not have a reporter (such as a test's stand in)
+        client_progress = getattr(fhir_client, "progress", None)
+        level = client_progress.level if client_progress is not None else "verbose"
+        progress = ProgressReporter(level, label="Resource types", total=len(self.resource_types))
 
         table = Table(title=f"Resource Loading: {fhir_client.target_service_url}")
         table.add_column("Resource Type", justify = "right", style="cyan")
         table.add_column("ID Count", justify="left", style="yellow")
         ids_found = 0
-        for resource_type in track(self.resource_types, f"Loading IDs for {len(self.resource_types)} resource types"):
-            try:
-                id_count = self.load_ids_for_resource_type(fhir_client, resource_type, exit_on_dupes=exit_on_dupes)
-                if id_count > 0:
-                    table.add_row(resource_type, str(id_count))
-                ids_found += id_count
-            except DuplicateIdentifierFound as e:
-                print(e)
-                os._exit(1)
-        console = Console()
-        console.print(table, justify="center")
+        resource_types: Iterable[str] = self.resource_types
+        if progress.verbose:
+            resource_types = track(resource_types, f"Loading IDs for {len(self.resource_types)} resource types")
+        with progress:
+            for resource_type in resource_types:
+                try:
+                    id_count = self.load_ids_for_resource_type(fhir_client, resource_type, exit_on_dupes=exit_on_dupes)
+                    if id_count > 0:
+                        table.add_row(resource_type, str(id_count))
+                    ids_found += id_count
+                    progress.note("ids", ids_found)
+                    progress.record()
+                except DuplicateIdentifierFound as e:
+                    print(e)
+                    os._exit(1)
 
-        print(f"{len(self.resource_types)} Resource types found: {ids_found} ids.")
+        console = Console()
+        # Otherwise the status line has already given the per type counts,
+        # but problems with the ids are always worth reporting
+        if progress.verbose:
+            console.print(table, justify="center")
+            print(f"{len(self.resource_types)} Resource types found: {ids_found} ids.")
 
         if len(self.malformed_ids) > 0:
             table = Table(title=f"{len(self.malformed_ids)} malformed IDs found")
@@ -148,7 +393,72 @@ class RIdCache:
 
             console.print(table, justify="center")
 
+        if self.track_duplicates:
+            self.report_duplicates()
+
+    def report_duplicates(self, max_rows: int = 5) -> None:
+        """Print a summary of the duplicate identifiers found so far"""
+        if len(self.duplicates) == 0:
+            print("No duplicate identifiers found")
+            return
+
+        by_system: defaultdict[str, int] = defaultdict(int)
+        for target_system, _ in self.duplicates:
+            by_system[target_system] += 1
+
+        console = Console()
+        table = Table(title=f"Duplicate Identifiers: {len(self.duplicates)}")
+        table.add_column("System", justify="right", style="blue")
+        table.add_column("Duplicated Identifiers", justify="left", style="yellow")
+        for target_system in sorted(by_system):
+            table.add_row(target_system, str(by_system[target_system]))
+        console.print(table, justify="center")
+
+        table = Table(title=f"Example duplicates (first {max_rows})")
+        table.add_column("System", justify="right", style="blue")
+        table.add_column("Value", justify="left", style="yellow")
+        table.add_column("Resources", justify="left", style="cyan")
+        for (target_system, entity_key), resources in list(self.duplicates.items())[0:max_rows]:
+            table.add_row(target_system, entity_key, ", ".join(resources))
+        console.print(table, justify="center")
+
+    def write_duplicates(self, path: str | Path) -> None:
+        """
+        Write the duplicate identifiers as TSV: system, value, the number of
+        resources and those resources (Type/id, comma separated)
+        """
+        with open(path, "wt") as f:
+            f.write("system\tvalue\tcount\tresources\n")
+            for (target_system, entity_key), resources in self.duplicates.items():
+                f.write(
+                    f"{_escape(target_system)}\t{_escape(entity_key)}\t{len(resources)}\t{','.join(resources)}\n"
+                )
+
+    def system_resource_types(self, resource_types: list[str]) -> list[str]:
+        """
+        Narrow resource_types down to those the systems hint says will be touched
+
+        Whistle systems end with the lowercase resource type (see the check
+        for malformed ids). If any of the systems don't follow that convention,
+        we can't tell which resource types they belong to, so nothing is dropped.
+        """
+        if self.systems is None:
+            return resource_types
+
+        by_name = {resource_type.lower(): resource_type for resource_type in resource_types}
+        touched = set()
+        for target_system in self.systems:
+            resource_type = by_name.get(target_system.split("/")[-1])
+            if resource_type is None:
+                return resource_types
+            touched.add(resource_type)
+
+        return [resource_type for resource_type in resource_types if resource_type in touched]
+
     def valid_system(self, target_system: str) -> bool:
+        if self.systems is not None and target_system not in self.systems:
+            return False
+
         if len(self.valid_patterns) == 0:
             return True
 
@@ -160,37 +470,85 @@ class RIdCache:
     def load_ids_for_resource_type(
         self, fhir_client: Any, resource_type: str, exit_on_dupes: bool = False
     ) -> int:
-        params = ["_elements=identifier,id","_count=200"]
+        page_size = self.page_size
+        if page_size is None:
+            profile = getattr(fhir_client, "performance", None)
+            if profile is None:
+                page_size = 200
+            else:
+                page_size = "auto" if profile.adaptive_paging else profile.page_size
+
+        get_args: dict[str, Any] = {}
+        params = ["_elements=identifier,id"]
+        if page_size == "auto":
+            get_args["rec_count"] = "auto"
+        else:
+            params.append(f"_count={page_size}")
         if self.study_id is not None:
             params = [f"_tag={self.study_id}"] + params
+        if self.systems is not None:
+            # Let the server skip everything from the systems we don't care about
+            systems = [s for s in self.systems if s.split("/")[-1] == resource_type.lower()]
+            if len(systems) == 0:
+                systems = self.systems
+            params = [f"identifier={','.join(f'{s}|' for s in systems)}"] + params
 
         query_string = "&".join(params)
 
-        result = fhir_client.get(f"{resource_type}?{query_string}")
+        checkpoint = None
+        if self.checkpoint_dir is not None:
+            # Spooled, so the ids from before an interruption can be stored again
+            checkpoint = PaginationCheckpoint(
+                self.checkpoint_dir / f"{resource_type}.json",
+                window=self.checkpoint_window,
+                spool=True,
+            )
+            get_args["checkpoint"] = checkpoint
+
+        # A page at a time, so the harvest never holds more than one page of
+        # entries no matter how many ids the server has
         record_count = 0
-        if result.success():
-            for entity in result.entries:
-                if 'resource' not in entity:
-                    print(pformat(entity))
-
-                resource = entity['resource']
-                if resource['resourceType'] != resource_type:
-                    print(f"Here is an issue: {resource['resourceType']} ~= {resource_type}")
-                else:
-                    target_id = resource['id']
-                    try:
-                        # get_identifier() may return None; indexing it here is
-                        # intentional -- the resulting TypeError is handled below
-                        # the same way as a missing 'system'/'value' key.
-                        identifier = get_identifier(resource)
-                        target_system = identifier['system']  # type: ignore[index]
-                        if self.valid_system(target_system):
-                            entity_key = identifier['value']  # type: ignore[index]
-                            self.store_id(resource_type, target_system, entity_key, target_id, exit_on_dupes=exit_on_dupes)
-                            record_count += 1
-                    except (TypeError, IndexError, KeyError):
-                        self.missing_identifiers[resource_type].append(resource)
+        first_page = True
+        for page in fhir_client.iter_pages(f"{resource_type}?{query_string}", **get_args):
+            if not page.success():
+                break
+            if first_page and checkpoint is not None:
+                # The pages handled before resuming come back from the spool
+                for entries in checkpoint.spooled_pages():
+                    record_count += self._store_entries(resource_type, entries, exit_on_dupes)
+            first_page = False
+            record_count += self._store_entries(resource_type, page.entries, exit_on_dupes)
+
+        if checkpoint is not None and not first_page:
+            # Everything has been stored, so there is nothing left to resume
+            checkpoint.clear()
+        return record_count
 
+    def _store_entries(
+        self, resource_type: str, entries: list[dict[str, Any]], exit_on_dupes: bool
+    ) -> int:
+        record_count = 0
+        for entity in entries:
+            if 'resource' not in entity:
+                print(pformat(entity))
+
+            resource = entity['resource']
+            if resource['resourceType'] != resource_type:
+                print(f"Here is an issue: {resource['resourceType']} ~= {resource_type}")
+            else:
+                target_id = resource['id']
+                try:
+                    # get_identifier() may return None; indexing it here is
+                    # intentional -- the resulting TypeError is handled below
+                    # the same way as a missing 'system'/'value' key.
+                    identifier = get_identifier(resource)
+                    target_system = identifier['system']  # type: ignore[index]
+                    if self.valid_system(target_system):
+                        entity_key = identifier['value']  # type: ignore[index]
+                        self.store_id(resource_type, target_system, entity_key, target_id, exit_on_dupes=exit_on_dupes)
+                        record_count += 1
+                except (TypeError, IndexError, KeyError):
+                    self.missing_identifiers[resource_type].append(resource)
         return record_count
 
 
@@ -206,7 +564,12 @@ class RIdCache:
         :type entity_key: str
         """
         try:
-            result = self.cache[target_system].get(entity_key)
+            if self.index is not None:
+                result = self.index.get(target_system, entity_key)
+            else:
+                result = self.cache[target_system].get(entity_key)
+            if result is None and self.snapshot is not None:
+                result = self.snapshot.get(target_system, entity_key)
         except Exception as ex:
             report_exception(ex, msg=f"{target_system} : {entity_key}")
 
@@ -216,6 +579,68 @@ class RIdCache:
             return result[1]
         return result
 
+    def write_snapshot(self, path: str | Path) -> None:
+        """
+        Write the cache to a file suitable for sharing, read-only, with other
+        processes via IdSnapshot (see attach_snapshot)
+        """
+        # An external sort: runs of at most snapshot_run_lines are sorted in
+        # memory and spilled, then merged, so memory stays bounded however
+        # many ids there are. Sorting the raw bytes keeps the order consistent
+        # with IdSnapshot's search
+        with tempfile.TemporaryDirectory(prefix="ridcache-snapshot-") as tmpdir:
+            runs: list[Path] = []
+            lines: list[bytes] = []
+
+            def spill() -> None:
+                lines.sort()
+                run = Path(tmpdir) / f"run-{len(runs)}"
+                with run.open("wb") as f:
+                    f.writelines(lines)
+                runs.append(run)
+                lines.clear()
+
+            for target_system, entity_key, entity_type, target_id in self.ids():
+                key = f"{_escape(target_system)}\t{_escape(entity_key)}\t".encode("utf-8")
+                lines.append(key + f"{_escape(entity_type)}\t{_escape(target_id)}\n".encode("utf-8"))
+                if len(lines) >= self.snapshot_run_lines:
+                    spill()
+
+            if len(runs) == 0:
+                lines.sort()
+                with open(path, "wb") as f:
+                    f.writelines(lines)
+                return
+
+            if len(lines) > 0:
+                spill()
+            with ExitStack() as stack:
+                files = [stack.enter_context(run.open("rb")) for run in runs]
+                with open(path, "wb") as f:
+                    f.writelines(heapq.merge(*files))
+
+    def attach_snapshot(self, path: str | Path) -> None:
+        """Use the snapshot at path for any ids that aren't in this cache"""
+        self.snapshot = IdSnapshot(path)
+
+    def ids(self) -> Iterator[tuple[str, str, str, str]]:
+        """Yield (system, value, resourceType, id) for every id in the cache"""
+        if self.index is not None:
+            yield from self.index.items()
+        else:
+            for target_system, ids in self.cache.items():
+                for entity_key, (entity_type, target_id) in ids.items():
+                    yield (target_system, entity_key, entity_type, target_id)
+
+    def close(self) -> None:
+        """Release the on-disk index and snapshot, if there are any"""
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
     def store_id(
         self,
         entity_type: str,
@@ -266,14 +691,31 @@ class RIdCache:
         if target_system.split("/")[-1] != entity_type.lower():
             self.malformed_ids.add(f"{target_system}|{entity_key}")
 
-        if entity_key in self.cache[target_system]:
+        if self.index is not None:
+            existing = self.index.get(target_system, entity_key)
+        else:
+            existing = self.cache[target_system].get(entity_key)
+
+        if existing is not None:
             if exit_on_dupes:
                 sys.stderr.write(f"""Duplicate key found for {target_system}:{entity_key} 
     -> {entity_type}/{target_id} exists with the same key.\n""")
                 # This is a bit harsh, but 
                 os._exit(1)
 
-        self.cache[target_system][entity_key] = (entity_type, target_id)
+            # Storing the id we already have isn't a duplicate
+            if self.track_duplicates and existing != (entity_type, target_id):
+                resources = self.duplicates.setdefault(
+                    (target_system, entity_key), [f"{existing[0]}/{existing[1]}"]
+                )
+                resource = f"{entity_type}/{target_id}"
+                if resource not in resources:
+                    resources.append(resource)
+
+        if self.index is not None:
+            self.index.put(target_system, entity_key, entity_type, target_id)
+        else:
+            self.cache[target_system][entity_key] = (entity_type, target_id)
         # id_log.write(f"{target_system}\t{entity_key}\t{entity_type}\t{target_id}\n")
 
 def exec() -> None:
@@ -298,12 +740,89 @@ def exec() -> None:
         action='append',
         help="Strings that identifier systems can match to be of interest. If none are provided all systems will 'match'"    
     )
+    parser.add_argument(
+        "-s",
+        "--system",
+        type=str,
+        action='append',
+        help="Identifier systems to load. If provided, ids from any other system are never downloaded"
+    )
+    parser.add_argument(
+        "--study-id",
+        type=str,
+        help="Only load ids for resources tagged with this study id"
+    )
+    parser.add_argument(
+        "--max-memory-ids",
+        type=int,
+        help="Keep at most this many ids in memory, spilling the rest to a temporary on-disk index"
+    )
+    parser.add_argument(
+        "--checkpoint-dir",
+        type=str,
+        help="Save the harvest's progress here so that it can be resumed if interrupted"
+    )
+    parser.add_argument(
+        "--window",
+        action="store_true",
+        help="Sort the harvest by _lastUpdated so it can be resumed even if the server's paging cursors expire"
+    )
+    parser.add_argument(
+        "--duplicates",
+        type=str,
+        help="Report every identifier shared by more than one resource and write them to this TSV file"
+    )
+    parser.add_argument(
+        "--page-size",
+        type=lambda value: value if value == "auto" else int(value),
+        help="_count to use for the harvest, or 'auto' to adapt it to the server (defaults to the host's performance profile)"
+    )
+    parser.add_argument(
+        "--progress",
+        choices=progress_levels,
+        help="How much to report as the ids are loaded (defaults to the host's progress setting)"
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        help="Profile the harvest, writing cProfile output and a breakdown of where the time went to this directory"
+    )
+    parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help="Also track the harvest's peak memory (slows things down considerably)"
+    )
     args = parser.parse_args(sys.argv[1:])
 
-    fhir_client = FhirClient(host_config[args.env])
-
-    idcache = RIdCache(valid_patterns=args.system_pattern)
+    cfg = host_config[args.env]
+    if args.progress is not None:
+        cfg = dict(cfg, progress=args.progress)
+    profiler = None
+    if args.profile is not None:
+        profiler = Profiler(args.profile, track_memory=args.profile_memory)
+        profiler.start()
+    fhir_client = FhirClient(cfg, profiler=profiler)
+
+    idcache = RIdCache(
+        study_id=args.study_id,
+        valid_patterns=args.system_pattern,
+        systems=args.system,
+        max_memory_ids=args.max_memory_ids,
+        track_duplicates=args.duplicates is not None,
+        checkpoint_dir=args.checkpoint_dir,
+        checkpoint_window=args.window,
+        page_size=args.page_size,
+    )
     idcache.load_ids_from_host(fhir_client)
+    if args.duplicates is not None:
+        idcache.write_duplicates(args.duplicates)
+        print(f"{len(idcache.duplicates)} duplicate identifiers written to {args.duplicates}")
+    idcache.close()
+
+    if profiler is not None:
+        profiler.stop()
+        for path in profiler.write():
+            print(f"Profile written to {path}")
 
 if __name__ == "__main__":
     exec()
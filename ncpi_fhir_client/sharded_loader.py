@@ -0,0 +1,288 @@
+"""
+Multi-process loader for NDJSON files.
+
+A single process spends most of its time parsing and serializing JSON, so it
+tops out at one core. This driver shards each NDJSON file across a pool of
+worker processes, each with its own FhirClient. Each worker is handed a
+contiguous range of the file's bytes and loads the lines that start within
+it, so no worker has to read (let alone parse) the rest of the file.
+
+The RIdCache is only warmed up once, by the parent. It is written to a
+snapshot file which every worker memory-maps read-only (see IdSnapshot), so
+the workers share a single copy rather than each harvesting the server. The
+ids the workers create are sent back and merged into the parent's cache
+once the load is finished.
+
+Files are loaded one at a time, in the order given, so resources that others
+depend on should come first.
+"""
+from __future__ import annotations
+
+import math
+import sys
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from json import loads
+from multiprocessing import get_context
+from os import cpu_count
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any
+
+from rich import print
+from rich.console import Console
+from rich.table import Table
+
+from ncpi_fhir_client.host_config import get_host_config
+from ncpi_fhir_client.progress import ProgressReporter, progress_levels
+from ncpi_fhir_client.ridcache import RIdCache, get_identifier
+
+# (resourceType, system, value, id) for each resource created by a worker
+NewId = tuple[str, str, str, str]
+
+
+@dataclass
+class ShardResult:
+    path: str
+    written: int = 0
+    failed: int = 0
+    new_ids: list[NewId] = field(default_factory=list)
+
+
+# Each worker process builds these once, in _init_worker
+_worker_client: Any = None
+
+
+def _init_worker(host_cfg: dict[str, Any], snapshot_path: str | None) -> None:
+    global _worker_client
+    from ncpi_fhir_client.fhir_client import FhirClient
+
+    _worker_client = FhirClient(host_cfg)
+
+    # Attached after the fact so the client doesn't harvest ids on its own
+    if snapshot_path is not None:
+        idcache = RIdCache()
+        idcache.attach_snapshot(snapshot_path)
+        _worker_client.idcache = idcache
+
+
+def byte_ranges(path: str | Path, shard_count: int) -> list[tuple[int, int]]:
+    """Split path into shard_count ranges of (start, end) byte offsets"""
+    size = Path(path).stat().st_size
+    step = math.ceil(size / shard_count)
+    return [(min(shard * step, size), min((shard + 1) * step, size)) for shard in range(shard_count)]
+
+
+def _load_shard(path: str, start: int, end: int) -> ShardResult:
+    """Load the lines of path that start at or after byte start and before byte end"""
+    result = ShardResult(path)
+    idcache = _worker_client.idcache
+
+    with open(path, "rb") as f:
+        if start > 0:
+            # The line running across start belongs to the shard before
+            f.seek(start - 1)
+            f.readline()
+        position = f.tell()
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            if not line.strip():
+                continue
+
+            resource = loads(line)
+            resource_type = resource["resourceType"]
+
+            identifier = get_identifier(resource)
+            system: str | None = None
+            value = ""
+            if identifier is not None and "system" in identifier and "value" in identifier:
+                system, value = identifier["system"], identifier["value"]
+
+            response = _worker_client.post(
+                resource_type,
+                resource,
+                identifier=None if system is None else f"{system}|{value}",
+            )
+
+            if 200 <= response["status_code"] < 300:
+                result.written += 1
+                created = response.get("response")
+                if (
+                    system is not None
+                    and "id" not in resource
+                    and isinstance(created, dict)
+                    and "id" in created
+                ):
+                    if idcache is not None:
+                        idcache.store_id(resource_type, system, value, created["id"])
+                    result.new_ids.append((resource_type, system, value, created["id"]))
+            else:
+                result.failed += 1
+
+    # The worker may not get the chance once the pool is done with it
+    _worker_client.close()
+    return result
+
+
+def load_sharded(
+    host_cfg: dict[str, Any],
+    paths: list[str | Path],
+    workers: int | None = None,
+    idcache: RIdCache | None = None,
+    progress: ProgressReporter | None = None,
+) -> list[ShardResult]:
+    """Load NDJSON files, in order, using a pool of worker processes
+
+    :param host_cfg: The host's configuration (an entry from fhir_hosts)
+    :param paths: NDJSON files to be loaded
+    :param workers: Number of worker processes, defaults to the number of cores
+    :param idcache: A warm cache to share with the workers. New ids are merged into it.
+    :param progress: Counts each shard as it finishes. Unless it is verbose, the workers are quiet.
+    :return: One result per file per worker
+    """
+    if workers is None:
+        workers = cpu_count() or 1
+    if progress is None:
+        progress = ProgressReporter.from_cfg(host_cfg)
+    progress.label = "Shards"
+    progress.total = len(paths) * workers
+    if not progress.verbose:
+        # A status line per process would only garble one another
+        host_cfg = dict(host_cfg, progress="quiet")
+
+    results = []
+    with TemporaryDirectory() as tmpdir:
+        snapshot_path = None
+        if idcache is not None:
+            snapshot_path = str(Path(tmpdir) / "ridcache.snapshot")
+            idcache.write_snapshot(snapshot_path)
+
+        # spawn keeps the workers from inheriting the parent's threads and locks
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(host_cfg, snapshot_path),
+        ) as executor:
+            with progress:
+                for path in paths:
+                    futures = [
+                        executor.submit(_load_shard, str(path), start, end)
+                        for start, end in byte_ranges(path, workers)
+                    ]
+                    for future in futures:
+                        result = future.result()
+                        results.append(result)
+                        progress.note("written", sum(r.written for r in results))
+                        progress.record(ok=result.failed == 0)
+
+    if idcache is not None:
+        for result in results:
+            for resource_type, system, value, target_id in result.new_ids:
+                idcache.store_id(resource_type, system, value, target_id)
+
+    return results
+
+
+def exec() -> None:
+    from ncpi_fhir_client.fhir_client import FhirClient
+
+    host_config = get_host_config()
+    env_options = sorted(host_config.keys())
+
+    parser = ArgumentParser(
+        description="Load NDJSON files into a FHIR server using multiple processes"
+    )
+    parser.add_argument(
+        "-e",
+        "--env",
+        choices=env_options,
+        required=True,
+        help="Remote configuration to be used to access the FHIR server.",
+    )
+    parser.add_argument(
+        "files",
+        nargs="+",
+        help="NDJSON files to load. Files are loaded in the order given, so resources that others depend on should come first.",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=cpu_count(),
+        help="Number of worker processes (default is the number of cores)",
+    )
+    parser.add_argument(
+        "-p",
+        "--system-pattern",
+        type=str,
+        action="append",
+        help="Strings that identifier systems can match to be of interest to the ID cache. If none are provided all systems will 'match'",
+    )
+    parser.add_argument(
+        "-s",
+        "--system",
+        type=str,
+        action="append",
+        help="Identifier systems the files use. If provided, ids from any other system are never downloaded",
+    )
+    parser.add_argument(
+        "--max-memory-ids",
+        type=int,
+        help="Keep at most this many ids in the parent's memory, spilling the rest to a temporary on-disk index",
+    )
+    parser.add_argument(
+        "--no-idcache",
+        action="store_true",
+        help="Skip the ID cache and let each write look up its identifier on the server",
+    )
+    parser.add_argument(
+        "--progress",
+        choices=progress_levels,
+        help="How much to report as the files load (defaults to the host's progress setting)",
+    )
+    args = parser.parse_args(sys.argv[1:])
+
+    host_cfg = host_config[args.env]
+    if args.progress is not None:
+        host_cfg = dict(host_cfg, progress=args.progress)
+
+    idcache = None
+    if not args.no_idcache:
+        idcache = RIdCache(
+            valid_patterns=args.system_pattern,
+            systems=args.system,
+            max_memory_ids=args.max_memory_ids,
+        )
+        idcache.load_ids_from_host(FhirClient(host_cfg))
+
+    results = load_sharded(host_cfg, args.files, workers=args.workers, idcache=idcache)
+    if idcache is not None:
+        idcache.close()
+
+    table = Table(title=f"Sharded Load: {host_cfg.get('target_service_url')}")
+    table.add_column("File", justify="left", style="cyan")
+    table.add_column("Written", justify="right", style="yellow")
+    table.add_column("Failed", justify="right", style="red")
+    table.add_column("New IDs", justify="right")
+    for path in args.files:
+        file_results = [r for r in results if r.path == str(path)]
+        table.add_row(
+            str(path),
+            str(sum(r.written for r in file_results)),
+            str(sum(r.failed for r in file_results)),
+            str(sum(len(r.new_ids) for r in file_results)),
+        )
+    Console().print(table, justify="center")
+
+    if sum(r.failed for r in results) > 0:
+        print("[red]Some resources failed to load[/red]")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    exec()
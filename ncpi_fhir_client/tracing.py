@@ -0,0 +1,195 @@
+"""
+Tracing spans around client operations.
+
+Counters say how much was done; a trace shows what a single call turned
+into, such as a post that became an identifier search, two retries and a
+PUT, or a get that followed 500 pages. Once a tracer is installed, the
+client emits nested spans for:
+
+    FhirClient.get, post, load...   each high level call
+    page                            each page of a search
+    send_request                    each request, with its status
+    retry                           each of urllib3's retries (the backoff,
+                                    see performance.HostRetry)
+    token refresh                   fetching a new token from an auth server
+
+Spans carry the resource type, method and status code (fhir.resource_type,
+http.method, http.status_code...). No tracer is installed by default, in
+which case each hook is a check against None.
+
+RecordingTracer needs nothing beyond the standard library and keeps the
+spans it finishes in memory, dropping the oldest once it is full:
+
+    tracer = RecordingTracer()
+    set_tracer(tracer)
+    client.post("Patient", patient)
+    tracer.write("trace.ndjson")
+
+OpenTelemetryTracer hands the spans to OpenTelemetry instead, which has to
+be installed (pip install "ncpi-fhir-client[otel]") and configured with an
+exporter as usual:
+
+    set_tracer(OpenTelemetryTracer())
+
+The tracer is shared by every thread (token refreshes happen well away from
+any client), while the nesting of spans is kept per thread.
+"""
+from __future__ import annotations
+
+import json
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from itertools import count
+from pathlib import Path
+from time import time
+from typing import Any, ContextManager, Iterator
+
+
+class Span:
+    """What a span needs to offer the code it surrounds"""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+
+class _NoSpan(Span):
+    """Stands in for a span when there is no tracer. Stateless, so one serves everyone"""
+
+    def __enter__(self) -> Span:
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        pass
+
+
+_no_span = _NoSpan()
+
+
+class Tracer(ABC):
+    @abstractmethod
+    def span(self, name: str, attributes: dict[str, Any]) -> ContextManager[Span]:
+        """Context manager wrapping the block in a span, nested inside the thread's current span"""
+
+
+_tracer: Tracer | None = None
+
+
+def set_tracer(tracer: Tracer | None) -> None:
+    """Install tracer (or None to stop tracing)"""
+    global _tracer
+    _tracer = tracer
+
+
+def get_tracer() -> Tracer | None:
+    return _tracer
+
+
+def span(name: str, attributes: dict[str, Any] | None = None) -> ContextManager[Span]:
+    """A span from the installed tracer, or a stand in that does nothing"""
+    tracer = _tracer
+    if tracer is None:
+        return _no_span
+    return tracer.span(name, attributes or {})
+
+
+@dataclass
+class RecordedSpan(Span):
+    name: str
+    span_id: int
+    parent_id: int | None
+    thread: str
+    # Seconds since the epoch
+    start: float
+    end: float | None = None
+    attributes: dict[str, Any] = field(default_factory=dict)
+    error: str | None = None
+
+    @property
+    def duration(self) -> float | None:
+        return None if self.end is None else self.end - self.start
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+
+class RecordingTracer(Tracer):
+    def __init__(self, capacity: int = 100000) -> None:
+        """
+        :param capacity: Number of finished spans kept. Older ones are dropped
+        """
+        assert capacity > 0, "capacity must be positive"
+        self._spans: deque[RecordedSpan] = deque(maxlen=capacity)
+        self._ids = count(1)
+        self._local = threading.local()
+        self.lock = threading.Lock()
+
+    def _stack(self) -> list[RecordedSpan]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextmanager
+    def span(self, name: str, attributes: dict[str, Any]) -> Iterator[RecordedSpan]:
+        stack = self._stack()
+        with self.lock:
+            span_id = next(self._ids)
+        recorded = RecordedSpan(
+            name,
+            span_id,
+            stack[-1].span_id if stack else None,
+            threading.current_thread().name,
+            time(),
+            attributes=dict(attributes),
+        )
+        stack.append(recorded)
+        try:
+            yield recorded
+        except BaseException as e:
+            recorded.error = repr(e)
+            raise
+        finally:
+            recorded.end = time()
+            stack.pop()
+            with self.lock:
+                self._spans.append(recorded)
+
+    def spans(self) -> list[RecordedSpan]:
+        """The finished spans still held, in the order they finished"""
+        with self.lock:
+            return list(self._spans)
+
+    def children(self, parent: RecordedSpan) -> list[RecordedSpan]:
+        return [s for s in self.spans() if s.parent_id == parent.span_id]
+
+    def clear(self) -> None:
+        with self.lock:
+            self._spans.clear()
+
+    def write(self, path: str | Path) -> None:
+        """Write the finished spans to path, one JSON object per line"""
+        with open(path, "wt") as f:
+            for recorded in self.spans():
+                f.write(json.dumps(asdict(recorded), default=str) + "\n")
+
+
+class OpenTelemetryTracer(Tracer):
+    def __init__(self, tracer: Any = None) -> None:
+        """
+        :param tracer: An OpenTelemetry Tracer, defaults to one from the global TracerProvider
+        """
+        if tracer is None:
+            # Only needed by those who ask for it
+            from opentelemetry import trace
+
+            tracer = trace.get_tracer("ncpi_fhir_client")
+        self.tracer = tracer
+
+    def span(self, name: str, attributes: dict[str, Any]) -> ContextManager[Span]:
+        # OpenTelemetry rejects attributes without a value
+        return self.tracer.start_as_current_span(
+            name, attributes={k: v for k, v in attributes.items() if v is not None}
+        )
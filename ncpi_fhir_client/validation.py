@@ -0,0 +1,375 @@
+"""
+Server-side validation ($validate) of many resources at once.
+
+Resources are grouped by resource type and profile before being sent. Each
+group is validated in turn by a bounded pool of worker threads, so the
+server is working against a single profile at a time rather than jumping
+between them. Groups are sent as soon as they reach batch_size resources
+(or when max_buffered resources are waiting altogether), so the input is
+streamed rather than read in full before anything is validated.
+
+Outcomes are cached by resource type, profile and a hash of the resource's
+content (see change_detection.resource_hash), so a rerun only sends the
+resources that changed since they were last validated. The cache can be
+persisted, one file per host, in the same append-only style as the
+ChangeTracker:
+
+    cache = ValidationCache.for_host(client.host_desc)
+
+The cache has no way of knowing when the profiles themselves change on the
+server, so it should be cleared (or the file deleted) when a new version of
+the IG is loaded.
+"""
+from __future__ import annotations
+
+import json
+import sys
+from argparse import ArgumentParser
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from functools import partial
+from pathlib import Path
+from pprint import pformat
+from threading import Lock
+from typing import Any, Iterable, Iterator, TextIO
+
+from rich import print
+from rich.console import Console
+from rich.table import Table
+
+from ncpi_fhir_client.change_detection import resource_hash
+from ncpi_fhir_client.host_config import get_host_config
+from ncpi_fhir_client.progress import progress_levels
+
+# Severities that make a resource invalid
+error_severities = {"error", "fatal"}
+
+# Status codes the server uses to report the result of a validation. Anything
+# else (such as a 500) says nothing about the resource, so it isn't cached
+outcome_status_codes = {200, 400, 412, 422}
+
+
+@dataclass
+class ValidationResult:
+    resource_type: str
+    id: str | None
+    profile: str | None
+    valid: bool
+    status_code: int
+    issues: list[dict[str, Any]] = field(default_factory=list)
+    # True if the outcome came from the cache rather than the server
+    cached: bool = False
+
+    def errors(self) -> list[dict[str, Any]]:
+        return [issue for issue in self.issues if issue.get("severity") in error_severities]
+
+
+def profiles(resource: dict[str, Any]) -> list[str]:
+    return list(resource.get("meta", {}).get("profile", []))
+
+
+def cache_key(resource_type: str, resource: dict[str, Any]) -> str:
+    """Key the outcome by type, every declared profile and the resource's content"""
+    return f"{resource_type}|{','.join(profiles(resource))}|{resource_hash(resource)}"
+
+
+class ValidationCache:
+    def __init__(self, store_path: str | Path | None = None) -> None:
+        """
+        :param store_path: File in which outcomes are persisted. If None, they are only kept in memory
+        """
+        self.store_path = None if store_path is None else Path(store_path)
+
+        # cache_key => (valid, status_code, issues)
+        self.outcomes: dict[str, tuple[bool, int, list[dict[str, Any]]]] = {}
+        self.lock = Lock()
+        self._store: TextIO | None = None
+
+        if self.store_path is not None and self.store_path.is_file():
+            with self.store_path.open("rt") as f:
+                for line in f:
+                    # A crash can leave a partial last line behind
+                    try:
+                        key, valid, status_code, issues = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.outcomes[key] = (valid, status_code, issues)
+
+    @classmethod
+    def for_host(
+        cls, host_desc: str, directory: str | Path = ".validation_cache"
+    ) -> ValidationCache:
+        """Return a cache whose store is specific to a single host"""
+        return cls(Path(directory) / f"{host_desc}.outcomes")
+
+    def __len__(self) -> int:
+        return len(self.outcomes)
+
+    def get(self, key: str) -> tuple[bool, int, list[dict[str, Any]]] | None:
+        with self.lock:
+            return self.outcomes.get(key)
+
+    def record(self, key: str, valid: bool, status_code: int, issues: list[dict[str, Any]]) -> None:
+        with self.lock:
+            self.outcomes[key] = (valid, status_code, issues)
+            if self.store_path is not None:
+                if self._store is None:
+                    self.store_path.parent.mkdir(parents=True, exist_ok=True)
+                    self._store = self.store_path.open("at")
+                self._store.write(json.dumps([key, valid, status_code, issues]) + "\n")
+                self._store.flush()
+
+    def clear(self) -> None:
+        """Forget every outcome, such as after the profiles have changed"""
+        with self.lock:
+            self.outcomes = {}
+            if self._store is not None:
+                self._store.close()
+                self._store = None
+            if self.store_path is not None:
+                self.store_path.unlink(missing_ok=True)
+
+    def close(self) -> None:
+        with self.lock:
+            if self._store is not None:
+                self._store.close()
+                self._store = None
+
+
+class ValidationPipeline:
+    def __init__(
+        self,
+        fhir_client: Any,
+        cache: ValidationCache | None = None,
+        max_workers: int = 4,
+        batch_size: int = 500,
+        max_buffered: int = 5000,
+    ) -> None:
+        """
+        :param fhir_client: client used to reach the server
+        :type fhir_client: FhirClient
+        :param cache: Outcomes from earlier runs. Resources whose outcome is cached are not sent
+        :param max_workers: Number of $validate requests in flight at once
+        :param batch_size: A group (resource type and profile) is sent once it holds this many resources
+        :param max_buffered: Every group is sent once this many resources are waiting altogether
+        """
+        self.fhir_client = fhir_client
+        self.cache = cache if cache is not None else ValidationCache()
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.max_buffered = max_buffered
+
+    def _validate_one(self, resource_type: str, resource: dict[str, Any]) -> ValidationResult:
+        declared = profiles(resource)
+        profile = declared[0] if len(declared) > 0 else None
+
+        endpoint = f"{self.fhir_client.target_service_url}/{resource_type}/$validate"
+        if profile is not None:
+            endpoint = f"{endpoint}?profile={profile}"
+
+        success, result = self.fhir_client.send_request("POST", endpoint, json=resource)
+        status_code = result["status_code"]
+        response = result.get("response")
+
+        is_outcome = isinstance(response, dict) and response.get("resourceType") == "OperationOutcome"
+        issues = []
+        if is_outcome:
+            issues = response.get("issue", [])
+        elif not success:
+            issues = [{"severity": "error", "diagnostics": pformat(response)}]
+
+        valid = success and not any(issue.get("severity") in error_severities for issue in issues)
+        if is_outcome and status_code in outcome_status_codes:
+            self.cache.record(cache_key(resource_type, resource), valid, status_code, issues)
+
+        return ValidationResult(
+            resource_type, resource.get("id"), profile, valid, status_code, issues
+        )
+
+    def validate(
+        self, resources: Iterable[tuple[str, dict[str, Any]]]
+    ) -> Iterator[ValidationResult]:
+        """Validate each (resource type, resource), yielding the results as they are known
+
+        Cached outcomes are yielded as they are read. The rest are sent a
+        batch (of a single resource type and profile) at a time.
+        """
+        groups: defaultdict[tuple[str, str], list[dict[str, Any]]] = defaultdict(list)
+        buffered = 0
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+
+            def send(key: tuple[str, str]) -> Iterator[ValidationResult]:
+                group = groups.pop(key)
+                return executor.map(partial(self._validate_one, key[0]), group)
+
+            for resource_type, resource in resources:
+                declared = profiles(resource)
+                profile = declared[0] if len(declared) > 0 else None
+
+                outcome = self.cache.get(cache_key(resource_type, resource))
+                if outcome is not None:
+                    valid, status_code, issues = outcome
+                    yield ValidationResult(
+                        resource_type,
+                        resource.get("id"),
+                        profile,
+                        valid,
+                        status_code,
+                        issues,
+                        cached=True,
+                    )
+                    continue
+
+                key = (resource_type, profile or "")
+                groups[key].append(resource)
+                buffered += 1
+                if len(groups[key]) >= self.batch_size:
+                    buffered -= len(groups[key])
+                    yield from send(key)
+                elif buffered >= self.max_buffered:
+                    for key in sorted(groups):
+                        yield from send(key)
+                    buffered = 0
+
+            for key in sorted(groups):
+                yield from send(key)
+
+
+def summary_table(results: list[ValidationResult]) -> Table:
+    counts: defaultdict[tuple[str, str], dict[str, int]] = defaultdict(
+        lambda: {"valid": 0, "invalid": 0, "cached": 0}
+    )
+    for result in results:
+        row = counts[(result.resource_type, result.profile or "")]
+        row["valid" if result.valid else "invalid"] += 1
+        row["cached"] += result.cached
+
+    table = Table(title="Validation")
+    table.add_column("Resource Type", justify="right", style="cyan")
+    table.add_column("Profile", justify="left")
+    table.add_column("Valid", justify="right", style="green")
+    table.add_column("Invalid", justify="right", style="red")
+    table.add_column("Cached", justify="right", style="yellow")
+    for (resource_type, profile), row in sorted(counts.items()):
+        table.add_row(
+            resource_type, profile, str(row["valid"]), str(row["invalid"]), str(row["cached"])
+        )
+    return table
+
+
+def read_resources(path: str | Path) -> Iterator[tuple[str, dict[str, Any]]]:
+    """Yield (resource type, resource) from an NDJSON file, or a JSON resource or Bundle"""
+    path = Path(path)
+    if path.suffix == ".ndjson":
+        with path.open("rt") as f:
+            for line in f:
+                if line.strip():
+                    resource = json.loads(line)
+                    yield (resource["resourceType"], resource)
+        return
+
+    resource = json.loads(path.read_text())
+    if resource["resourceType"] == "Bundle":
+        for entry in resource.get("entry", []):
+            yield (entry["resource"]["resourceType"], entry["resource"])
+    else:
+        yield (resource["resourceType"], resource)
+
+
+def exec() -> None:
+    from ncpi_fhir_client.fhir_client import FhirClient
+
+    host_config = get_host_config()
+    env_options = sorted(host_config.keys())
+
+    parser = ArgumentParser(
+        description="Validate resources against a FHIR server, skipping those whose outcome is already known"
+    )
+    parser.add_argument(
+        "-e",
+        "--env",
+        choices=env_options,
+        required=True,
+        help="Remote configuration to be used to access the FHIR server.",
+    )
+    parser.add_argument(
+        "files",
+        nargs="+",
+        help="NDJSON files, or JSON files containing a resource or Bundle",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="Number of $validate requests to have in flight at once (defaults to the host's performance concurrency)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=500,
+        help="Send resources of the same type and profile once this many have been read",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Validate everything, ignoring (and not saving) outcomes from earlier runs",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        help="Write the invalid resources' issues to this file (NDJSON)",
+    )
+    parser.add_argument(
+        "--progress",
+        choices=progress_levels,
+        help="How much to report as the resources are validated (defaults to the host's progress setting)",
+    )
+    args = parser.parse_args(sys.argv[1:])
+
+    cfg = host_config[args.env]
+    if args.progress is not None:
+        cfg = dict(cfg, progress=args.progress)
+    fhir_client = FhirClient(cfg)
+    progress = fhir_client.progress
+    progress.label = "Resources"
+    cache = None if args.no_cache else ValidationCache.for_host(fhir_client.host_desc)
+    pipeline = ValidationPipeline(
+        fhir_client,
+        cache=cache,
+        max_workers=args.workers or fhir_client.performance.concurrency,
+        batch_size=args.batch_size,
+    )
+
+    def resources() -> Iterator[tuple[str, dict[str, Any]]]:
+        for path in args.files:
+            yield from read_resources(path)
+
+    results = []
+    with progress:
+        for result in pipeline.validate(resources()):
+            results.append(result)
+            progress.record(ok=result.valid)
+            if not result.valid:
+                progress.message(
+                    f"{result.resource_type}/{result.id} is invalid", detail=pformat(result.issues)
+                )
+    pipeline.cache.close()
+
+    Console().print(summary_table(results), justify="center")
+
+    invalid = [result for result in results if not result.valid]
+    if args.output is not None:
+        with open(args.output, "wt") as f:
+            for result in invalid:
+                f.write(json.dumps(asdict(result)) + "\n")
+
+    if len(invalid) > 0:
+        print(f"[red]{len(invalid)} resources failed validation[/red]")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    exec()
@@ -0,0 +1,157 @@
+"""
+Append-only journal of the writes made by FhirClient.post, so that a load
+which dies part way through can be rerun without sending everything again.
+
+Each completed write is recorded as a single line:
+
+    key<tab>hash<tab>id<tab>status
+
+where key identifies the resource across runs (its type and first
+identifier or, failing that, its type and id), hash is the content hash
+of what was sent (see change_detection.resource_hash) and id is the id the
+server assigned. A rerun skips any resource whose key and content match a
+successful write in the journal.
+
+Lines are flushed as they are written, so a crash loses nothing that the
+server acknowledged; they are fsync'd every sync_every records (and on
+close) to survive losing the machine as well. A partial last line, left by
+a crash, is ignored. Later lines win when the journal is read back, and
+compact() rewrites it with only the latest line per resource.
+"""
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from threading import Lock
+from typing import Any, TextIO
+
+from ncpi_fhir_client.change_detection import resource_hash
+
+
+def journal_key(resource_type: str, resource: dict[str, Any]) -> str | None:
+    """The key a resource is journaled under, or None if it can't be identified"""
+    identifier = resource.get("identifier")
+    if isinstance(identifier, list):
+        identifier = identifier[0] if len(identifier) > 0 else None
+    if isinstance(identifier, dict) and "system" in identifier and "value" in identifier:
+        value = f"{identifier['system']}|{identifier['value']}"
+        # Keep the line parseable no matter what is in the identifier
+        return f"{resource_type}?{value.replace(chr(9), ' ').replace(chr(10), ' ')}"
+
+    if "id" in resource:
+        return f"{resource_type}/{resource['id']}"
+    return None
+
+
+class WriteJournal:
+    def __init__(self, path: str | Path, sync_every: int = 1000) -> None:
+        """
+        :param path: The journal file. Entries from earlier runs are loaded if it exists
+        :param sync_every: fsync the journal after this many records
+        """
+        self.path = Path(path)
+        self.sync_every = sync_every
+
+        # key => (hash, id, status). Only the digest's bytes are kept to
+        # hold down the memory used by large journals
+        self.entries: dict[str, tuple[bytes, str, int]] = {}
+        self.lock = Lock()
+        self._file: TextIO | None = None
+        self._unsynced = 0
+
+        # Just some statistics for the end of the run
+        self.skipped_count = 0
+        self.recorded_count = 0
+
+        if self.path.is_file():
+            with self.path.open("rt") as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        continue
+                    pieces = line[:-1].split("\t")
+                    if len(pieces) == 4 and len(pieces[1]) == 32 and pieces[3].isdigit():
+                        self.entries[pieces[0]] = (
+                            bytes.fromhex(pieces[1]),
+                            pieces[2],
+                            int(pieces[3]),
+                        )
+
+    @classmethod
+    def for_host(cls, host_desc: str, directory: str | Path = ".write_journal") -> WriteJournal:
+        """Return a journal specific to a single host"""
+        return cls(Path(directory) / f"{host_desc}.journal")
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def written_id(self, resource_type: str, resource: dict[str, Any]) -> str | None:
+        """Return the id resource was written to, if the journal shows it was written as it is now"""
+        key = journal_key(resource_type, resource)
+        if key is None:
+            return None
+
+        with self.lock:
+            entry = self.entries.get(key)
+            # Entries without an id (from older journals) aren't enough to skip the write
+            if (
+                entry is None
+                or not (200 <= entry[2] < 300)
+                or entry[1] == ""
+                or entry[0] != bytes.fromhex(resource_hash(resource))
+            ):
+                return None
+            self.skipped_count += 1
+            return entry[1]
+
+    def record(
+        self, resource_type: str, resource: dict[str, Any], id: str | None, status_code: int
+    ) -> None:
+        """Record a write, as sent (before the server assigned it an id)
+
+        Writes without an id, such as those the server rejected, are left out
+        since a rerun has to send them again anyway.
+        """
+        key = journal_key(resource_type, resource)
+        if key is None or not id:
+            return
+
+        content_hash = resource_hash(resource)
+        with self.lock:
+            self.entries[key] = (bytes.fromhex(content_hash), id, status_code)
+            self.recorded_count += 1
+
+            if self._file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = self.path.open("at")
+            self._file.write(f"{key}\t{content_hash}\t{id}\t{status_code}\n")
+            self._file.flush()
+
+            self._unsynced += 1
+            if self._unsynced >= self.sync_every:
+                os.fsync(self._file.fileno())
+                self._unsynced = 0
+
+    def compact(self) -> None:
+        """Rewrite the journal so that it contains a single line per resource"""
+        with self.lock:
+            self._close()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+            with tmp_path.open("wt") as f:
+                for key, (content_hash, id, status_code) in self.entries.items():
+                    f.write(f"{key}\t{content_hash.hex()}\t{id}\t{status_code}\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+
+    def _close(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+            self._unsynced = 0
+
+    def close(self) -> None:
+        with self.lock:
+            self._close()
@@ -0,0 +1,121 @@
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from requests.models import Response
+
+from ncpi_fhir_client.fhir_client import FhirClient
+
+BASE_URL = "http://example.org/fhir"
+
+
+def make_client(profiler=None, **cfg):
+    """A basic auth client for BASE_URL, with cfg added to (or overriding) its config"""
+    return FhirClient(
+        {
+            "auth_type": "auth_basic",
+            "username": "u",
+            "password": "p",
+            "target_service_url": BASE_URL,
+            **cfg,
+        },
+        profiler=profiler,
+    )
+
+
+@pytest.fixture
+def client():
+    return make_client()
+
+
+def make_response(status_code, body=b"", url=f"{BASE_URL}/Patient", headers=None):
+    """A requests Response as the session would return it; body is JSON unless it's str/bytes"""
+    response = Response()
+    response.status_code = status_code
+    if isinstance(body, str):
+        body = body.encode()
+    response._content = body if isinstance(body, bytes) else json.dumps(body).encode()
+    response.url = url
+    response.headers.update(headers or {})
+    return response
+
+
+def respond_with(client, monkeypatch, response):
+    """Have every GET, POST and PUT the client sends come back with response"""
+    for method in ("get", "post", "put"):
+        monkeypatch.setattr(client.session, method, lambda url, **kwargs: response)
+
+
+class StubFhirHandler(BaseHTTPRequestHandler):
+    """A tiny FHIR-ish server: searches come back empty, writes echo the resource back"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/fhir+json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+
+    def _count(self, key):
+        with self.server.lock:
+            self.server.calls[key] += 1
+            return self.server.calls[key]
+
+    def do_GET(self):
+        self._count("GET")
+        if self.path.endswith("/metadata"):
+            self._reply(200, {"resourceType": "CapabilityStatement", "rest": [{"mode": "server"}]})
+        else:
+            self._reply(200, {"resourceType": "Bundle", "type": "searchset", "total": 0})
+
+    def do_POST(self):
+        body = self._body()
+        if self.path == "/token":
+            self._count("token")
+            # Widen the window in which other threads could also decide to refresh
+            time.sleep(0.05)
+            self._reply(200, {"access_token": "token", "expires_in": 3600})
+            return
+
+        resource = json.loads(body)
+        resource["id"] = str(self._count("POST"))
+        self._reply(201, resource)
+
+    def do_PUT(self):
+        self._count("PUT")
+        self._reply(200, json.loads(self._body()))
+
+
+class StubUrl(str):
+    """The stub server's base URL, with the server attached for inspecting calls"""
+
+
+@pytest.fixture
+def fhir_server():
+    """Run a StubFhirHandler server, returning its base URL (the server itself is fhir_server.server)"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubFhirHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.calls = Counter()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    url = StubUrl(f"http://127.0.0.1:{server.server_port}/fhir")
+    url.server = server
+    yield url
+
+    server.shutdown()
+    server.server_close()
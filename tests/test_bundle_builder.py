@@ -0,0 +1,104 @@
+from ncpi_fhir_client.bundle_builder import BundleBuilder
+from ncpi_fhir_client.ridcache import RIdCache
+
+BASE_URL = "http://example.org/fhir"
+
+
+def patient(id, **extra):
+    return dict(
+        {
+            "resourceType": "Patient",
+            "id": id,
+            "identifier": [{"system": "http://sys/patient", "value": f"p-{id}"}],
+        },
+        **extra,
+    )
+
+
+def specimen(id, subject):
+    return {"resourceType": "Specimen", "id": id, "subject": {"reference": subject}}
+
+
+def test_new_resources_are_posted_with_urn_references():
+    builder = BundleBuilder(base_url=BASE_URL)
+    builder.add_all([patient("1"), specimen("s1", "Patient/1")])
+    (bundle,) = builder.bundles()
+
+    patient_entry, specimen_entry = bundle["entry"]
+    assert bundle["type"] == "transaction"
+    assert patient_entry["fullUrl"].startswith("urn:uuid:")
+    assert patient_entry["request"] == {"method": "POST", "url": "Patient"}
+    assert "id" not in patient_entry["resource"]
+    assert specimen_entry["resource"]["subject"]["reference"] == patient_entry["fullUrl"]
+
+
+def test_conditional_references_are_rewritten():
+    builder = BundleBuilder()
+    builder.add_all(
+        [patient("1"), specimen("s1", "Patient?identifier=http://sys/patient|p-1")]
+    )
+    patient_entry, specimen_entry = builder.bundles()[0]["entry"]
+    assert specimen_entry["resource"]["subject"]["reference"] == patient_entry["fullUrl"]
+
+
+def test_known_resources_are_put():
+    idcache = RIdCache()
+    idcache.store_id("Patient", "http://sys/patient", "p-1", "123")
+
+    builder = BundleBuilder(base_url=BASE_URL, idcache=idcache)
+    builder.add_all([patient("1"), specimen("s1", "Patient/1")])
+    patient_entry, specimen_entry = builder.bundles()[0]["entry"]
+
+    assert patient_entry["request"] == {"method": "PUT", "url": "Patient/123"}
+    assert patient_entry["fullUrl"] == f"{BASE_URL}/Patient/123"
+    assert patient_entry["resource"]["id"] == "123"
+    assert specimen_entry["resource"]["subject"]["reference"] == "Patient/123"
+
+
+def test_client_ids():
+    builder = BundleBuilder(client_ids=True)
+    builder.add(patient("1"))
+    (entry,) = builder.bundles()[0]["entry"]
+    assert entry["request"] == {"method": "PUT", "url": "Patient/1"}
+
+
+def test_linked_resources_share_a_bundle():
+    builder = BundleBuilder(max_entries=2)
+    for i in range(3):
+        builder.add(patient(str(i)))
+        builder.add(specimen(f"s{i}", f"Patient/{i}"))
+    bundles = builder.bundles()
+
+    assert len(bundles) == 3
+    for bundle in bundles:
+        patient_entry, specimen_entry = bundle["entry"]
+        assert specimen_entry["resource"]["subject"]["reference"] == patient_entry["fullUrl"]
+
+
+def test_put_targets_are_sent_first():
+    builder = BundleBuilder(client_ids=True, max_entries=1)
+    # The specimens come first, but depend on the patient
+    builder.add_all([specimen("s1", "Patient/1"), specimen("s2", "Patient/1"), patient("1")])
+    bundles = builder.bundles()
+
+    assert [bundle["entry"][0]["request"]["url"] for bundle in bundles] == [
+        "Patient/1",
+        "Specimen/s1",
+        "Specimen/s2",
+    ]
+
+
+def test_byte_limit():
+    builder = BundleBuilder(client_ids=True, max_bytes=400)
+    builder.add_all([patient(str(i)) for i in range(6)])
+    bundles = builder.bundles()
+
+    assert len(bundles) > 1
+    assert sum(len(bundle["entry"]) for bundle in bundles) == 6
+
+
+def test_references_outside_the_input_are_left_alone():
+    builder = BundleBuilder()
+    builder.add(specimen("s1", "Patient/elsewhere"))
+    (entry,) = builder.bundles()[0]["entry"]
+    assert entry["resource"]["subject"]["reference"] == "Patient/elsewhere"
@@ -0,0 +1,70 @@
+from ncpi_fhir_client.change_detection import ChangeTracker, canonical_json, resource_hash
+
+
+def patient(**extra):
+    return dict({"resourceType": "Patient", "id": "1", "gender": "male"}, **extra)
+
+
+class TestResourceHash:
+    def test_key_order_does_not_matter(self):
+        assert canonical_json({"a": 1, "b": 2}) == canonical_json({"b": 2, "a": 1})
+
+    def test_meta_is_ignored(self):
+        assert resource_hash(patient()) == resource_hash(
+            patient(meta={"versionId": "3", "lastUpdated": "2024-01-01"})
+        )
+
+    def test_content_changes_change_the_hash(self):
+        assert resource_hash(patient()) != resource_hash(patient(gender="female"))
+
+
+class TestChangeTracker:
+    def test_unknown_resources_are_changed(self):
+        tracker = ChangeTracker()
+        assert tracker.is_unchanged("Patient", patient()) is False
+
+    def test_resources_without_an_id_are_never_unchanged(self):
+        tracker = ChangeTracker()
+        resource = {"resourceType": "Patient", "gender": "male"}
+        tracker.record("Patient", resource)
+        assert tracker.is_unchanged("Patient", resource) is False
+
+    def test_recorded_resources_are_unchanged_until_they_change(self):
+        tracker = ChangeTracker()
+        tracker.record("Patient", patient())
+        assert tracker.is_unchanged("Patient", patient()) is True
+        assert tracker.is_unchanged("Patient", patient(gender="female")) is False
+        assert (tracker.unchanged_count, tracker.changed_count) == (1, 1)
+
+    def test_records_the_id_assigned_by_the_server(self):
+        tracker = ChangeTracker()
+        tracker.record("Patient", {"resourceType": "Patient", "gender": "male"}, id="1")
+        assert tracker.is_unchanged("Patient", patient()) is True
+
+    def test_hashes_persist_across_runs(self, tmp_path):
+        store = tmp_path / "dev.hashes"
+        tracker = ChangeTracker(store)
+        tracker.record("Patient", patient(gender="female"))
+        tracker.record("Patient", patient())
+        tracker.close()
+
+        reloaded = ChangeTracker(store)
+        assert reloaded.is_unchanged("Patient", patient()) is True
+
+    def test_compact_leaves_one_line_per_resource(self, tmp_path):
+        store = tmp_path / "dev.hashes"
+        tracker = ChangeTracker(store)
+        tracker.record("Patient", patient(gender="female"))
+        tracker.record("Patient", patient())
+        tracker.compact()
+
+        assert store.read_text().splitlines() == [f"Patient/1\t{resource_hash(patient())}"]
+
+    def test_partial_lines_are_ignored(self, tmp_path):
+        store = tmp_path / "dev.hashes"
+        store.write_text(f"Patient/1\t{resource_hash(patient())}\nPatient/2\t12")
+        assert len(ChangeTracker(store)) == 1
+
+    def test_for_host_uses_a_store_per_host(self, tmp_path):
+        tracker = ChangeTracker.for_host("dev", tmp_path)
+        assert tracker.store_path == tmp_path / "dev.hashes"
@@ -0,0 +1,79 @@
+import pytest
+
+from ncpi_fhir_client.checkpoint import PaginationCheckpoint, parse_instant
+
+
+def page(*ids):
+    return {"entry": [{"resource": {"resourceType": "Patient", "id": id}} for id in ids]}
+
+
+def test_progress_for_a_different_search_is_discarded(tmp_path):
+    checkpoint = PaginationCheckpoint(tmp_path / "cp.json")
+    checkpoint.resume("http://x/Patient")
+    checkpoint.record(page("1"), "next")
+
+    assert PaginationCheckpoint(tmp_path / "cp.json").resume("http://x/Patient") is True
+    assert PaginationCheckpoint(tmp_path / "cp.json").resume("http://x/Specimen") is False
+    assert not (tmp_path / "cp.json").exists()
+
+
+def test_completed_searches_start_over(tmp_path):
+    checkpoint = PaginationCheckpoint(tmp_path / "cp.json")
+    checkpoint.resume("http://x/Patient")
+    checkpoint.record(page("1"), None)
+
+    assert checkpoint.completed()
+    assert checkpoint.resume("http://x/Patient") is False
+    assert checkpoint.pages == 0
+
+
+def test_pages_spooled_after_the_last_save_are_dropped(tmp_path):
+    checkpoint = PaginationCheckpoint(tmp_path / "cp.json", spool=True)
+    checkpoint.resume("http://x/Patient")
+    checkpoint.record(page("1", "2"), "next")
+    # As if the run died between spooling a page and saving the checkpoint
+    with checkpoint.spool_path.open("at") as f:
+        f.write('[{"resource": {"id": "3"}}]\n')
+
+    resumed = PaginationCheckpoint(tmp_path / "cp.json", spool=True)
+    assert resumed.resume("http://x/Patient")
+    assert [entry["resource"]["id"] for entry in resumed.spooled_entries()] == ["1", "2"]
+
+
+def test_windowed_searches_are_sorted_by_last_updated(tmp_path):
+    checkpoint = PaginationCheckpoint(tmp_path / "checkpoint", window=True)
+    assert checkpoint.prepare("Patient?gender=male") == "Patient?gender=male&_sort=_lastUpdated"
+    assert checkpoint.prepare("Patient?_sort=_lastUpdated") == "Patient?_sort=_lastUpdated"
+    with pytest.raises(ValueError):
+        checkpoint.prepare("Patient?_sort=-birthdate")
+
+
+def test_instants_are_compared_as_times(tmp_path):
+    def updated(id, last_updated):
+        return {"resource": {"resourceType": "Patient", "id": id, "meta": {"lastUpdated": last_updated}}}
+
+    checkpoint = PaginationCheckpoint(tmp_path / "checkpoint", window=True)
+    checkpoint.resume("Patient")
+    checkpoint.record(
+        {
+            "entry": [
+                updated("1", "2024-01-01T00:00:00.500Z"),
+                # Earlier, although it sorts later as a string
+                updated("2", "2024-01-01T00:00:00Z"),
+                # The same instant as 1, in another offset and precision
+                updated("3", "2024-01-01T01:00:00.5+01:00"),
+                updated("4", "2023-12-31T23:59:59.999-00:00"),
+            ]
+        },
+        "page2",
+    )
+
+    assert checkpoint.last_updated == "2024-01-01T00:00:00.500Z"
+    assert checkpoint.boundary_ids == ["Patient/1", "Patient/3"]
+    assert checkpoint.window_url() == "Patient?_lastUpdated=ge2024-01-01T00:00:00.500Z"
+
+
+def test_parse_instant():
+    assert parse_instant("2024-01-01T00:00:00Z") == parse_instant("2024-01-01T00:00:00.000+00:00")
+    assert parse_instant("2024-01-01T00:00:00.123456789Z").microsecond == 123456
+    assert parse_instant("2024-01-01") is None
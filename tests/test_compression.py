@@ -0,0 +1,67 @@
+import gzip
+import json
+
+import pytest
+
+from ncpi_fhir_client.compression import CompressionSettings
+
+
+def bundle(entry_count):
+    return {
+        "resourceType": "Bundle",
+        "entry": [{"resource": {"resourceType": "Patient", "id": str(i)}} for i in range(entry_count)],
+    }
+
+
+class TestFromCfg:
+    def test_defaults_leave_requests_alone(self):
+        settings = CompressionSettings.from_cfg({})
+        assert settings.request_bodies is False
+        assert settings.responses is None
+
+    def test_reads_the_hosts_compression_section(self):
+        settings = CompressionSettings.from_cfg(
+            {"compression": {"request_bodies": True, "min_size": 10, "responses": True}}
+        )
+        assert settings == CompressionSettings(request_bodies=True, min_size=10, responses=True)
+
+    def test_unknown_settings_are_rejected(self):
+        with pytest.raises(ValueError):
+            CompressionSettings.from_cfg({"compression": {"request_body": True}})
+
+    def test_invalid_levels_are_rejected(self):
+        with pytest.raises(ValueError):
+            CompressionSettings.from_cfg({"compression": {"level": 12}})
+
+
+class TestUpdateRequestArgs:
+    def test_large_bodies_are_gzipped(self):
+        settings = CompressionSettings(request_bodies=True, min_size=100)
+        original = {"json": bundle(50), "headers": {"Content-Type": "application/fhir+json"}}
+
+        request_args = settings.update_request_args(original)
+
+        assert "json" not in request_args
+        assert request_args["headers"]["Content-Encoding"] == "gzip"
+        assert request_args["headers"]["Content-Type"] == "application/fhir+json"
+        assert json.loads(gzip.decompress(request_args["data"])) == bundle(50)
+        # The caller's copy still has the original body for logging
+        assert original["json"] == bundle(50)
+        assert "Content-Encoding" not in original["headers"]
+
+    def test_small_bodies_are_sent_as_is(self):
+        settings = CompressionSettings(request_bodies=True, min_size=100000)
+        request_args = settings.update_request_args({"json": bundle(1)})
+        assert request_args["json"] == bundle(1)
+        assert "Content-Encoding" not in request_args["headers"]
+
+    def test_response_compression_overrides_the_auth_modules_choice(self):
+        request_args = {"headers": {"Accept-Encoding": "identity"}}
+        assert (
+            CompressionSettings(responses=True).update_request_args(request_args)["headers"]["Accept-Encoding"]
+            == "gzip, deflate"
+        )
+        assert (
+            CompressionSettings().update_request_args(request_args)["headers"]["Accept-Encoding"]
+            == "identity"
+        )
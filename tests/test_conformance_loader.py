@@ -0,0 +1,153 @@
+from urllib.parse import unquote
+
+from ncpi_fhir_client.change_detection import ChangeTracker
+from tests.conftest import BASE_URL
+
+
+def result(status_code, response):
+    return {
+        "status_code": status_code,
+        "request_url": "http://x",
+        "response": response,
+        "response_headers": {},
+        "response_bytes": 0,
+    }
+
+
+class ConformanceServer:
+    """Just enough of a server to search by url and write resources"""
+
+    def __init__(self, *resources):
+        self.resources = {f"{r['resourceType']}/{r['id']}": dict(r) for r in resources}
+        self.requests = []
+        self.next_id = 100
+
+    def write(self, method, path, resource):
+        if method == "POST":
+            self.next_id += 1
+            resource = dict(resource, id=str(self.next_id))
+            path = f"{path}/{resource['id']}"
+        created = path not in self.resources
+        self.resources[path] = resource
+        return result(201 if created else 200, resource)
+
+    def send_request(self, method, url, **kwargs):
+        method = method.upper()
+        self.requests.append((method, unquote(url)))
+        path = url[len(BASE_URL) + 1 :]
+        if method == "GET":
+            resource_type, query = path.split("?url=")
+            urls = [u.replace("\\,", ",") for u in unquote(query).split(",")]
+            entries = [
+                {"resource": r}
+                for key, r in sorted(self.resources.items())
+                if key.startswith(f"{resource_type}/") and r.get("url") in urls
+            ]
+            return True, result(200, {"resourceType": "Bundle", "entry": entries, "link": []})
+        if method == "DELETE":
+            self.resources.pop(path, None)
+            return True, result(200, {})
+        if method == "POST" and path == "":
+            responses = []
+            for entry in kwargs["json"]["entry"]:
+                request = entry["request"]
+                written = self.write(request["method"], request["url"], entry["resource"])
+                status = "201 Created" if written["status_code"] == 201 else "200 OK"
+                responses.append({"response": {"status": status}})
+            return True, result(200, {"resourceType": "Bundle", "entry": responses})
+        return True, self.write(method, path, kwargs["json"])
+
+
+def code_system(id, url, version="1.0", **extra):
+    return dict(
+        {"resourceType": "CodeSystem", "id": id, "url": url, "version": version, "status": "active"},
+        **extra,
+    )
+
+
+def make_server(client, monkeypatch, *resources):
+    server = ConformanceServer(*resources)
+    monkeypatch.setattr(client, "send_request", server.send_request)
+    return server
+
+
+class TestConformanceLoader:
+    def test_unchanged_artifacts_are_skipped(self, client, monkeypatch):
+        server = make_server(client, monkeypatch, code_system("cs1", "http://cs/1"))
+
+        summary = client.conformance_loader().load([code_system("cs1", "http://cs/1")])
+
+        assert (summary.skipped, summary.created, summary.updated) == (1, 0, 0)
+        assert [method for method, _ in server.requests] == ["GET"]
+
+    def test_urls_are_looked_up_in_chunks(self, client, monkeypatch):
+        server = make_server(client, monkeypatch)
+        artifacts = [code_system(f"cs{i}", f"http://cs/{i}") for i in range(5)]
+        artifacts.append({"resourceType": "ValueSet", "id": "vs", "url": "http://vs,1"})
+
+        summary = client.conformance_loader(chunk_size=2).load(artifacts)
+
+        searches = [url for method, url in server.requests if method == "GET"]
+        assert len(searches) == 4
+        assert searches[-1] == f"{BASE_URL}/ValueSet?url=http://vs\\,1"
+        assert summary.created == 6
+
+    def test_changed_artifacts_replace_the_servers_copy(self, client, monkeypatch):
+        server = make_server(client, monkeypatch, code_system("server-id", "http://cs/1"))
+        # An artifact without an id takes over the server's copy
+        artifact = code_system("x", "http://cs/1", version="2.0")
+        del artifact["id"]
+
+        summary = client.conformance_loader().load([artifact])
+
+        assert summary.updated == 1
+        assert server.requests[-1] == ("PUT", f"{BASE_URL}/CodeSystem/server-id")
+        assert server.resources["CodeSystem/server-id"]["version"] == "2.0"
+
+    def test_writes_are_recorded_with_the_change_tracker(self, client, monkeypatch):
+        make_server(client, monkeypatch)
+        client.change_tracker = ChangeTracker()
+        artifact = code_system("cs1", "http://cs/1")
+
+        client.conformance_loader().load([artifact])
+
+        assert client.change_tracker.is_unchanged("CodeSystem", artifact)
+
+    def test_extra_copies_are_deleted(self, client, monkeypatch):
+        server = make_server(
+            client,
+            monkeypatch,
+            code_system("a", "http://cs/1"),
+            code_system("b", "http://cs/1", version="0.9"),
+        )
+
+        summary = client.conformance_loader().load([code_system("a", "http://cs/1")])
+
+        assert (summary.skipped, summary.deleted) == (1, 1)
+        assert sorted(server.resources) == ["CodeSystem/a"]
+
+    def test_transactions(self, client, monkeypatch):
+        server = make_server(client, monkeypatch, code_system("cs1", "http://cs/1"))
+        artifacts = [code_system("cs1", "http://cs/1", title="New")] + [
+            code_system(f"cs{i}", f"http://cs/{i}") for i in range(2, 5)
+        ]
+
+        summary = client.conformance_loader(transaction=True, bundle_size=2).load(artifacts)
+
+        assert [url for method, url in server.requests if method == "POST"] == [BASE_URL, BASE_URL]
+        assert (summary.created, summary.updated) == (3, 1)
+        assert server.resources["CodeSystem/cs1"]["title"] == "New"
+
+    def test_failures_are_reported(self, client, monkeypatch):
+        server = make_server(client, monkeypatch)
+        original = server.send_request
+
+        def send_request(method, url, **kwargs):
+            if method == "PUT":
+                return False, result(422, {"resourceType": "OperationOutcome"})
+            return original(method, url, **kwargs)
+
+        monkeypatch.setattr(client, "send_request", send_request)
+        summary = client.conformance_loader().load([code_system("cs1", "http://cs/1")])
+
+        assert summary.failures == [("CodeSystem/http://cs/1", 422, {"resourceType": "OperationOutcome"})]
@@ -0,0 +1,58 @@
+import pytest
+
+from ncpi_fhir_client.connection_pool import PoolSettings, host_adapter
+from ncpi_fhir_client.fhir_client import FhirClient
+
+
+def make_cfg(url, **extra):
+    return dict(
+        {"auth_type": "auth_basic", "username": "u", "password": "p", "target_service_url": url},
+        **extra,
+    )
+
+
+class TestPoolSettings:
+    def test_defaults(self):
+        assert PoolSettings.from_cfg({}).pool_maxsize == 64
+
+    def test_reads_the_hosts_connection_pool_section(self):
+        settings = PoolSettings.from_cfg({"connection_pool": {"pool_maxsize": 8, "pool_block": True}})
+        assert (settings.pool_maxsize, settings.pool_block) == (8, True)
+
+    def test_unknown_settings_are_rejected(self):
+        with pytest.raises(ValueError):
+            PoolSettings.from_cfg({"connection_pool": {"maxsize": 8}})
+
+
+class TestHostAdapter:
+    def test_clients_for_the_same_host_share_an_adapter(self):
+        first = FhirClient(make_cfg("http://shared.example.org/fhir"))
+        second = FhirClient(make_cfg("http://shared.example.org/fhir/"))
+        assert first.adapter is second.adapter
+
+    def test_hosts_and_settings_get_their_own_adapters(self):
+        settings = PoolSettings()
+        adapter = host_adapter("http://one.example.org", settings)
+        assert host_adapter("http://two.example.org", settings) is not adapter
+        assert host_adapter("http://one.example.org", PoolSettings(pool_maxsize=2)) is not adapter
+
+    def test_clients_with_different_retries_get_their_own_adapters(self):
+        first = FhirClient(make_cfg("http://retries.example.org/fhir"))
+        same = FhirClient(make_cfg("http://retries.example.org/fhir"))
+        fewer = FhirClient(make_cfg("http://retries.example.org/fhir", performance={"retries": 2}))
+        assert same.adapter is first.adapter
+        assert fewer.adapter is not first.adapter
+        assert fewer.adapter.max_retries.total == 2
+
+    def test_stats_report_connection_reuse(self, fhir_server):
+        client = FhirClient(make_cfg(fhir_server))
+        other = FhirClient(make_cfg(fhir_server))
+        for _ in range(3):
+            client.get("Patient")
+            other.get("Patient")
+
+        stats = list(client.pool_stats().values())
+        assert len(stats) == 1
+        assert stats[0]["requests"] == 6
+        assert stats[0]["new_connections"] == 1
+        assert stats[0]["reused_connections"] == 5
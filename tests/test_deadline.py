@@ -0,0 +1,118 @@
+import time
+
+import pytest
+from urllib3.exceptions import ReadTimeoutError
+
+from ncpi_fhir_client.deadline import (
+    Deadline,
+    DeadlineExceeded,
+    DeadlineRetry,
+    current_deadline,
+    deadline_scope,
+    request_timeout,
+)
+from ncpi_fhir_client.fhir_client import FhirClient
+
+
+def make_cfg(url, **extra):
+    return dict(
+        {"auth_type": "auth_basic", "username": "u", "password": "p", "target_service_url": url},
+        **extra,
+    )
+
+
+class TestDeadline:
+    def test_clamp(self):
+        deadline = Deadline(5)
+        assert deadline.clamp(60) <= 5
+        assert deadline.clamp(1) == 1
+        connect, read = deadline.clamp((1, None))
+        assert connect == 1 and 4 < read <= 5
+
+    def test_check_reports_progress(self):
+        deadline = Deadline(0.01, "harvest")
+        time.sleep(0.02)
+        with pytest.raises(DeadlineExceeded) as excinfo:
+            deadline.check({"pages": 3})
+        assert "harvest exceeded its 0.01s deadline" in str(excinfo.value)
+        assert "pages=3" in str(excinfo.value)
+
+
+class TestDeadlineScope:
+    def test_scopes_are_per_thread_and_restored(self):
+        assert current_deadline() is None
+        deadline = Deadline(5)
+        with deadline_scope(deadline):
+            assert current_deadline() is deadline
+        assert current_deadline() is None
+
+    def test_an_earlier_enclosing_deadline_still_applies(self):
+        outer = Deadline(5)
+        with deadline_scope(outer):
+            with deadline_scope(Deadline(60)) as inner:
+                assert inner is outer
+            with deadline_scope(Deadline(1)) as inner:
+                assert inner is not outer
+            assert current_deadline() is outer
+
+    def test_request_timeout(self):
+        assert request_timeout((10, 60)) == (10, 60)
+        with deadline_scope(Deadline(0.01)):
+            time.sleep(0.02)
+            with pytest.raises(DeadlineExceeded):
+                request_timeout((10, 60))
+
+
+class TestDeadlineRetry:
+    def test_retries_that_would_back_off_past_the_deadline_give_up(self):
+        retry = DeadlineRetry(total=5, backoff_factor=10)
+        error = ReadTimeoutError(None, "/", "read timed out")
+        with deadline_scope(Deadline(5)):
+            # The first retry doesn't back off
+            retry = retry.increment(method="GET", url="/", error=error)
+            with pytest.raises(DeadlineExceeded):
+                retry.increment(method="GET", url="/", error=error)
+
+        # Without a deadline, it is just a Retry
+        assert retry.increment(method="GET", url="/", error=error).get_backoff_time() > 0
+
+
+class TestClientDeadlines:
+    def test_requests_are_refused_once_the_deadline_passes(self, fhir_server):
+        client = FhirClient(make_cfg(fhir_server))
+        with client.deadline(0.01, operation="harvest"):
+            time.sleep(0.02)
+            with pytest.raises(DeadlineExceeded) as excinfo:
+                client.send_request("GET", f"{fhir_server}/Patient")
+        assert f"url={fhir_server}/Patient" in str(excinfo.value)
+        assert fhir_server.server.calls["GET"] == 0
+
+    def test_timeouts_are_cut_down_to_the_time_remaining(self, fhir_server, monkeypatch):
+        client = FhirClient(make_cfg(fhir_server))
+        sent = {}
+        original = client.session.get
+
+        def get(url, **kwargs):
+            sent.update(kwargs)
+            return original(url, **kwargs)
+
+        monkeypatch.setattr(client.session, "get", get)
+        with client.deadline(5):
+            client.send_request("GET", f"{fhir_server}/Patient")
+        connect, read = sent["timeout"]
+        assert connect <= 5 and read <= 5
+
+    def test_operation_timeout_applies_to_each_call(self, fhir_server, monkeypatch):
+        client = FhirClient(make_cfg(fhir_server, performance={"operation_timeout": 30}))
+        seen = []
+        original = client.send_request
+
+        def send_request(*args, **kwargs):
+            seen.append(current_deadline())
+            return original(*args, **kwargs)
+
+        monkeypatch.setattr(client, "send_request", send_request)
+        client.get("Patient")
+        assert seen[0].seconds == 30
+        assert seen[0].operation == "get Patient"
+        assert current_deadline() is None
@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+from ncpi_fhir_client.error_capture import ErrorCapture
+from tests.conftest import BASE_URL, make_response, respond_with
+
+
+class TestErrorCapture:
+    def test_only_the_most_recent_failures_are_kept(self):
+        capture = ErrorCapture(capacity=2)
+        for status in (500, 502, 503):
+            capture.record("GET", "http://x", status, "HTTP error", "body")
+
+        assert [failure.status_code for failure in capture.failures()] == [502, 503]
+        assert capture.total == 3
+
+    def test_bodies_are_truncated(self):
+        capture = ErrorCapture(max_body=11)
+        failure = capture.record("POST", "http://x", 422, "HTTP 422", "x" * 25, {"id": "1"})
+        assert failure.body == "xxxxxxxxxxx... [14 more characters]"
+        assert failure.request_body == '{"id": "1"}'
+
+    def test_failures_are_spilled_in_full(self, tmp_path):
+        capture = ErrorCapture(max_body=11, spill_dir=tmp_path / "errors")
+        failure = capture.record("POST", "http://x", 422, "HTTP 422", "x" * 25, {"id": "1"})
+        capture.close()
+
+        spilled = json.loads((tmp_path / "errors" / "000001-POST-422.json").read_text())
+        assert failure.spill_path == str(tmp_path / "errors" / "000001-POST-422.json")
+        assert spilled["body"] == "x" * 25
+        assert spilled["request_body"] == '{"id": "1"}'
+        assert spilled["status_code"] == 422
+
+    def test_unknown_settings_are_rejected(self):
+        with pytest.raises(ValueError):
+            ErrorCapture.from_cfg({"error_capture": {"size": 10}})
+        assert ErrorCapture.from_cfg({"error_capture": {"capacity": 10}}).capacity == 10
+
+
+class TestClientErrorCapture:
+    def test_non_json_responses_are_captured_rather_than_written_out(
+        self, client, monkeypatch, tmp_path
+    ):
+        monkeypatch.chdir(tmp_path)
+        respond_with(client, monkeypatch, make_response(502, "<html>Bad Gateway</html>"))
+
+        success, result = client.send_request("GET", f"{BASE_URL}/Patient")
+
+        assert not success
+        [failure] = client.errors.failures()
+        assert (failure.method, failure.status_code) == ("GET", 502)
+        assert failure.reason == "non-JSON response"
+        assert failure.body == "<html>Bad Gateway</html>"
+        assert list(tmp_path.iterdir()) == []
+
+    def test_non_json_failures_are_captured_once_with_the_request(self, client, monkeypatch):
+        respond_with(client, monkeypatch, make_response(502, "<html>Bad Gateway</html>"))
+
+        client.send_request("POST", f"{BASE_URL}/Patient", json={"resourceType": "Patient"})
+
+        [failure] = client.errors.failures()
+        assert failure.reason == "non-JSON response"
+        assert json.loads(failure.request_body) == {"resourceType": "Patient"}
+
+    def test_non_json_successes_are_not_captured(self, client, monkeypatch):
+        respond_with(client, monkeypatch, make_response(200, "OK"))
+        assert client.send_request("GET", f"{BASE_URL}/Patient/1")[0]
+        assert len(client.errors) == 0
+
+    def test_write_failures_keep_the_request(self, client, monkeypatch, capsys):
+        outcome = {"resourceType": "OperationOutcome", "issue": [{"severity": "error"}]}
+        respond_with(client, monkeypatch, make_response(422, outcome))
+
+        client.send_request("POST", f"{BASE_URL}/Patient", json={"resourceType": "Patient"})
+
+        [failure] = client.errors.failures()
+        assert failure.reason == "HTTP 422"
+        assert json.loads(failure.request_body) == {"resourceType": "Patient"}
+        assert json.loads(failure.body) == outcome
+        assert "resourceType" not in capsys.readouterr().out
+
+    def test_successes_are_not_captured(self, client, monkeypatch):
+        respond_with(client, monkeypatch, make_response(200, {"resourceType": "Bundle"}))
+        assert client.send_request("GET", f"{BASE_URL}/Patient")[0]
+        assert len(client.errors) == 0
@@ -0,0 +1,424 @@
+import pytest
+
+from ncpi_fhir_client.change_detection import ChangeTracker
+from ncpi_fhir_client.checkpoint import PaginationCheckpoint
+from ncpi_fhir_client.deadline import DeadlineExceeded, current_deadline
+from ncpi_fhir_client.fhir_client import InvalidCall
+from ncpi_fhir_client.write_journal import WriteJournal
+from tests.conftest import BASE_URL
+
+
+def make_result(response, status_code=200):
+    return {
+        "status_code": status_code,
+        "request_url": "http://x",
+        "response": response,
+        "response_headers": {},
+        "response_bytes": 0,
+    }
+
+
+class StubServer(dict):
+    """Canned responses keyed by URL (or by (METHOD, URL) when the method matters)"""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+
+    def send_request(self, method, url, **kwargs):
+        self.requests.append((method.upper(), url, kwargs))
+        result = self.get((method.upper(), url)) or self[url]
+        if isinstance(result, list):
+            # A response for each request in turn
+            result = result.pop(0)
+        return (200 <= result["status_code"] < 300, result)
+
+
+@pytest.fixture
+def server(client, monkeypatch):
+    """Replace send_request with canned responses"""
+    stub = StubServer()
+    monkeypatch.setattr(client, "send_request", stub.send_request)
+    return stub
+
+
+def capability_statement(*search_params):
+    return make_result(
+        {
+            "resourceType": "CapabilityStatement",
+            "rest": [{"searchParam": [{"name": name} for name in search_params]}],
+        }
+    )
+
+
+class TestQueryUrl:
+    def test_plain_resource(self, client):
+        assert client._query_url("Patient") == f"{BASE_URL}/Patient"
+
+    def test_parameters_are_appended_to_an_existing_query(self, client):
+        url = client._query_url("Patient?gender=male", rec_count=50, elements=["id", "identifier"])
+        assert url == f"{BASE_URL}/Patient?gender=male&_count=50&_elements=id,identifier"
+
+    def test_summary(self, client):
+        assert client._query_url("Patient", summary="count") == f"{BASE_URL}/Patient?_summary=count"
+
+    def test_full_urls_are_left_alone(self, client):
+        assert client._query_url("http://other/Patient", rec_count=5) == "http://other/Patient?_count=5"
+
+
+class TestSupportsSearchParam:
+    def test_declared_parameters_are_supported(self, client, server):
+        server[f"{BASE_URL}/metadata"] = capability_statement("_summary")
+        assert client.supports_search_param("_summary") is True
+
+    def test_undeclared_parameters_are_unknown(self, client, server):
+        server[f"{BASE_URL}/metadata"] = capability_statement()
+        assert client.supports_search_param("_elements") is None
+
+
+class TestCount:
+    def test_uses_summary_count(self, client, server):
+        server[f"{BASE_URL}/metadata"] = capability_statement("_summary")
+        server[f"{BASE_URL}/Patient?_summary=count"] = make_result(
+            {"resourceType": "Bundle", "total": 42}
+        )
+        assert client.count("Patient") == 42
+
+    def test_falls_back_to_paging_ids_when_summary_is_ignored(self, client, server):
+        server[f"{BASE_URL}/metadata"] = capability_statement()
+        server[f"{BASE_URL}/Patient?_summary=count"] = make_result(
+            {"resourceType": "Bundle", "entry": [{"resource": {"id": "1"}}]}
+        )
+        server[f"{BASE_URL}/Patient?_elements=id"] = make_result(
+            {
+                "resourceType": "Bundle",
+                "entry": [{"resource": {"id": "1"}}, {"resource": {"id": "2"}}],
+            }
+        )
+
+        assert client.count("Patient") == 2
+        assert client.supports_search_param("_summary", "Patient") is False
+
+        # Once we know the server ignores it, we stop asking
+        del server[f"{BASE_URL}/Patient?_summary=count"]
+        assert client.count("Patient") == 2
+
+
+class TestGetIds:
+    def test_harvests_ids_and_identifiers(self, client, server):
+        server[f"{BASE_URL}/Patient?_elements=id,identifier"] = make_result(
+            {
+                "resourceType": "Bundle",
+                "entry": [
+                    {"resource": {"id": "1", "identifier": [{"system": "s", "value": "a"}]}},
+                    {"resource": {"id": "2"}},
+                ],
+            }
+        )
+
+        assert client.get_ids("Patient", identifiers=True) == {
+            "1": [{"system": "s", "value": "a"}],
+            "2": [],
+        }
+
+    def test_ids_only(self, client, server):
+        server[f"{BASE_URL}/Patient?_elements=id"] = make_result(
+            {"resourceType": "Bundle", "entry": [{"resource": {"id": "1"}}]}
+        )
+        assert client.get_ids("Patient") == ["1"]
+
+
+class TestFetchGraph:
+    def test_searches_id_chunks_with_includes(self, client, server):
+        page = {
+            "resourceType": "Bundle",
+            "entry": [
+                {"resource": {"resourceType": "Patient", "id": "1"}, "search": {"mode": "match"}},
+                {
+                    "resource": {
+                        "resourceType": "Condition",
+                        "id": "c1",
+                        "subject": {"reference": "Patient/1"},
+                    },
+                    "search": {"mode": "include"},
+                },
+            ],
+        }
+        server[f"{BASE_URL}/Patient?_id=1,2&_revinclude=Condition:subject"] = make_result(page)
+        server[f"{BASE_URL}/Patient?_id=3&_revinclude=Condition:subject"] = make_result(
+            {
+                "resourceType": "Bundle",
+                "entry": [{"resource": {"resourceType": "Patient", "id": "3"}}],
+            }
+        )
+
+        graph = client.fetch_graph(
+            "Patient", ids=["1", "Patient/2", "3"], revinclude=["Condition:subject"], chunk_size=2
+        )
+
+        assert graph.matches == {"Patient/1", "Patient/3"}
+        assert [r["id"] for r in graph.referencing("Patient/1", "Condition")] == ["c1"]
+
+
+class TestChangeDetection:
+    def test_unchanged_resources_are_not_written(self, client, server):
+        client.change_tracker = ChangeTracker()
+        resource = {"resourceType": "Patient", "id": "1", "gender": "male"}
+        server[f"{BASE_URL}/Patient/1"] = make_result(dict(resource, meta={"versionId": "1"}))
+
+        assert "unchanged" not in client.post("Patient", dict(resource))
+
+        del server[f"{BASE_URL}/Patient/1"]
+        result = client.post("Patient", dict(resource))
+        assert result["status_code"] == 200
+        assert result["unchanged"] is True
+
+    def test_posts_are_recorded_with_the_assigned_id(self, client, server):
+        client.change_tracker = ChangeTracker()
+        resource = {"resourceType": "Patient", "gender": "male"}
+        server[f"{BASE_URL}/Patient"] = make_result(dict(resource, id="9"), status_code=201)
+
+        client.post("Patient", dict(resource))
+
+        assert client.change_tracker.is_unchanged("Patient", dict(resource, id="9"))
+
+
+class TestDiffUpdate:
+    def current(self):
+        return {
+            "resourceType": "Observation",
+            "id": "1",
+            "meta": {"versionId": "4", "lastUpdated": "2024-01-01"},
+            "status": "preliminary",
+            "note": [{"text": "x" * 500}],
+        }
+
+    def test_sends_a_patch_guarded_by_the_current_version(self, client, server):
+        server[("GET", f"{BASE_URL}/Observation/1")] = make_result(self.current())
+        server[("PATCH", f"{BASE_URL}/Observation/1")] = make_result({"id": "1"})
+
+        new = dict(self.current(), status="final")
+        del new["meta"]
+        client.update("Observation", "1", new, diff=True)
+
+        method, url, kwargs = server.requests[-1]
+        assert method == "PATCH"
+        assert kwargs["json"] == [{"op": "replace", "path": "/status", "value": "final"}]
+        assert kwargs["headers"]["If-Match"] == 'W/"4"'
+
+    def test_falls_back_to_a_guarded_put_when_the_patch_is_larger(self, client, server):
+        server[("PUT", f"{BASE_URL}/Observation/1")] = make_result({"id": "1"})
+
+        new = {"resourceType": "Observation", "id": "1", "status": "final"}
+        client.update("Observation", "1", new, diff=True, current=self.current())
+
+        assert [request[0] for request in server.requests] == ["PUT"]
+        assert server.requests[0][2]["headers"]["If-Match"] == 'W/"4"'
+
+    def test_diffs_again_when_the_version_changed(self, client, server):
+        newer = dict(self.current(), meta={"versionId": "5"}, note=[{"text": "y" * 500}])
+        server[("GET", f"{BASE_URL}/Observation/1")] = make_result(newer)
+        server[("PATCH", f"{BASE_URL}/Observation/1")] = [
+            make_result({}, status_code=412),
+            make_result({"id": "1"}),
+        ]
+
+        new = dict(self.current(), status="final")
+        result = client.update("Observation", "1", new, diff=True, current=self.current())
+
+        assert result["status_code"] == 200
+        assert [request[0] for request in server.requests] == ["PATCH", "GET", "PATCH"]
+        kwargs = server.requests[-1][2]
+        assert kwargs["headers"]["If-Match"] == 'W/"5"'
+        assert {"op": "replace", "path": "/note/0/text", "value": "x" * 500} in kwargs["json"]
+
+    def test_a_second_conflict_is_returned(self, client, server):
+        server[("GET", f"{BASE_URL}/Observation/1")] = make_result(self.current())
+        server[("PATCH", f"{BASE_URL}/Observation/1")] = make_result({}, status_code=412)
+
+        new = dict(self.current(), status="final")
+        result = client.update("Observation", "1", new, diff=True, current=self.current())
+
+        assert result["status_code"] == 412
+        assert "PUT" not in [request[0] for request in server.requests]
+
+    def test_nothing_is_sent_without_changes(self, client, server):
+        result = client.update(
+            "Observation", "1", self.current(), diff=True, current=self.current()
+        )
+
+        assert server.requests == []
+        assert result["unchanged"] is True
+
+
+class TestCheckpointedPagination:
+    def page(self, ids, next_url=None, updated="2024-01-01T00:00:00Z"):
+        response = {
+            "resourceType": "Bundle",
+            "entry": [
+                {"resource": {"resourceType": "Patient", "id": id, "meta": {"lastUpdated": updated}}}
+                for id in ids
+            ],
+            "link": [],
+        }
+        if next_url is not None:
+            response["link"].append({"relation": "next", "url": next_url})
+        return make_result(response)
+
+    def serve(self, server, fail_page_2=False):
+        server[f"{BASE_URL}/Patient"] = self.page(["1", "2"], "page2")
+        server["page2"] = self.page(["3", "4"], "page3")
+        server["page3"] = self.page(["5"])
+        if fail_page_2:
+            server["page2"] = make_result({}, status_code=410)
+
+    def test_an_interrupted_harvest_resumes_from_the_checkpoint(self, client, server, tmp_path):
+        self.serve(server, fail_page_2=True)
+        checkpoint = PaginationCheckpoint(tmp_path / "patients.json")
+
+        with pytest.raises(InvalidCall):
+            for page in client.iter_pages("Patient", checkpoint=checkpoint):
+                pass
+        assert PaginationCheckpoint(tmp_path / "patients.json").resume(f"{BASE_URL}/Patient")
+
+        self.serve(server)
+        server.requests.clear()
+        ids = [
+            entry["resource"]["id"]
+            for page in client.iter_pages("Patient", checkpoint=checkpoint)
+            for entry in page.entries
+        ]
+
+        assert ids == ["3", "4", "5"]
+        assert [request[1] for request in server.requests] == ["page2", "page3"]
+        assert checkpoint.completed()
+
+    def test_get_returns_the_pages_from_before_the_interruption(self, client, server, tmp_path):
+        self.serve(server, fail_page_2=True)
+        checkpoint = PaginationCheckpoint(tmp_path / "patients.json")
+        with pytest.raises(InvalidCall):
+            client.get("Patient", checkpoint=checkpoint)
+
+        self.serve(server)
+        result = client.get("Patient", checkpoint=checkpoint)
+
+        assert [entry["resource"]["id"] for entry in result.entries] == ["1", "2", "3", "4", "5"]
+        assert result.entry_count == 5
+        # get returned everything, so there is nothing left to resume
+        assert not (tmp_path / "patients.json").exists()
+
+    def test_expired_cursors_fall_back_to_a_lastupdated_window(self, client, server, tmp_path):
+        url = f"{BASE_URL}/Patient?_sort=_lastUpdated"
+        server[url] = self.page(["1", "2"], "page2")
+        server["page2"] = make_result({}, status_code=410)
+        # Patient 2 shares the boundary timestamp with 6, which wasn't seen yet
+        server[f"{url}&_lastUpdated=ge2024-01-01T00:00:00Z"] = self.page(["2", "6"])
+        checkpoint = PaginationCheckpoint(tmp_path / "patients.json", window=True)
+
+        ids = [
+            entry["resource"]["id"]
+            for page in client.iter_pages("Patient", checkpoint=checkpoint)
+            for entry in page.entries
+        ]
+
+        assert ids == ["1", "2", "6"]
+        assert checkpoint.pages == 2
+
+
+class TestWriteJournal:
+    def resource(self):
+        return {
+            "resourceType": "Patient",
+            "identifier": [{"system": "http://sys/patient", "value": "p1"}],
+        }
+
+    def test_a_rerun_skips_journaled_writes(self, client, server, tmp_path):
+        server[("POST", f"{BASE_URL}/Patient")] = make_result(
+            dict(self.resource(), id="42"), status_code=201
+        )
+        with client:
+            client.journal = WriteJournal(tmp_path / "writes")
+            client.post("Patient", self.resource())
+
+        server.requests.clear()
+        client.journal = WriteJournal(tmp_path / "writes")
+        resource = self.resource()
+        result = client.post("Patient", resource, identifier="http://sys/patient|p1")
+
+        assert server.requests == []
+        assert result["journaled"] is True
+        assert resource["id"] == "42"
+
+    def test_failed_writes_are_retried(self, client, server, tmp_path):
+        server[("POST", f"{BASE_URL}/Patient")] = make_result({}, status_code=400)
+        client.journal = WriteJournal(tmp_path / "writes")
+        client.post("Patient", self.resource())
+        client.post("Patient", self.resource())
+
+        assert len(server.requests) == 2
+
+
+class TestDeadlines:
+    def test_get_reports_the_pages_it_fetched(self, client, server):
+        def page(number, next_url=None):
+            bundle = {
+                "resourceType": "Bundle",
+                "entry": [{"resource": {"resourceType": "Patient", "id": str(number)}}],
+            }
+            if next_url is not None:
+                bundle["link"] = [{"relation": "next", "url": next_url}]
+            return make_result(bundle)
+
+        server[f"{BASE_URL}/Patient"] = page(1, f"{BASE_URL}/Patient?page=2")
+        server[f"{BASE_URL}/Patient?page=2"] = page(2, f"{BASE_URL}/Patient?page=3")
+
+        def send_request(method, url, **kwargs):
+            if url.endswith("page=3"):
+                raise DeadlineExceeded(current_deadline(), {"url": url})
+            return StubServer.send_request(server, method, url, **kwargs)
+
+        client.send_request = send_request
+        with pytest.raises(DeadlineExceeded) as excinfo:
+            client.get("Patient", deadline=60)
+
+        assert excinfo.value.progress["pages"] == 2
+        assert [entry["resource"]["id"] for entry in excinfo.value.partial.entries] == ["1", "2"]
+        assert "get Patient exceeded its 60s deadline" in str(excinfo.value)
+
+
+class TestAdaptivePaging:
+    def page(self, count, next_url=None):
+        bundle = {
+            "resourceType": "Bundle",
+            "entry": [{"resource": {"resourceType": "Patient", "id": str(i)}} for i in range(count)],
+            "link": [],
+        }
+        if next_url is not None:
+            bundle["link"].append({"relation": "next", "url": next_url})
+        return make_result(bundle)
+
+    def test_auto_probes_the_server_and_adjusts_the_next_links(self, client, server):
+        server[f"{BASE_URL}/Patient?_elements=id&_count=1000"] = self.page(
+            500, f"{BASE_URL}?_getpages=x&_getpagesoffset=500&_count=500"
+        )
+        server[f"{BASE_URL}/Patient?_count=200"] = self.page(
+            200, f"{BASE_URL}?_getpages=x&_getpagesoffset=200&_count=200"
+        )
+        server[f"{BASE_URL}?_getpages=x&_getpagesoffset=200&_count=400"] = self.page(3)
+
+        result = client.get("Patient", rec_count="auto")
+
+        assert result.entry_count == 203
+        assert client.page_sizer.server_limit == 500
+        assert [url for _, url, _ in server.requests][1:] == [
+            f"{BASE_URL}/Patient?_count=200",
+            f"{BASE_URL}?_getpages=x&_getpagesoffset=200&_count=400",
+        ]
+
+    def test_fixed_counts_are_left_alone(self, client, server):
+        server[f"{BASE_URL}/Patient?_count=200"] = self.page(
+            200, f"{BASE_URL}?_getpages=x&_getpagesoffset=200&_count=200"
+        )
+        server[f"{BASE_URL}?_getpages=x&_getpagesoffset=200&_count=200"] = self.page(3)
+
+        assert client.get("Patient", rec_count=200).entry_count == 203
@@ -39,3 +39,42 @@ class TestGetHostConfig:
 
         with pytest.raises(SystemExit):
             get_host_config()
+
+
+class TestPerformanceValidation:
+    def test_invalid_performance_settings_exit(self, tmp_path, monkeypatch, capsys):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "fhir_hosts").write_text(
+            "dev:\n"
+            "  target_service_url: http://example.org/fhir\n"
+            "  performance:\n"
+            "    page_sise: 50\n"
+        )
+
+        with pytest.raises(SystemExit):
+            get_host_config()
+        assert "Invalid performance settings for host, dev" in capsys.readouterr().err
+
+    def test_other_sections_are_checked(self, tmp_path, monkeypatch, capsys):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "fhir_hosts").write_text(
+            "dev:\n"
+            "  target_service_url: http://example.org/fhir\n"
+            "  compression:\n"
+            "    level: 12\n"
+        )
+
+        with pytest.raises(SystemExit):
+            get_host_config()
+        assert "Invalid compression settings for host, dev" in capsys.readouterr().err
+
+    def test_valid_performance_settings_are_kept(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "fhir_hosts").write_text(
+            "dev:\n"
+            "  target_service_url: http://example.org/fhir\n"
+            "  performance:\n"
+            "    page_size: 50\n"
+        )
+
+        assert get_host_config()["dev"]["performance"] == {"page_size": 50}
@@ -0,0 +1,52 @@
+import pytest
+
+from ncpi_fhir_client.json_patch import apply_patch, make_patch
+
+
+def round_trip(source, target):
+    patch = make_patch(source, target)
+    assert apply_patch(source, patch) == target
+    return patch
+
+
+class TestMakePatch:
+    def test_identical_documents_need_no_patch(self):
+        assert make_patch({"a": [1, 2]}, {"a": [1, 2]}) == []
+
+    def test_changed_added_and_removed_members(self):
+        patch = round_trip({"a": 1, "b": 2}, {"a": 3, "c": 4})
+        assert sorted(op["op"] for op in patch) == ["add", "remove", "replace"]
+
+    def test_insertion_in_the_middle_of_a_list_is_a_single_add(self):
+        patch = round_trip({"a": ["x", "y", "z"]}, {"a": ["x", "new", "y", "z"]})
+        assert patch == [{"op": "add", "path": "/a/1", "value": "new"}]
+
+    def test_removal_from_the_middle_of_a_list_is_a_single_remove(self):
+        patch = round_trip({"a": ["x", "y", "z"]}, {"a": ["x", "z"]})
+        assert patch == [{"op": "remove", "path": "/a/1"}]
+
+    def test_changes_within_list_items_are_patched_in_place(self):
+        source = {"component": [{"code": "a", "value": 1}, {"code": "b", "value": 2}]}
+        target = {"component": [{"code": "a", "value": 1}, {"code": "b", "value": 3}]}
+        patch = round_trip(source, target)
+        assert patch == [{"op": "replace", "path": "/component/1/value", "value": 3}]
+
+    def test_replaces_a_value_when_that_is_smaller_than_its_diff(self):
+        patch = round_trip({"a": {"b": 1, "c": 2}}, {"a": {"d": 3, "e": 4}})
+        assert patch == [{"op": "replace", "path": "/a", "value": {"d": 3, "e": 4}}]
+
+    def test_keys_are_escaped(self):
+        patch = round_trip({"a/b": 1, "c~d": 1}, {"a/b": 2, "c~d": 2})
+        assert [op["path"] for op in patch] == ["/a~1b", "/c~0d"]
+
+    @pytest.mark.parametrize(
+        "source, target",
+        [
+            ([1, 2, 3, 4], [4, 3, 2, 1]),
+            ([1, 2], [1, 2, 3, 4]),
+            ([1, 2, 3, 4], []),
+            ({"a": [{"b": [1, 2]}]}, {"a": [{"b": [2]}, {"c": 1}]}),
+        ],
+    )
+    def test_round_trips(self, source, target):
+        round_trip({"v": source}, {"v": target})
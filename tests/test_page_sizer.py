@@ -0,0 +1,108 @@
+import pytest
+
+from ncpi_fhir_client.page_sizer import PageSizer, requested_count, with_count
+from ncpi_fhir_client.performance import PerformanceProfile
+
+
+def bundle(entries, next_url=None, included=0):
+    page = {
+        "resourceType": "Bundle",
+        "entry": [{"resource": {"resourceType": "Patient", "id": str(i)}} for i in range(entries)]
+        + [
+            {"resource": {"resourceType": "Organization"}, "search": {"mode": "include"}}
+        ] * included,
+    }
+    if next_url is not None:
+        page["link"] = [{"relation": "next", "url": next_url}]
+    return page
+
+
+class TestCountParam:
+    def test_replaces_an_existing_count(self):
+        url = "http://x/fhir?_getpages=abc&_getpagesoffset=200&_count=200&_bundletype=searchset"
+        assert with_count(url, 50) == url.replace("_count=200", "_count=50")
+
+    def test_adds_a_missing_count(self):
+        assert with_count("http://x/fhir/Patient", 50) == "http://x/fhir/Patient?_count=50"
+        assert with_count("http://x/fhir/Patient?a=1", 50) == "http://x/fhir/Patient?a=1&_count=50"
+
+    def test_requested_count(self):
+        assert requested_count("http://x/fhir/Patient?_count=25") == 25
+        assert requested_count("http://x/fhir/Patient?max_count=25") is None
+
+
+class TestPageSizer:
+    def test_defaults_to_the_initial_size(self):
+        assert PageSizer(initial=200).size_for("Patient") == 200
+
+    def test_heavy_pages_shrink_straight_away(self):
+        sizer = PageSizer(initial=200, target_seconds=10)
+        # 200 entries took 40 seconds, so 50 should take about 10
+        assert sizer.observe("Observation", 200, bundle(200, "next"), 40, 1000) == 50
+        assert sizer.size_for("Observation") == 50
+        # Other types are unaffected
+        assert sizer.size_for("Patient") == 200
+
+    def test_light_pages_grow_gradually(self):
+        sizer = PageSizer(initial=100, max_size=1000)
+        assert sizer.observe("Patient", 100, bundle(100, "next"), 0.1, 1000) == 200
+        assert sizer.observe("Patient", 200, bundle(200, "next"), 0.1, 1000) == 400
+
+    def test_large_payloads_are_limited(self):
+        sizer = PageSizer(initial=100, max_bytes=1024 * 1024)
+        assert sizer.observe("DocumentReference", 100, bundle(100, "next"), 0.1, 4 * 1024 * 1024) == 25
+
+    def test_sizes_stay_within_the_limits(self):
+        sizer = PageSizer(initial=100, min_size=20, max_size=150)
+        assert sizer.observe("Patient", 100, bundle(100, "next"), 0.01, 1) == 150
+        assert sizer.observe("Patient", 100, bundle(100, "next"), 1000, 1) == 20
+
+    def test_short_pages_with_a_next_link_reveal_the_servers_limit(self):
+        sizer = PageSizer(initial=500, max_size=1000)
+        sizer.observe("Patient", 500, bundle(100, "next"), 0.1, 1000)
+        # One short page could just have had some results filtered out
+        assert sizer.server_limit is None
+        sizer.observe("Patient", 500, bundle(100, "next"), 0.1, 1000)
+        assert sizer.server_limit == 100
+        assert sizer.size_for("Specimen") == 100
+
+        # Asking for the most there is to ask for needs no second page
+        sizer = PageSizer(initial=500, max_size=1000)
+        sizer.observe("Patient", 1000, bundle(300, "next"), 0.1, 1000)
+        assert sizer.server_limit == 300
+
+        # The last page of a search is short without saying anything about the limit
+        sizer = PageSizer(initial=500)
+        sizer.observe("Patient", 500, bundle(100), 0.1, 1000)
+        assert sizer.server_limit is None
+
+    def test_included_resources_dont_count_towards_the_page(self):
+        sizer = PageSizer(initial=100, max_size=100)
+        sizer.observe("Patient", 100, bundle(60, "next", included=40), 0.1, 1000)
+        assert sizer.server_limit == 60
+
+        sizer = PageSizer(initial=100, max_size=100)
+        sizer.observe("Patient", 100, bundle(100, "next", included=40), 0.1, 1000)
+        assert sizer.server_limit is None
+
+    def test_probe(self):
+        class Client:
+            target_service_url = "http://x/fhir"
+
+            def send_request(self, method, url):
+                self.url = url
+                return True, {"response": bundle(300, "next")}
+
+        client = Client()
+        sizer = PageSizer(max_size=1000)
+        assert sizer.probe(client, "Patient") == 300
+        assert client.url == "http://x/fhir/Patient?_elements=id&_count=1000"
+        assert sizer.probed
+
+    def test_from_profile(self):
+        sizer = PageSizer.from_profile(PerformanceProfile(page_size=50, max_page_size=400))
+        assert (sizer.initial, sizer.max_size) == (50, 400)
+
+    def test_min_size_cant_exceed_max_size(self):
+        with pytest.raises(AssertionError):
+            PageSizer(min_size=500, max_size=100)
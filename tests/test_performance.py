@@ -0,0 +1,191 @@
+import pytest
+from urllib3 import HTTPResponse
+from urllib3.exceptions import ProtocolError
+
+from ncpi_fhir_client.connection_pool import PoolSettings
+from ncpi_fhir_client.deadline import Deadline, DeadlineExceeded, deadline_scope
+from ncpi_fhir_client.fhir_client import FhirClient
+from ncpi_fhir_client.performance import HostRetry, PerformanceProfile
+from ncpi_fhir_client.rate_limit import RateLimiter, RateLimitSettings, rate_limit_scope
+from ncpi_fhir_client.tracing import RecordingTracer, set_tracer, span
+
+
+def make_cfg(url, **extra):
+    return dict(
+        {"auth_type": "auth_basic", "username": "u", "password": "p", "target_service_url": url},
+        **extra,
+    )
+
+
+class TestPerformanceProfile:
+    def test_defaults(self):
+        profile = PerformanceProfile.from_cfg({})
+        assert profile.page_size == 200
+        assert profile.post_retries is None
+
+        retry = profile.retry()
+        assert (retry.total, retry.connect, retry.backoff_factor) == (10, 1, 5)
+        assert set(retry.status_forcelist) == {429, 500, 502, 503, 504}
+
+    def test_reads_the_hosts_performance_section(self):
+        profile = PerformanceProfile.from_cfg(
+            {
+                "performance": {
+                    "page_size": 50,
+                    "retries": 3,
+                    "retry_statuses": [429, 503],
+                    "read_timeout": 30,
+                }
+            }
+        )
+        assert profile.page_size == 50
+        assert profile.retry().total == 3
+        assert profile.retry().status_forcelist == (429, 503)
+        assert profile.timeout() == (10, 30)
+
+    def test_unknown_settings_are_rejected(self):
+        with pytest.raises(ValueError):
+            PerformanceProfile.from_cfg({"performance": {"pagesize": 50}})
+
+    @pytest.mark.parametrize(
+        "settings", [{"page_size": 0}, {"concurrency": -1}, {"retries": -1}, {"read_timeout": 0}]
+    )
+    def test_out_of_range_settings_are_rejected(self, settings):
+        with pytest.raises(ValueError):
+            PerformanceProfile.from_cfg({"performance": settings})
+
+    def test_pool_maxsize_sizes_the_connection_pool(self):
+        assert PoolSettings.from_cfg({"performance": {"pool_maxsize": 8}}).pool_maxsize == 8
+        # The connection_pool section wins
+        cfg = {"performance": {"pool_maxsize": 8}, "connection_pool": {"pool_maxsize": 16}}
+        assert PoolSettings.from_cfg(cfg).pool_maxsize == 16
+
+
+class TestClientProfile:
+    def test_the_client_uses_the_hosts_retries(self):
+        client = FhirClient(
+            make_cfg("http://profile.example.org/fhir", performance={"retries": 2, "post_retries": 1})
+        )
+        assert client.adapter.max_retries.total == 2
+        assert client.performance.post_retries == 1
+
+    def test_timeouts_are_sent_with_each_request(self, fhir_server, monkeypatch):
+        client = FhirClient(
+            make_cfg(fhir_server, performance={"connect_timeout": 5, "read_timeout": 60})
+        )
+        sent = {}
+        original = client.session.get
+
+        def get(url, **kwargs):
+            sent.update(kwargs)
+            return original(url, **kwargs)
+
+        monkeypatch.setattr(client.session, "get", get)
+        client.send_request("GET", f"{fhir_server}/Patient")
+        assert sent["timeout"] == (5, 60)
+
+    def test_post_gives_up_after_the_hosts_post_retries(self, fhir_server, monkeypatch):
+        client = FhirClient(make_cfg(fhir_server, performance={"post_retries": 2}))
+        attempts = []
+
+        def send_request(verb, url, **kwargs):
+            attempts.append(verb)
+            return False, {"status_code": 422, "response": {"issue": []}, "request_url": url}
+
+        monkeypatch.setattr(client, "send_request", send_request)
+        monkeypatch.setattr("ncpi_fhir_client.fhir_client.sleep", lambda seconds: None)
+        patient = {"resourceType": "Patient", "identifier": [{"system": "http://sys", "value": "1"}]}
+        client.post("Patient", patient)
+        assert len(attempts) == 2
+
+    def test_post_falls_back_on_retry_post_count(self, fhir_server, monkeypatch):
+        client = FhirClient(make_cfg(fhir_server))
+        attempts = []
+
+        def send_request(verb, url, **kwargs):
+            attempts.append(verb)
+            return False, {"status_code": 422, "response": {"issue": []}, "request_url": url}
+
+        monkeypatch.setattr(client, "send_request", send_request)
+        monkeypatch.setattr("ncpi_fhir_client.fhir_client.sleep", lambda seconds: None)
+        monkeypatch.setattr(FhirClient, "retry_post_count", 3)
+        patient = {"resourceType": "Patient", "identifier": [{"system": "http://sys", "value": "1"}]}
+        client.post("Patient", patient)
+        assert len(attempts) == 3
+
+
+class TestHostRetry:
+    def limiter(self):
+        return RateLimiter(RateLimitSettings(reads_per_second=100, read_burst=1))
+
+    def test_the_hosts_retries_use_it(self):
+        assert isinstance(PerformanceProfile.from_cfg({}).retry(), HostRetry)
+
+    def test_retries_that_would_back_off_past_the_deadline_give_up(self):
+        retry = HostRetry(total=5, backoff_factor=10)
+        error = ProtocolError("reset")
+        with deadline_scope(Deadline(5)):
+            retry = retry.increment("GET", "/Patient", error=error)
+            with pytest.raises(DeadlineExceeded):
+                retry.increment("GET", "/Patient", error=error)
+
+    def test_each_retry_takes_a_token(self):
+        limiter = self.limiter()
+        limiter.acquire("GET")
+        retry = HostRetry(total=3, backoff_factor=0, status_forcelist=[503])
+        retry = retry.increment("GET", "/Patient", response=HTTPResponse(status=503))
+
+        with rate_limit_scope(limiter):
+            retry.sleep()
+        assert limiter.stats()["read_wait"] > 0
+
+    def test_a_429_holds_back_the_budget_for_the_retry_after(self):
+        limiter = self.limiter()
+        response = HTTPResponse(status=429, headers={"Retry-After": "0.2"})
+        retry = HostRetry(total=3, status_forcelist=[429])
+        retry = retry.increment("GET", "/Patient", response=response)
+
+        with rate_limit_scope(limiter):
+            retry.sleep(response)
+        assert limiter.stats()["read_wait"] >= 0.2
+
+    def test_a_429_isnt_waited_out_past_the_deadline(self):
+        limiter = self.limiter()
+        response = HTTPResponse(status=429, headers={"Retry-After": "3600"})
+        retry = HostRetry(total=3, status_forcelist=[429])
+        retry = retry.increment("GET", "/Patient", response=response)
+
+        with deadline_scope(Deadline(30)), rate_limit_scope(limiter):
+            with pytest.raises(DeadlineExceeded):
+                retry.sleep(response)
+
+    def test_a_retry_after_isnt_waited_out_past_the_deadline(self):
+        response = HTTPResponse(status=503, headers={"Retry-After": "3600"})
+        retry = HostRetry(total=3, status_forcelist=[503])
+        retry = retry.increment("GET", "/Patient", response=response)
+
+        with deadline_scope(Deadline(30)):
+            with pytest.raises(DeadlineExceeded):
+                retry.sleep(response)
+
+    def test_nothing_is_taken_outside_a_client(self):
+        retry = HostRetry(total=3, backoff_factor=0, status_forcelist=[503])
+        retry.increment("GET", "/Patient", response=HTTPResponse(status=503)).sleep()
+
+    def test_each_backoff_is_a_span(self):
+        tracer = RecordingTracer()
+        set_tracer(tracer)
+        try:
+            retry = HostRetry(total=3, backoff_factor=0)
+            retry = retry.increment("GET", "/Patient", error=ProtocolError("reset"))
+            with span("send_request"):
+                retry.sleep()
+        finally:
+            set_tracer(None)
+
+        backoff, request = tracer.spans()
+        assert backoff.name == "retry"
+        assert backoff.attributes["retry.attempt"] == 1
+        assert backoff.attributes["http.url"] == "/Patient"
+        assert "reset" in backoff.attributes["retry.error"]
+        assert backoff.parent_id == request.span_id
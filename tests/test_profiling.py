@@ -0,0 +1,90 @@
+import json
+import pstats
+
+import pytest
+
+from ncpi_fhir_client.profiling import Profiler, memory_section, timed
+from ncpi_fhir_client.ridcache import RIdCache
+from tests.conftest import make_client, make_response
+
+
+def bundle_response(count):
+    entries = [{"resource": {"resourceType": "Patient", "id": str(i)}} for i in range(count)]
+    return make_response(200, {"resourceType": "Bundle", "entry": entries, "link": []})
+
+
+class TestHooks:
+    def test_nothing_is_done_without_a_profiler(self):
+        with timed(None, "network"), memory_section(None, "get Patient"):
+            pass
+
+    def test_memory_sections_need_memory_tracking(self):
+        profiler = Profiler("unused")
+        with memory_section(profiler, "get Patient"):
+            pass
+        assert profiler.sections == []
+
+
+class TestProfiler:
+    def test_timings_are_broken_down_by_category(self, tmp_path):
+        with Profiler(tmp_path, cpu=False) as profiler:
+            with profiler.timer("network"):
+                pass
+            with profiler.timer("network"):
+                pass
+            with profiler.timer("json"):
+                pass
+
+        timings = json.loads((tmp_path / "timings.json").read_text())
+        assert timings["calls"] == {"network": 2, "json": 1, "auth": 0}
+        assert set(timings["seconds"]) == {"network", "json", "auth", "local"}
+        assert sum(timings["seconds"].values()) == pytest.approx(timings["wall"])
+
+    def test_cprofile_output(self, tmp_path):
+        with Profiler(tmp_path, top=5):
+            sorted(range(1000), key=lambda i: -i)
+
+        assert "function calls" in (tmp_path / "cprofile.txt").read_text()
+        stats = pstats.Stats(str(tmp_path / "cprofile.pstats"))
+        assert stats.total_calls > 0
+
+    def test_nested_memory_sections(self, tmp_path):
+        with Profiler(tmp_path, cpu=False, track_memory=True) as profiler:
+            with profiler.memory("outer") as outer:
+                with profiler.memory("inner") as inner:
+                    block = bytearray(5_000_000)
+                del block
+
+        assert [section.label for section in profiler.sections] == ["inner", "outer"]
+        assert inner.growth >= 5_000_000
+        # The inner section's peak is credited to the outer one as well
+        assert outer.peak >= inner.peak
+
+        report = (tmp_path / "memory.txt").read_text().splitlines()
+        assert report[0] == "Peak MB\tGrowth MB\tSection"
+        assert sorted(line.split("\t")[2] for line in report[1:3]) == ["inner", "outer"]
+        assert "After outer:" in report
+
+
+class TestClientProfiling:
+    def test_requests_are_timed(self, monkeypatch, tmp_path):
+        profiler = Profiler(tmp_path, cpu=False)
+        profiler.start()
+        client = make_client(profiler)
+        monkeypatch.setattr(client.session, "get", lambda url, **kwargs: bundle_response(3))
+
+        assert client.get("Patient").entry_count == 3
+        profiler.stop()
+        assert profiler.calls == {"network": 1, "json": 1, "auth": 1}
+
+    def test_gets_and_harvests_are_memory_sections(self, monkeypatch, tmp_path):
+        profiler = Profiler(tmp_path, cpu=False, track_memory=True)
+        profiler.start()
+        client = make_client(profiler)
+        monkeypatch.setattr(client.session, "get", lambda url, **kwargs: bundle_response(3))
+
+        client.get("Patient")
+        RIdCache(resource_types=["Patient"]).load_ids_from_host(client)
+        profiler.stop()
+        labels = [section.label for section in profiler.sections]
+        assert labels == ["get Patient", "RIdCache.load_ids_from_host"]
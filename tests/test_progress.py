@@ -0,0 +1,112 @@
+import io
+
+import pytest
+from rich.console import Console
+
+from ncpi_fhir_client.progress import ProgressReporter
+from tests.conftest import make_client, make_response
+
+
+def make_reporter(level, **kwargs):
+    output = io.StringIO()
+    reporter = ProgressReporter(
+        level, console=Console(file=output, force_terminal=False), **kwargs
+    )
+    return reporter, output
+
+
+class TestFromCfg:
+    def test_verbose_by_default(self):
+        assert ProgressReporter.from_cfg({}).level == "verbose"
+
+    def test_level_alone(self):
+        assert ProgressReporter.from_cfg({"progress": "quiet"}).level == "quiet"
+
+    def test_level_and_interval(self):
+        reporter = ProgressReporter.from_cfg(
+            {"progress": {"level": "aggregate", "interval": 0.5}}
+        )
+        assert reporter.level == "aggregate"
+        assert reporter.interval == 0.5
+
+    def test_unknown_settings_are_rejected(self):
+        with pytest.raises(ValueError):
+            ProgressReporter.from_cfg({"progress": {"level": "quiet", "colour": "red"}})
+
+    def test_unknown_levels_are_rejected(self):
+        with pytest.raises(ValueError):
+            ProgressReporter.from_cfg({"progress": "loud"})
+
+
+class TestReporter:
+    def test_messages_are_only_shown_when_verbose(self, capsys):
+        ProgressReporter("verbose").message("POST: Patient", detail="the resource")
+        ProgressReporter("aggregate").message("hidden")
+        ProgressReporter("quiet").message("hidden")
+        assert capsys.readouterr().out == "POST: Patient\nthe resource\n"
+
+    def test_status_line(self):
+        reporter, _ = make_reporter("aggregate", label="Writes", total=4)
+        reporter.completed = 2
+        reporter.failed = 1
+        reporter.note("ids", 10)
+        status = reporter.render()
+        assert status.startswith("Writes: 2/4 (")
+        assert ", 10 ids, 1 failed (50.0%), ETA " in status
+
+    def test_no_eta_without_a_total(self):
+        reporter, _ = make_reporter("aggregate")
+        reporter.completed = 3
+        assert reporter.eta() is None
+        assert "ETA" not in reporter.render()
+
+    def test_eta_from_a_fraction(self):
+        reporter, _ = make_reporter("aggregate")
+        reporter.fraction = lambda: 0.5
+        reporter.started -= 10
+        assert reporter.eta() == pytest.approx(10, abs=1)
+
+    def test_aggregate_reports_once_work_is_recorded(self):
+        reporter, output = make_reporter("aggregate", interval=60, label="Writes")
+        reporter.record()
+        reporter.record(ok=False)
+        reporter.stop()
+        assert output.getvalue().startswith("Writes: 2 (")
+        assert "1 failed (50.0%)" in output.getvalue()
+
+    @pytest.mark.parametrize("level", ["quiet", "verbose"])
+    def test_other_levels_have_no_status_line(self, level):
+        reporter, output = make_reporter(level)
+        with reporter:
+            reporter.record()
+        assert reporter.completed == 1
+        assert output.getvalue() == ""
+
+
+class TestPostProgress:
+    def test_verbose_posts_are_reported(self, monkeypatch, capsys):
+        client = make_client()
+        monkeypatch.setattr(client.session, "post", lambda url, **kwargs: make_response(201, {"resourceType": "Patient", "id": "1"}))
+        client.post("Patient", {"resourceType": "Patient"})
+        assert "POST: " in capsys.readouterr().out
+        assert client.progress.completed == 1
+
+    def test_quiet_posts_are_counted_but_not_reported(self, monkeypatch, capsys):
+        client = make_client(progress="quiet")
+        monkeypatch.setattr(client.session, "post", lambda url, **kwargs: make_response(201, {"resourceType": "Patient", "id": "1"}))
+        for _ in range(3):
+            client.post("Patient", {"resourceType": "Patient"})
+        assert capsys.readouterr().out == ""
+        assert client.progress.completed == 3
+        assert client.progress.failed == 0
+
+    def test_closing_the_client_stops_the_status_line(self, monkeypatch):
+        reporter, output = make_reporter("aggregate", interval=60, label="Writes")
+        with make_client() as client:
+            client.progress = reporter
+            monkeypatch.setattr(client.session, "post", lambda url, **kwargs: make_response(201, {"resourceType": "Patient", "id": "1"}))
+            client.post("Patient", {"resourceType": "Patient"})
+            assert reporter._thread is not None
+
+        assert reporter._thread is None
+        assert output.getvalue().startswith("Writes: 1 (")
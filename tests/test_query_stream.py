@@ -0,0 +1,102 @@
+import io
+import json
+
+from ncpi_fhir_client.fhir_result import FhirResult
+from ncpi_fhir_client.query_stream import QueryStreamer
+
+
+def make_page(entries, status_code=200):
+    return FhirResult(
+        {
+            "status_code": status_code,
+            "request_url": "http://x",
+            "response": {"entry": entries},
+            "response_bytes": 100,
+        }
+    )
+
+
+class FakeClient:
+    def __init__(self, pages):
+        self.pages = pages
+
+    def iter_pages(self, query, except_on_error=True):
+        yield from self.pages[query]
+
+
+def patients(*ids):
+    return [{"resource": {"resourceType": "Patient", "id": id}} for id in ids]
+
+
+class TestJsonOutput:
+    def test_streams_pages_into_a_single_document(self):
+        client = FakeClient({"Patient": [make_page(patients("1", "2")), make_page(patients("3"))]})
+        out = io.StringIO()
+
+        streamer = QueryStreamer(client, out)
+        streamer.begin({"FHIR Server": "http://x"})
+        summaries = streamer.run(["Patient"])
+        streamer.end()
+
+        document = json.loads(out.getvalue())
+        assert document[0] == {"FHIR Server": "http://x"}
+        assert document[1]["Query"] == "Patient"
+        assert [e["resource"]["id"] for e in document[1]["Entries"]] == ["1", "2", "3"]
+        assert document[1]["Record Count"] == 3
+        assert summaries[0].page_count == 2
+        assert summaries[0].bytes_received == 200
+
+    def test_concurrent_queries_are_written_in_the_order_given(self):
+        client = FakeClient(
+            {
+                "Patient": [make_page(patients("1"))],
+                "Observation": [make_page([])],
+                "Condition": [make_page(patients("2", "3"))],
+            }
+        )
+        out = io.StringIO()
+
+        streamer = QueryStreamer(client, out, concurrency=3)
+        streamer.begin()
+        streamer.run(["Patient", "Observation", "Condition"])
+        streamer.end()
+
+        document = json.loads(out.getvalue())
+        assert [record["Query"] for record in document] == ["Patient", "Observation", "Condition"]
+        assert [record["Record Count"] for record in document] == [1, 0, 2]
+
+    def test_failed_query_records_the_response(self):
+        error_page = FhirResult(
+            {"status_code": 400, "request_url": "http://x", "response": {"issue": ["bad"]}}
+        )
+        client = FakeClient({"Bad": [error_page]})
+        out = io.StringIO()
+
+        streamer = QueryStreamer(client, out)
+        streamer.begin()
+        summaries = streamer.run(["Bad"])
+        streamer.end()
+
+        document = json.loads(out.getvalue())
+        assert document[0]["Status Code"] == 400
+        assert document[0]["Response"] == {"issue": ["bad"]}
+        assert not summaries[0].success()
+
+
+class TestJsonLinesOutput:
+    def test_writes_one_resource_per_line(self):
+        client = FakeClient(
+            {
+                "Patient": [make_page(patients("1", "2"))],
+                "Condition": [make_page(patients("3"))],
+            }
+        )
+        out = io.StringIO()
+
+        streamer = QueryStreamer(client, out, fmt="jsonl", concurrency=2)
+        streamer.begin()
+        streamer.run(["Patient", "Condition"])
+        streamer.end()
+
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        assert sorted(line["id"] for line in lines) == ["1", "2", "3"]
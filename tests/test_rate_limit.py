@@ -0,0 +1,121 @@
+import threading
+from time import monotonic
+
+import pytest
+
+from ncpi_fhir_client.deadline import Deadline, DeadlineExceeded
+from ncpi_fhir_client.rate_limit import (
+    RateLimiter,
+    RateLimitSettings,
+    TokenBucket,
+    retry_after_seconds,
+)
+from tests.conftest import make_client, make_response, respond_with
+
+
+class TestTokenBucket:
+    def test_bursts_are_not_delayed(self):
+        bucket = TokenBucket(rate=10, burst=5)
+        assert sum(bucket.acquire() for _ in range(5)) == 0
+
+    def test_requests_beyond_the_burst_are_paced(self):
+        bucket = TokenBucket(rate=100, burst=1)
+        start = monotonic()
+        for _ in range(11):
+            bucket.acquire()
+        # 10 requests beyond the burst at 100/s
+        assert monotonic() - start >= 0.09
+
+    def test_threads_share_the_budget(self):
+        bucket = TokenBucket(rate=200, burst=1)
+        start = monotonic()
+        threads = [
+            threading.Thread(target=lambda: [bucket.acquire() for _ in range(5)]) for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert monotonic() - start >= 19 / 200 - 0.01
+
+    def test_pauses_hold_back_the_next_caller(self):
+        bucket = TokenBucket(rate=100, burst=5)
+        bucket.pause(0.1)
+        assert bucket.acquire() >= 0.1
+
+    def test_waits_past_the_deadline_are_refused(self):
+        bucket = TokenBucket(rate=100, burst=5)
+        bucket.pause(3600)
+        start = monotonic()
+        with pytest.raises(DeadlineExceeded) as excinfo:
+            bucket.acquire(deadline=Deadline(5))
+        assert monotonic() - start < 1
+        assert excinfo.value.progress["rate_limit_wait"] >= 3600
+        # Nothing was taken, so the wait is the same for the next caller
+        assert bucket.waited == 0
+        assert -bucket.tokens / bucket.rate == pytest.approx(3600, abs=1)
+
+
+def test_retry_after_values():
+    assert retry_after_seconds("2") == 2
+    assert retry_after_seconds(None) == 1
+    assert retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert retry_after_seconds("soon") == 1
+
+
+class TestRateLimiter:
+    def test_a_429_holds_back_the_budget_in_place_of_the_backoff(self):
+        limiter = RateLimiter(RateLimitSettings(reads_per_second=100))
+        assert limiter.before_retry("GET", 429, "0.2")
+        assert limiter.acquire("GET") >= 0.2
+        # Other statuses, and methods without a budget, back off as usual
+        assert not limiter.before_retry("GET", 503)
+        assert not limiter.before_retry("POST", 429)
+
+    def test_reads_and_writes_have_separate_budgets(self):
+        limiter = RateLimiter(RateLimitSettings(reads_per_second=1, writes_per_second=1))
+        assert limiter.acquire("GET") == 0
+        assert limiter.acquire("POST") == 0
+        assert limiter.acquire("get") > 0
+
+    def test_unlimited_by_default(self):
+        limiter = RateLimiter.from_cfg({})
+        assert limiter.reads is None and limiter.writes is None
+        assert limiter.acquire("PUT") == 0
+
+    def test_settings_are_validated(self):
+        with pytest.raises(ValueError):
+            RateLimitSettings.from_cfg({"rate_limit": {"reads": 10}})
+        with pytest.raises(ValueError):
+            RateLimitSettings.from_cfg({"rate_limit": {"writes_per_second": 0}})
+        with pytest.raises(ValueError):
+            RateLimitSettings.from_cfg({"rate_limit": {"reads_per_second": 5, "read_burst": 0.5}})
+
+
+def test_client_requests_are_limited(fhir_server):
+    client = make_client(
+        target_service_url=str(fhir_server),
+        rate_limit={"reads_per_second": 100, "read_burst": 1},
+    )
+    for _ in range(3):
+        client.get("Patient")
+    assert client.rate_limiter.stats()["read_wait"] > 0
+    assert client.rate_limiter.stats()["write_wait"] == 0
+
+
+def test_a_429_slows_the_client_down(monkeypatch):
+    client = make_client(rate_limit={"writes_per_second": 100})
+    respond_with(client, monkeypatch, make_response(429, headers={"Retry-After": "0.2"}))
+
+    client.send_request("POST", "http://example.org/fhir/Patient", json={})
+    assert client.rate_limiter.acquire("POST") >= 0.2
+
+
+def test_the_client_gives_up_rather_than_wait_past_its_deadline():
+    client = make_client(rate_limit={"reads_per_second": 100})
+    client.rate_limiter.throttle("GET", "3600")
+
+    with client.deadline(30):
+        with pytest.raises(DeadlineExceeded) as excinfo:
+            client.send_request("GET", "http://example.org/fhir/Patient")
+    assert excinfo.value.progress["url"] == "http://example.org/fhir/Patient"
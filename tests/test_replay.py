@@ -0,0 +1,106 @@
+import json
+
+import pytest
+
+from ncpi_fhir_client.fhir_client import FhirClient
+from ncpi_fhir_client.replay import BundleReplayer, entry_request, iter_bundle_entries, iter_entries
+
+
+def make_cfg(url):
+    return {"auth_type": "auth_basic", "username": "u", "password": "p", "target_service_url": url}
+
+
+def patients(count):
+    return [
+        {
+            "resourceType": "Patient",
+            "id": f"p{i}",
+            "name": [{"text": f"Patient é {i} \"quoted\" [x]"}],
+            "extension": [{"valueDecimal": 1.25 * i}],
+        }
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def bundle_file(tmp_path):
+    """A bundle written the way write_to_bundle writes them"""
+    path = tmp_path / "patients.json"
+    client = FhirClient(make_cfg("http://example.org/fhir"))
+    client.init_bundle(str(path), "bundle-1")
+    for resource in patients(5):
+        client.write_to_bundle(resource)
+    client.close_bundle()
+    return path
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1024 * 1024])
+def test_entries_match_a_full_parse(bundle_file, chunk_size):
+    expected = json.loads(bundle_file.read_text())["entry"]
+    assert list(iter_bundle_entries(bundle_file, chunk_size=chunk_size)) == expected
+
+
+def test_keys_after_the_entries_and_empty_bundles(tmp_path):
+    path = tmp_path / "bundle.json"
+    path.write_text('{"entry": [{"resource": {"id": 1}}, {"resource": {"id": 22}}], "total": 123}')
+    assert [e["resource"]["id"] for e in iter_bundle_entries(path, chunk_size=3)] == [1, 22]
+
+    path.write_text('{"resourceType": "Bundle", "entry": []}')
+    assert list(iter_bundle_entries(path)) == []
+
+
+def test_large_entries_are_decoded_once(tmp_path, monkeypatch):
+    entry = {"resource": {"id": "big", "text": 'a \\"} [ é' * 2000, "items": [[1, {"n": None}]] * 500}}
+    path = tmp_path / "bundle.json"
+    path.write_text(json.dumps({"entry": [entry, entry], "total": 2}))
+
+    decoded = []
+    raw_decode = json.JSONDecoder.raw_decode
+
+    def counting(self, s, idx=0):
+        decoded.append(len(s) - idx)
+        return raw_decode(self, s, idx)
+
+    monkeypatch.setattr(json.JSONDecoder, "raw_decode", counting)
+    assert list(iter_bundle_entries(path, chunk_size=64)) == [entry, entry]
+    # One failed attempt on a partial chunk and one once the whole entry has been read
+    assert sum(decoded) < 5 * path.stat().st_size
+
+
+def test_truncated_files_are_an_error(tmp_path):
+    path = tmp_path / "bundle.json"
+    path.write_text('{"entry": [{"resource": {"id": 1}}, {"resource": ')
+    with pytest.raises(ValueError):
+        list(iter_bundle_entries(path, chunk_size=4))
+
+
+def test_ndjson_resources_become_entries(tmp_path):
+    path = tmp_path / "patients.ndjson"
+    path.write_text("\n".join(json.dumps(p) for p in patients(3)) + "\n")
+    entries = list(iter_entries(path))
+    assert [entry_request(entry) for entry in entries] == [
+        ("PUT", "Patient/p0"),
+        ("PUT", "Patient/p1"),
+        ("PUT", "Patient/p2"),
+    ]
+
+
+def test_replays_entries_one_at_a_time(fhir_server, bundle_file):
+    replayer = BundleReplayer(FhirClient(make_cfg(fhir_server)), workers=3, progress_interval=0)
+    stats = replayer.replay([bundle_file])
+
+    assert (stats.entries, stats.succeeded, stats.failed, stats.requests) == (5, 5, 0, 5)
+    # write_to_bundle's entries are POSTs
+    assert fhir_server.server.calls["POST"] == 5
+    assert stats.bytes_read == bundle_file.stat().st_size
+
+
+def test_replays_entries_in_batches(fhir_server, bundle_file, tmp_path):
+    ndjson = tmp_path / "more.ndjson"
+    ndjson.write_text(json.dumps(patients(1)[0]) + "\n")
+
+    replayer = BundleReplayer(FhirClient(make_cfg(fhir_server)), batch_size=2, progress_interval=0)
+    stats = replayer.replay([bundle_file, ndjson])
+
+    assert (stats.entries, stats.succeeded, stats.requests) == (6, 6, 4)
+    assert fhir_server.server.calls["POST"] == 4
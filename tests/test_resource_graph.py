@@ -0,0 +1,79 @@
+from ncpi_fhir_client.resource_graph import ResourceGraph, find_references, reference_key
+
+
+class TestReferenceKey:
+    def test_relative_reference(self):
+        assert reference_key("Patient/1") == "Patient/1"
+
+    def test_absolute_and_versioned_references(self):
+        assert reference_key("http://x/fhir/Patient/1") == "Patient/1"
+        assert reference_key("Patient/1/_history/3") == "Patient/1"
+
+    def test_reference_objects(self):
+        assert reference_key({"reference": "Patient/1"}) == "Patient/1"
+        assert reference_key({"display": "no reference"}) is None
+
+    def test_contained_and_urn_references_are_not_resolvable(self):
+        assert reference_key("#contained") is None
+        assert reference_key("urn:uuid:1234") is None
+
+
+def test_find_references_walks_nested_elements():
+    observation = {
+        "resourceType": "Observation",
+        "subject": {"reference": "Patient/1"},
+        "specimen": {"reference": "Specimen/2"},
+        "component": [{"valueReference": {"reference": "Patient/3"}}],
+    }
+    assert sorted(find_references(observation)) == ["Patient/1", "Patient/3", "Specimen/2"]
+
+
+def make_graph():
+    graph = ResourceGraph()
+    graph.add_entries(
+        [
+            {"resource": {"resourceType": "Patient", "id": "1"}, "search": {"mode": "match"}},
+            {
+                "resource": {
+                    "resourceType": "Condition",
+                    "id": "c1",
+                    "subject": {"reference": "Patient/1"},
+                },
+                "search": {"mode": "include"},
+            },
+            {
+                "resource": {
+                    "resourceType": "Observation",
+                    "id": "o1",
+                    "subject": {"reference": "Patient/1"},
+                },
+                "search": {"mode": "include"},
+            },
+        ]
+    )
+    return graph
+
+
+class TestResourceGraph:
+    def test_resolves_references_locally(self):
+        graph = make_graph()
+        condition = graph.resolve("Condition/c1")
+        assert graph.resolve(condition["subject"]) == {"resourceType": "Patient", "id": "1"}
+        assert "Patient/2" not in graph
+
+    def test_tracks_which_resources_matched_the_search(self):
+        assert make_graph().matches == {"Patient/1"}
+
+    def test_referencing_finds_resources_pointing_at_a_target(self):
+        graph = make_graph()
+        assert [r["id"] for r in graph.referencing("Patient/1")] == ["c1", "o1"]
+        assert [r["id"] for r in graph.referencing("Patient/1", "Observation")] == ["o1"]
+
+    def test_reverse_index_is_refreshed_when_resources_are_added(self):
+        graph = make_graph()
+        graph.referencing("Patient/1")
+        graph.add({"resourceType": "Specimen", "id": "s1", "subject": {"reference": "Patient/1"}})
+        assert [r["id"] for r in graph.referencing("Patient/1", "Specimen")] == ["s1"]
+
+    def test_ids_by_type(self):
+        assert make_graph().ids("Condition") == ["c1"]
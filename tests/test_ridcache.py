@@ -1,6 +1,10 @@
+import json
+
 import pytest
 
 from ncpi_fhir_client import ridcache
+from ncpi_fhir_client.performance import PerformanceProfile
+from ncpi_fhir_client.progress import ProgressReporter
 from ncpi_fhir_client.ridcache import RIdCache, get_identifier
 
 
@@ -80,3 +84,276 @@ class TestStoreAndGetId:
             cache._store_id("Patient", "http://sys/patient", "key1", "id2", exit_on_dupes=True)
 
         assert calls == [1]
+
+
+class TestSnapshot:
+    def make_cache(self):
+        cache = RIdCache()
+        cache._store_id("Patient", "http://sys/patient", "key1", "id1")
+        cache._store_id("Patient", "http://sys/patient", "key2", "id2")
+        cache._store_id("Specimen", "http://sys/specimen", "tab\there", "id3")
+        cache._store_id("Specimen", "http://sys/specimen", "back\\slash\nnewline", "id4")
+        return cache
+
+    def test_lookups_match_the_cache(self, tmp_path):
+        cache = self.make_cache()
+        cache.write_snapshot(tmp_path / "ids")
+
+        snapshot = ridcache.IdSnapshot(tmp_path / "ids")
+        for target_system, ids in cache.cache.items():
+            for entity_key, value in ids.items():
+                assert snapshot.get(target_system, entity_key) == value
+        snapshot.close()
+
+    def test_missing_keys_return_none(self, tmp_path):
+        self.make_cache().write_snapshot(tmp_path / "ids")
+
+        snapshot = ridcache.IdSnapshot(tmp_path / "ids")
+        assert snapshot.get("http://sys/patient", "key") is None
+        assert snapshot.get("http://sys/patient", "key3") is None
+        assert snapshot.get("http://sys/other", "key1") is None
+        snapshot.close()
+
+    def test_snapshots_larger_than_a_sort_run(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(RIdCache, "snapshot_run_lines", 2)
+        cache = self.make_cache()
+        cache.write_snapshot(tmp_path / "ids")
+
+        lines = (tmp_path / "ids").read_bytes().splitlines()
+        assert lines == sorted(lines)
+        snapshot = ridcache.IdSnapshot(tmp_path / "ids")
+        for target_system, ids in cache.cache.items():
+            for entity_key, value in ids.items():
+                assert snapshot.get(target_system, entity_key) == value
+        snapshot.close()
+
+    def test_empty_snapshot(self, tmp_path):
+        RIdCache().write_snapshot(tmp_path / "ids")
+
+        snapshot = ridcache.IdSnapshot(tmp_path / "ids")
+        assert snapshot.get("http://sys/patient", "key1") is None
+        snapshot.close()
+
+    def test_get_id_falls_back_to_an_attached_snapshot(self, tmp_path):
+        self.make_cache().write_snapshot(tmp_path / "ids")
+
+        cache = RIdCache()
+        cache._store_id("Patient", "http://sys/patient", "key9", "id9")
+        cache.attach_snapshot(tmp_path / "ids")
+
+        assert cache.get_id("http://sys/patient", "key9") == ("Patient", "id9")
+        assert cache.get_id("http://sys/patient", "key2", resource_type="Patient") == "id2"
+        assert cache.get_id("http://sys/patient", "key3") is None
+
+
+class TestTieredCache:
+    def test_ids_beyond_the_memory_limit_come_from_the_index(self):
+        cache = RIdCache(max_memory_ids=2)
+        for i in range(5):
+            cache.store_id("Patient", "http://sys/patient", f"key{i}", f"id{i}")
+
+        assert len(cache.index.hot) == 2
+        assert len(cache.index) == 5
+        # The two most recent are still in memory, the rest come from disk
+        for i in [4, 3, 0, 1, 2]:
+            assert cache.get_id("http://sys/patient", f"key{i}", "Patient") == f"id{i}"
+        assert cache.get_id("http://sys/patient", "key5") is None
+        assert cache.index.disk_hits == 3
+        assert cache.index.memory_hits == 2
+        cache.close()
+
+    def test_the_temporary_index_is_removed_on_close(self):
+        cache = RIdCache(max_memory_ids=2)
+        path = cache.index.path
+        assert path.exists()
+        cache.close()
+        assert not path.exists()
+
+    def test_snapshot_from_a_tiered_cache(self, tmp_path):
+        cache = RIdCache(max_memory_ids=1, index_path=tmp_path / "index.sqlite")
+        cache.store_id("Patient", "http://sys/patient", "key1", "id1")
+        cache.store_id("Specimen", "http://sys/specimen", "key2", "id2")
+        cache.write_snapshot(tmp_path / "ids")
+
+        snapshot = ridcache.IdSnapshot(tmp_path / "ids")
+        assert snapshot.get("http://sys/patient", "key1") == ("Patient", "id1")
+        assert snapshot.get("http://sys/specimen", "key2") == ("Specimen", "id2")
+        snapshot.close()
+        cache.close()
+        # Indexes we were given a path for are left behind
+        assert (tmp_path / "index.sqlite").exists()
+
+
+class TestSystemHints:
+    def test_systems_narrow_the_resource_types(self):
+        cache = RIdCache(systems=["http://sys/patient", "http://sys/specimen"])
+        assert cache.system_resource_types(["Observation", "Patient", "Specimen"]) == [
+            "Patient",
+            "Specimen",
+        ]
+
+    def test_unrecognized_systems_keep_every_resource_type(self):
+        cache = RIdCache(systems=["http://sys/patient", "http://sys/participants"])
+        assert cache.system_resource_types(["Observation", "Patient"]) == ["Observation", "Patient"]
+
+    def test_only_listed_systems_are_valid(self):
+        cache = RIdCache(systems=["http://sys/patient"])
+        assert cache.valid_system("http://sys/patient") is True
+        assert cache.valid_system("http://sys/patient2") is False
+
+    def test_systems_are_searched_for_on_the_server(self):
+        class Client:
+            def iter_pages(self, query):
+                self.query = query
+                yield type("Result", (), {"success": lambda self: False})()
+
+        client = Client()
+        cache = RIdCache(study_id="SD_1", systems=["http://sys/patient", "http://sys/specimen"])
+        cache.load_ids_for_resource_type(client, "Patient")
+        assert client.query.startswith("Patient?identifier=http://sys/patient|&_tag=SD_1")
+
+    def test_page_size_comes_from_the_clients_profile(self):
+        class Client:
+            performance = PerformanceProfile(page_size=50)
+
+            def iter_pages(self, query):
+                self.query = query
+                yield type("Result", (), {"success": lambda self: False})()
+
+        client = Client()
+        RIdCache().load_ids_for_resource_type(client, "Patient")
+        assert "_count=50" in client.query
+
+        RIdCache(page_size=25).load_ids_for_resource_type(client, "Patient")
+        assert "_count=25" in client.query
+
+    def test_adaptive_profiles_harvest_with_auto_page_sizes(self):
+        class Client:
+            performance = PerformanceProfile(adaptive_paging=True)
+
+            def iter_pages(self, query, **kwargs):
+                self.query, self.kwargs = query, kwargs
+                yield type("Result", (), {"success": lambda self: False})()
+
+        client = Client()
+        RIdCache().load_ids_for_resource_type(client, "Patient")
+        assert "_count" not in client.query
+        assert client.kwargs == {"rec_count": "auto"}
+
+    def test_quiet_clients_harvest_without_reporting(self, capsys):
+        class Client:
+            target_service_url = "http://example.org/fhir"
+            performance = PerformanceProfile()
+            progress = ProgressReporter("quiet")
+
+            def iter_pages(self, query):
+                yield type("Result", (), {"success": lambda self: False})()
+
+        RIdCache(resource_types=["Patient", "Specimen"]).load_ids_from_host(Client())
+        assert capsys.readouterr().out == ""
+
+    def test_quiet_harvests_still_report_duplicates(self, capsys):
+        class Client:
+            target_service_url = "http://example.org/fhir"
+            progress = ProgressReporter("quiet")
+
+            def iter_pages(self, query):
+                entries = patients("1", "2")
+                # Both patients share an identifier
+                entries[1]["resource"]["identifier"] = entries[0]["resource"]["identifier"]
+                yield page(entries)
+
+        cache = RIdCache(resource_types=["Patient"], track_duplicates=True)
+        cache.load_ids_from_host(Client())
+        assert "Duplicate Identifiers: 1" in capsys.readouterr().out
+
+
+def patients(*ids):
+    return [
+        {
+            "resource": {
+                "resourceType": "Patient",
+                "id": id,
+                "identifier": [{"system": "http://sys/patient", "value": f"key{id}"}],
+            }
+        }
+        for id in ids
+    ]
+
+
+def page(entries):
+    return type("Result", (), {"success": lambda self: True, "entries": entries})()
+
+
+class TestHarvest:
+
+    def test_ids_are_stored_a_page_at_a_time(self):
+        pages = [patients("1", "2"), patients("3")]
+
+        class Client:
+            def iter_pages(self, query):
+                for entries in pages:
+                    yield page(entries)
+
+        cache = RIdCache()
+        assert cache.load_ids_for_resource_type(Client(), "Patient") == 3
+        assert cache.get_id("http://sys/patient", "key3") == ("Patient", "3")
+
+    def test_resumed_harvests_store_the_spooled_ids(self, tmp_path):
+        checkpoint_dir = tmp_path / "checkpoints"
+        spooled = patients("1", "2")
+
+        class Client:
+            def iter_pages(self, query, checkpoint):
+                # As if an earlier run handled the first page before it died
+                checkpoint.spool_path.parent.mkdir(parents=True, exist_ok=True)
+                checkpoint.spool_path.write_text(json.dumps(spooled) + "\n")
+                yield page(patients("3"))
+
+        cache = RIdCache(checkpoint_dir=checkpoint_dir)
+        assert cache.load_ids_for_resource_type(Client(), "Patient") == 3
+        assert cache.get_id("http://sys/patient", "key1") == ("Patient", "1")
+        # Finished, so there is nothing left to resume
+        assert list(checkpoint_dir.iterdir()) == []
+
+
+class TestDuplicateTracking:
+    def make_cache(self, **kwargs):
+        cache = RIdCache(track_duplicates=True, **kwargs)
+        cache.store_id("Patient", "http://sys/patient", "key1", "id1")
+        cache.store_id("Patient", "http://sys/patient", "key1", "id2")
+        cache.store_id("Patient", "http://sys/patient", "key1", "id3")
+        cache.store_id("Patient", "http://sys/patient", "key2", "id4")
+        # The same resource harvested twice isn't a duplicate
+        cache.store_id("Patient", "http://sys/patient", "key2", "id4")
+        return cache
+
+    def test_every_duplicate_is_recorded(self):
+        cache = self.make_cache()
+        assert cache.duplicates == {
+            ("http://sys/patient", "key1"): ["Patient/id1", "Patient/id2", "Patient/id3"]
+        }
+
+    def test_duplicates_are_recorded_by_tiered_caches(self):
+        cache = self.make_cache(max_memory_ids=1)
+        assert list(cache.duplicates) == [("http://sys/patient", "key1")]
+        cache.close()
+
+    def test_duplicates_are_not_tracked_by_default(self):
+        cache = RIdCache()
+        cache.store_id("Patient", "http://sys/patient", "key1", "id1")
+        cache.store_id("Patient", "http://sys/patient", "key1", "id2")
+        assert cache.duplicates == {}
+
+    def test_write_duplicates(self, tmp_path):
+        cache = self.make_cache()
+        cache.write_duplicates(tmp_path / "dupes.tsv")
+
+        assert (tmp_path / "dupes.tsv").read_text().splitlines() == [
+            "system\tvalue\tcount\tresources",
+            "http://sys/patient\tkey1\t3\tPatient/id1,Patient/id2,Patient/id3",
+        ]
+
+    def test_report_duplicates(self, capsys):
+        self.make_cache().report_duplicates()
+        assert "Duplicate Identifiers: 1" in capsys.readouterr().out
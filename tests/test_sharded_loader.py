@@ -0,0 +1,72 @@
+import json
+
+from ncpi_fhir_client import sharded_loader
+from ncpi_fhir_client.ridcache import RIdCache
+from ncpi_fhir_client.sharded_loader import _load_shard, byte_ranges, load_sharded
+
+
+def make_cfg(url):
+    return {"auth_type": "auth_basic", "username": "u", "password": "p", "target_service_url": str(url)}
+
+
+def write_ndjson(path, count):
+    with open(path, "wt") as f:
+        for i in range(count):
+            resource = {
+                "resourceType": "Patient",
+                "identifier": [{"system": "http://sys/patient", "value": f"p{i}"}],
+            }
+            f.write(json.dumps(resource) + "\n")
+
+
+def test_every_line_is_loaded_once_and_new_ids_are_merged(fhir_server, tmp_path):
+    write_ndjson(tmp_path / "patients.ndjson", 9)
+
+    idcache = RIdCache()
+    # Already on the server, so it should be a PUT rather than a new resource
+    idcache._store_id("Patient", "http://sys/patient", "p4", "existing")
+
+    results = load_sharded(
+        make_cfg(fhir_server), [tmp_path / "patients.ndjson"], workers=2, idcache=idcache
+    )
+
+    assert len(results) == 2
+    assert sum(r.written for r in results) == 9
+    assert sum(r.failed for r in results) == 0
+    assert fhir_server.server.calls["POST"] == 8
+    assert fhir_server.server.calls["PUT"] == 1
+
+    assert idcache.get_id("http://sys/patient", "p4", "Patient") == "existing"
+    new_ids = {idcache.get_id("http://sys/patient", f"p{i}", "Patient") for i in range(9) if i != 4}
+    assert new_ids == {str(i) for i in range(1, 9)}
+
+
+def test_byte_ranges_give_each_line_to_one_shard(tmp_path, monkeypatch):
+    path = tmp_path / "patients.ndjson"
+    write_ndjson(path, 10)
+    with open(path, "at") as f:
+        # Blank lines and a last line without a newline
+        f.write("\n\n" + json.dumps({"resourceType": "Patient"}))
+
+    class Client:
+        idcache = None
+
+        def __init__(self):
+            self.posted = []
+
+        def post(self, resource_type, resource, identifier=None):
+            self.posted.append(resource.get("identifier", [{}])[0].get("value"))
+            return {"status_code": 201, "response": {}}
+
+        def close(self):
+            pass
+
+    for shard_count in (1, 3, 7, 40):
+        client = Client()
+        monkeypatch.setattr(sharded_loader, "_worker_client", client)
+        ranges = byte_ranges(path, shard_count)
+        assert len(ranges) == shard_count
+        written = sum(_load_shard(str(path), start, end).written for start, end in ranges)
+
+        assert written == 11
+        assert sorted(client.posted, key=str) == sorted([f"p{i}" for i in range(10)] + [None], key=str)
@@ -0,0 +1,75 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from ncpi_fhir_client.fhir_client import FhirClient
+
+THREAD_COUNT = 32
+REQUESTS_PER_THREAD = 10
+
+
+def make_client(fhir_server, tmp_path):
+    return FhirClient(
+        {
+            "auth_type": "auth_kf_openid",
+            "client_id": "id",
+            "client_secret": "secret",
+            "token_url": f"http://127.0.0.1:{fhir_server.server.server_port}/token",
+            "target_service_url": fhir_server,
+        },
+        cmdlog=tmp_path / "rest.log",
+    )
+
+
+def read_log_entries(path):
+    decoder = json.JSONDecoder()
+    text = path.read_text()
+    entries = []
+    position = 0
+    while position < len(text.strip()):
+        entry, position = decoder.raw_decode(text, position)
+        entries.append(entry)
+        while position < len(text) and text[position].isspace():
+            position += 1
+    return entries
+
+
+def test_many_threads_share_a_client(fhir_server, tmp_path):
+    client = make_client(fhir_server, tmp_path)
+    client.init_bundle(tmp_path / "bundle.json", "stress")
+
+    def work(thread_id):
+        for i in range(REQUESTS_PER_THREAD):
+            patient = {"resourceType": "Patient", "gender": "male"}
+            result = client.post("Patient", patient)
+            assert result["status_code"] == 201
+
+            created = result["response"]
+            client.write_to_bundle(created)
+            assert client.update("Patient", created["id"], created)["status_code"] == 200
+            assert client.get(f"Patient?identifier={thread_id}-{i}").success()
+            client.sleep_until(f"Patient?identifier={thread_id}-{i}", 0, count_only=True)
+
+    with ThreadPoolExecutor(max_workers=THREAD_COUNT) as executor:
+        for _ in executor.map(work, range(THREAD_COUNT)):
+            pass
+    client.close_bundle()
+    client.rest_log.close()
+
+    total = THREAD_COUNT * REQUESTS_PER_THREAD
+    calls = fhir_server.server.calls
+
+    # Only one of the threads should have refreshed the token
+    assert calls["token"] == 1
+    assert calls["POST"] == total
+    assert calls["PUT"] == total
+
+    bundle = json.loads((tmp_path / "bundle.json").read_text())
+    assert len(bundle["entry"]) == total
+    assert len({entry["fullUrl"] for entry in bundle["entry"]}) == total
+
+    log_entries = read_log_entries(tmp_path / "rest.log")
+    assert sorted(entry["method"] for entry in log_entries) == ["POST"] * total + ["PUT"] * total
+
+    # Every thread has its own session, but they all share the host's pool
+    stats = list(client.pool_stats().values())[0]
+    assert stats["new_connections"] <= client.pool_settings.pool_maxsize
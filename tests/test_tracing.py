@@ -0,0 +1,146 @@
+import json
+from contextlib import contextmanager
+
+import pytest
+
+from ncpi_fhir_client import tracing
+from ncpi_fhir_client.tracing import (
+    OpenTelemetryTracer,
+    RecordingTracer,
+    Tracer,
+    set_tracer,
+    span,
+)
+from tests.conftest import BASE_URL, make_response
+
+
+@pytest.fixture
+def tracer():
+    tracer = RecordingTracer()
+    set_tracer(tracer)
+    yield tracer
+    set_tracer(None)
+
+
+def by_name(tracer, name):
+    return [s for s in tracer.spans() if s.name == name]
+
+
+class TestSpans:
+    def test_nothing_is_recorded_without_a_tracer(self):
+        with span("send_request", {"http.method": "GET"}) as disabled:
+            disabled.set_attribute("http.status_code", 200)
+        assert disabled is tracing._no_span
+
+    def test_spans_nest(self, tracer):
+        with span("outer") as outer:
+            with span("inner", {"fhir.resource_type": "Patient"}) as inner:
+                inner.set_attribute("http.status_code", 200)
+
+        assert [s.name for s in tracer.spans()] == ["inner", "outer"]
+        assert inner.parent_id == outer.span_id
+        assert outer.parent_id is None
+        assert inner.attributes == {"fhir.resource_type": "Patient", "http.status_code": 200}
+        assert tracer.children(outer) == [inner]
+        assert outer.duration >= inner.duration >= 0
+
+    def test_errors_are_recorded(self, tracer):
+        with pytest.raises(ValueError):
+            with span("failing"):
+                raise ValueError("boom")
+        assert tracer.spans()[0].error == "ValueError('boom')"
+
+    def test_only_the_most_recent_spans_are_kept(self):
+        tracer = RecordingTracer(capacity=2)
+        set_tracer(tracer)
+        try:
+            for name in ("a", "b", "c"):
+                with span(name):
+                    pass
+        finally:
+            set_tracer(None)
+        assert [s.name for s in tracer.spans()] == ["b", "c"]
+
+    def test_tracers_must_provide_spans(self):
+        class Incomplete(Tracer):
+            pass
+
+        with pytest.raises(TypeError):
+            Incomplete()
+
+    def test_write(self, tracer, tmp_path):
+        with span("outer", {"fhir.resource_type": "Patient"}):
+            pass
+        tracer.write(tmp_path / "trace.ndjson")
+
+        lines = (tmp_path / "trace.ndjson").read_text().splitlines()
+        assert len(lines) == 1
+        assert json.loads(lines[0])["attributes"] == {"fhir.resource_type": "Patient"}
+
+
+class TestClientSpans:
+    def test_a_paged_get(self, tracer, client, monkeypatch):
+        pages = {
+            f"{BASE_URL}/Patient": {
+                "resourceType": "Bundle",
+                "entry": [{"resource": {"resourceType": "Patient", "id": "1"}}],
+                "link": [{"relation": "next", "url": f"{BASE_URL}/Patient?page=2"}],
+            },
+            f"{BASE_URL}/Patient?page=2": {
+                "resourceType": "Bundle",
+                "entry": [{"resource": {"resourceType": "Patient", "id": "2"}}],
+                "link": [],
+            },
+        }
+        monkeypatch.setattr(
+            client.session, "get", lambda url, **kwargs: make_response(200, pages[url], url)
+        )
+
+        client.get("Patient")
+        (get,) = by_name(tracer, "FhirClient.get")
+        assert get.attributes == {
+            "fhir.resource_type": "Patient",
+            "http.status_code": 200,
+            "fhir.entries": 2,
+        }
+
+        page_spans = tracer.children(get)
+        assert [(p.name, p.attributes["fhir.page"]) for p in page_spans] == [("page", 1), ("page", 2)]
+        (request,) = tracer.children(page_spans[1])
+        assert request.name == "send_request"
+        assert request.attributes["http.method"] == "GET"
+        assert request.attributes["http.status_code"] == 200
+        assert request.attributes["fhir.resource_type"] == "Patient"
+
+    def test_a_post(self, tracer, client, monkeypatch):
+        monkeypatch.setattr(
+            client.session,
+            "post",
+            lambda url, **kwargs: make_response(
+                201, {"resourceType": "Patient", "id": "1"}, url
+            ),
+        )
+        client.post("Patient", {"resourceType": "Patient"})
+
+        (post,) = by_name(tracer, "FhirClient.post")
+        assert post.attributes == {"fhir.resource_type": "Patient", "http.status_code": 201}
+        (request,) = tracer.children(post)
+        assert request.attributes["http.method"] == "POST"
+
+
+class TestOpenTelemetryTracer:
+    def test_spans_are_started_on_the_tracer_given(self):
+        started = []
+
+        class Tracer:
+            @contextmanager
+            def start_as_current_span(self, name, attributes):
+                started.append((name, attributes))
+                yield None
+
+        with OpenTelemetryTracer(Tracer()).span(
+            "send_request", {"http.method": "GET", "fhir.resource_type": None}
+        ):
+            pass
+        # Attributes without a value are left off
+        assert started == [("send_request", {"http.method": "GET"})]
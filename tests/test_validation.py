@@ -0,0 +1,134 @@
+import json
+
+from ncpi_fhir_client.validation import ValidationCache, ValidationPipeline, read_resources
+
+BASE_URL = "http://example.org/fhir"
+PROFILE = "http://example.org/StructureDefinition/study-patient"
+
+
+class StubClient:
+    """Responds to $validate with an error for any resource whose gender is 'bogus'"""
+
+    target_service_url = BASE_URL
+
+    def __init__(self):
+        self.requests = []
+
+    def send_request(self, method, url, json=None):
+        self.requests.append((method, url, json))
+        if json.get("gender") == "bogus":
+            issue = {"severity": "error", "diagnostics": "Unknown gender"}
+            status_code = 412
+        else:
+            issue = {"severity": "information", "diagnostics": "All OK"}
+            status_code = 200
+        response = {"resourceType": "OperationOutcome", "issue": [issue]}
+        return (status_code == 200, {"status_code": status_code, "response": response})
+
+
+def patient(id, gender="male", profile=PROFILE):
+    resource = {"resourceType": "Patient", "id": id, "gender": gender}
+    if profile is not None:
+        resource["meta"] = {"profile": [profile]}
+    return ("Patient", resource)
+
+
+def test_outcomes_are_reported():
+    client = StubClient()
+    results = list(ValidationPipeline(client).validate([patient("1"), patient("2", "bogus")]))
+
+    assert {result.id: result.valid for result in results} == {"1": True, "2": False}
+    assert [issue["diagnostics"] for result in results for issue in result.errors()] == [
+        "Unknown gender"
+    ]
+    assert all(url == f"{BASE_URL}/Patient/$validate?profile={PROFILE}" for _, url, _ in client.requests)
+
+
+def test_requests_are_grouped_by_profile():
+    client = StubClient()
+    resources = [patient("1"), patient("2", profile=None), patient("3"), patient("4", profile=None)]
+    list(ValidationPipeline(client, max_workers=1).validate(resources))
+
+    assert [body["id"] for _, _, body in client.requests] == ["2", "4", "1", "3"]
+
+
+def test_batches_are_sent_before_the_input_is_exhausted():
+    client = StubClient()
+    read = []
+
+    def resources():
+        for id in range(10):
+            read.append(id)
+            yield patient(str(id), profile=None if id % 2 else PROFILE)
+
+    pipeline = ValidationPipeline(client, max_workers=1, batch_size=2, max_buffered=3)
+    results = pipeline.validate(resources())
+    # The first batch of two is sent after reading three resources
+    assert next(results).id == "0"
+    assert read == [0, 1, 2]
+
+    assert sorted(int(result.id) for result in [*results]) == list(range(1, 10))
+    assert len(client.requests) == 10
+
+
+def test_buffered_groups_are_all_sent_at_the_limit():
+    client = StubClient()
+    resources = [patient("1"), patient("2", profile=None), patient("3")]
+    pipeline = ValidationPipeline(client, max_workers=1, batch_size=10, max_buffered=2)
+    list(pipeline.validate(resources))
+
+    assert [body["id"] for _, _, body in client.requests] == ["2", "1", "3"]
+
+
+def test_unchanged_resources_are_not_revalidated(tmp_path):
+    client = StubClient()
+    cache = ValidationCache(tmp_path / "outcomes")
+    list(ValidationPipeline(client, cache=cache).validate([patient("1"), patient("2", "bogus")]))
+    cache.close()
+
+    client = StubClient()
+    cache = ValidationCache(tmp_path / "outcomes")
+    results = list(
+        ValidationPipeline(client, cache=cache).validate(
+            [patient("1"), patient("2", "bogus"), patient("3")]
+        )
+    )
+
+    assert [body["id"] for _, _, body in client.requests] == ["3"]
+    assert {result.id: (result.valid, result.cached) for result in results} == {
+        "1": (True, True),
+        "2": (False, True),
+        "3": (True, False),
+    }
+
+
+def test_a_different_profile_is_validated_again():
+    client = StubClient()
+    pipeline = ValidationPipeline(client)
+    list(pipeline.validate([patient("1")]))
+    list(pipeline.validate([patient("1", profile="http://example.org/other")]))
+
+    assert len(client.requests) == 2
+
+
+def test_server_errors_are_not_cached():
+    class FailingClient(StubClient):
+        def send_request(self, method, url, json=None):
+            self.requests.append((method, url, json))
+            return (False, {"status_code": 503, "response": "Service Unavailable"})
+
+    client = FailingClient()
+    pipeline = ValidationPipeline(client)
+    results = list(pipeline.validate([patient("1")]))
+
+    assert results[0].valid is False
+    assert len(pipeline.cache) == 0
+
+
+def test_read_resources(tmp_path):
+    (tmp_path / "patients.ndjson").write_text(json.dumps(patient("1")[1]) + "\n\n")
+    bundle = {"resourceType": "Bundle", "entry": [{"resource": patient("2")[1]}]}
+    (tmp_path / "bundle.json").write_text(json.dumps(bundle))
+
+    assert [r["id"] for _, r in read_resources(tmp_path / "patients.ndjson")] == ["1"]
+    assert [r["id"] for _, r in read_resources(tmp_path / "bundle.json")] == ["2"]
@@ -0,0 +1,62 @@
+from ncpi_fhir_client.change_detection import resource_hash
+from ncpi_fhir_client.write_journal import WriteJournal, journal_key
+
+
+def patient(value="p1", **extra):
+    return dict(
+        {"resourceType": "Patient", "identifier": [{"system": "http://sys/patient", "value": value}]},
+        **extra,
+    )
+
+
+def test_keys_prefer_the_identifier():
+    assert journal_key("Patient", patient(id="1")) == "Patient?http://sys/patient|p1"
+    assert journal_key("Patient", {"id": "1"}) == "Patient/1"
+    assert journal_key("Patient", {"identifier": []}) is None
+
+
+def test_successful_writes_are_covered_across_runs(tmp_path):
+    journal = WriteJournal(tmp_path / "writes")
+    journal.record("Patient", patient("p1"), "1", 201)
+    journal.record("Patient", patient("p2"), None, 422)
+    journal.close()
+
+    journal = WriteJournal(tmp_path / "writes")
+    assert journal.written_id("Patient", patient("p1")) == "1"
+    # Failed writes and changed content have to be sent again
+    assert journal.written_id("Patient", patient("p2")) is None
+    assert journal.written_id("Patient", patient("p1", gender="male")) is None
+    assert journal.skipped_count == 1
+
+
+def test_partial_lines_from_a_crash_are_ignored(tmp_path):
+    journal = WriteJournal(tmp_path / "writes")
+    journal.record("Patient", patient("p1"), "1", 201)
+    journal.close()
+    with (tmp_path / "writes").open("at") as f:
+        f.write("Patient?http://sys/patient|p2\tabc")
+
+    assert len(WriteJournal(tmp_path / "writes")) == 1
+
+
+def test_compact_keeps_the_latest_line(tmp_path):
+    journal = WriteJournal(tmp_path / "writes", sync_every=1)
+    journal.record("Patient", patient("p1"), "1", 500)
+    journal.record("Patient", patient("p1"), "1", 200)
+    journal.compact()
+
+    assert len((tmp_path / "writes").read_text().splitlines()) == 1
+    assert WriteJournal(tmp_path / "writes").written_id("Patient", patient("p1")) == "1"
+
+
+def test_writes_without_an_id_are_not_covered(tmp_path):
+    journal = WriteJournal(tmp_path / "writes")
+    journal.record("Patient", patient("p1"), None, 200)
+    journal.close()
+    # As an older journal might have recorded it
+    with (tmp_path / "writes").open("at") as f:
+        f.write(f"Patient?http://sys/patient|p2\t{resource_hash(patient('p2'))}\t\t200\n")
+
+    journal = WriteJournal(tmp_path / "writes")
+    assert journal.written_id("Patient", patient("p1")) is None
+    assert journal.written_id("Patient", patient("p2")) is None